@@ -0,0 +1,77 @@
+# accounts/cache.py
+"""
+User fields and social providers read through the shared cache (see
+rbackend/cache.py) instead of PostgreSQL on every authenticated request and
+rendered page.
+
+Entries are dropped by the CustomUser and SocialAccount save and delete
+signals (accounts/signals.py), again once the change commits. That reaches
+every worker only through a shared backend, which is why settings.py refuses
+locmem with more than one. The TTLs bound how long a change made without
+signals, such as QuerySet.update(), stays unseen; the user TTL is short since
+it also delays deactivations.
+
+Users are cached as USER_FIELDS only, never their password hash: an md5 of
+it stands in for the token revocation check (accounts/authentication.py),
+and reading any other field of a cached user loads it from the database.
+"""
+from django.contrib.auth import get_user_model
+from django.db import router
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from rbackend.cache import cached, stats
+
+USER_TTL = 60
+SOCIAL_PROVIDERS_TTL = 3600
+USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser',
+               'user_group', 'activity_date', 'last_login', 'date_joined')
+
+stats.track('user', 'social_providers')
+
+
+def user_key(user_id):
+    return f'accounts:user-fields:{user_id}'
+
+
+def social_providers_key(user_id):
+    return f'accounts:social-providers:{user_id}'
+
+
+def load_user_fields(user_id):
+    """
+    {field: value} of USER_FIELDS of the user, with the md5 of their
+    password hash as ``password_md5``, or None.
+    """
+    fields = get_user_model().objects.filter(pk=user_id).values(*USER_FIELDS, 'password').first()
+    if fields is not None:
+        fields['password_md5'] = get_md5_hash_password(fields.pop('password'))
+    return fields
+
+
+def cached_user(user_id):
+    """
+    The user with primary key ``user_id``, or None. Fields other than
+    USER_FIELDS are deferred.
+    """
+    fields = cached('user', user_key(user_id), USER_TTL, lambda: load_user_fields(user_id))
+    if fields is None:
+        return None
+    fields = dict(fields)
+    password_md5 = fields.pop('password_md5')
+    User = get_user_model()
+    # from_db() takes the values in the model's field order
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in fields]
+    user = User.from_db(router.db_for_read(User), names, [fields[name] for name in names])
+    user.password_md5 = password_md5
+    return user
+
+
+def social_providers(user):
+    """
+    The providers of the user's social accounts, oldest first.
+    """
+    from allauth.socialaccount.models import SocialAccount
+
+    return cached('social_providers', social_providers_key(user.pk), SOCIAL_PROVIDERS_TTL,
+                  lambda: list(SocialAccount.objects.filter(user_id=user.pk).order_by('pk').values_list(
+                      'provider', flat=True)))
@@ -1,4 +1,4 @@
-from allauth.socialaccount.models import SocialAccount
+from .cache import social_providers
 
 def is_google_user(user):
     """
@@ -7,7 +7,7 @@ def is_google_user(user):
     """
     if not user or user.is_anonymous:
         return False
-    return SocialAccount.objects.filter(user=user, provider='google').exists()
+    return 'google' in social_providers(user)
 
 def get_social_provider(user):
     """
@@ -16,8 +16,8 @@ def get_social_provider(user):
     """
     if not user or user.is_anonymous:
         return None
-    social_account = SocialAccount.objects.filter(user=user).first()
-    return social_account.provider if social_account else None
+    providers = social_providers(user)
+    return providers[0] if providers else None
 
 def get_user_registration_method(user):
     """
@@ -26,8 +26,8 @@ def get_user_registration_method(user):
     """
     if not user or user.is_anonymous:
         return None
-    social_account = SocialAccount.objects.filter(user=user).first()
-    return social_account.provider if social_account else 'email'
+    providers = social_providers(user)
+    return providers[0] if providers else 'email'
 
 # def user_registration_info(request):
 #     """
@@ -55,20 +55,17 @@ def user_registration_info(request):
         try:
             # Check if SocialAccount model is available
             if apps.is_installed('allauth.socialaccount'):
-                from allauth.socialaccount.models import SocialAccount
-                
-                user = request.user
+                # One cached lookup (accounts/cache.py) for the three values
+                providers = social_providers(request.user)
                 
                 # Check if Google user
-                is_google = SocialAccount.objects.filter(user=user, provider='google').exists()
-                context['is_google_user'] = is_google
+                context['is_google_user'] = 'google' in providers
                 
                 # Get social provider
-                social_account = SocialAccount.objects.filter(user=user).first()
-                context['social_provider'] = social_account.provider if social_account else None
+                context['social_provider'] = providers[0] if providers else None
                 
                 # Get registration method
-                context['registration_method'] = social_account.provider if social_account else 'email'
+                context['registration_method'] = providers[0] if providers else 'email'
             else:
                 # Fallback if allauth is not available
                 context['is_google_user'] = False
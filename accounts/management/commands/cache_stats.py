@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rbackend.cache import stats
+
+
+class Command(BaseCommand):
+    help = 'Hit and miss counts of the shared cache tier per kind of entry (rbackend/cache.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        backend = settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1]
+        self.stdout.write(f"Backend: {backend} ({settings.CACHES['default'].get('LOCATION', '')})")
+        if backend == 'LocMemCache':
+            self.stdout.write("A per-process backend: only this command's own reads are counted")
+        for kind, counts in stats.read().items():
+            total = counts['hits'] + counts['misses']
+            rate = f"{counts['hits'] / total * 100:.1f}%" if total else '-'
+            self.stdout.write(f"{kind}: {counts['hits']} hits, {counts['misses']} misses, hit rate {rate}")
+        if options['reset']:
+            stats.reset()
+            self.stdout.write("Counters reset")
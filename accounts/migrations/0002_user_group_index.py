@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='user_group',
+            field=models.CharField(blank=True, db_index=True, help_text='User group (15 characters max)', max_length=15),
+        ),
+    ]
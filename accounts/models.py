@@ -8,7 +8,7 @@ class CustomUser(AbstractUser):
     # Custom fields
     phone_number = models.CharField(max_length=15, blank=True)
     profile_picture = models.ImageField(upload_to='profiles/', blank=True)
-    user_group = models.CharField(max_length=15, blank=True, help_text="User group (15 characters max)")
+    user_group = models.CharField(max_length=15, blank=True, db_index=True, help_text="User group (15 characters max)")
     activity_date = models.DateField(null=True, blank=True, help_text="Date of current activity")
     
     # Fix reverse accessor clashes
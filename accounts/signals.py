@@ -1,10 +1,15 @@
 # accounts/signals.py
+from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import pre_delete
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.contrib.auth.models import User
 from allauth.account.models import EmailAddress
+from allauth.socialaccount.models import SocialAccount
 from django.contrib.auth.signals import user_logged_in
 from django.contrib import messages
+from rbackend.cache import invalidate
+from .cache import social_providers_key, user_key
 
 @receiver(user_logged_in)
 def user_logged_in_callback(sender, request, user, **kwargs):
@@ -16,4 +21,23 @@ def user_logged_in_callback(sender, request, user, **kwargs):
 @receiver(pre_delete, sender=User)
 def delete_allauth_email_addresses(sender, instance, **kwargs):
     """Delete AllAuth email addresses when a user is deleted"""
-    EmailAddress.objects.filter(user=instance).delete()
\ No newline at end of file
+    EmailAddress.objects.filter(user=instance).delete()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached user row (accounts/cache.py) when it changes"""
+    keys = (user_key(instance.pk), social_providers_key(instance.pk))
+    invalidate(*keys)
+    # Again once committed: a read in between may have cached the old row
+    transaction.on_commit(lambda: invalidate(*keys))
+
+
+@receiver(post_save, sender=SocialAccount)
+@receiver(post_delete, sender=SocialAccount)
+def invalidate_cached_social_providers(sender, instance, **kwargs):
+    """Drop the cached social providers of the account's user"""
+    key = social_providers_key(instance.user_id)
+    invalidate(key)
+    transaction.on_commit(lambda: invalidate(key))
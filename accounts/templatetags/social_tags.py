@@ -1,5 +1,5 @@
 from django import template
-from allauth.socialaccount.models import SocialAccount
+from accounts.cache import social_providers
 
 register = template.Library()
 
@@ -11,7 +11,7 @@ def is_google_user(user):
     """
     if not user or user.is_anonymous:
         return False
-    return SocialAccount.objects.filter(user=user, provider='google').exists()
+    return 'google' in social_providers(user)
 
 @register.filter
 def social_provider(user):
@@ -21,8 +21,8 @@ def social_provider(user):
     """
     if not user or user.is_anonymous:
         return 'email'
-    social_account = SocialAccount.objects.filter(user=user).first()
-    return social_account.provider if social_account else 'email'
+    providers = social_providers(user)
+    return providers[0] if providers else 'email'
 
 @register.simple_tag
 def get_registration_badge(user):
@@ -33,10 +33,10 @@ def get_registration_badge(user):
     if not user or user.is_anonymous:
         return ''
     
-    social_account = SocialAccount.objects.filter(user=user).first()
+    providers = social_providers(user)
     
-    if social_account:
-        provider = social_account.provider
+    if providers:
+        provider = providers[0]
         if provider == 'google':
             return '<span class="badge bg-danger">Google</span>'
         elif provider == 'github':
@@ -1,3 +1,268 @@
-from django.test import TestCase
+import io
+import multiprocessing
+import os
+import shutil
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from allauth.socialaccount.models import SocialAccount
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from rbackend.cache import LockedFileBasedCache, stats
+
+from .cache import cached_user, social_providers, user_key
+
+try:
+    import redis
+except ImportError:
+    redis = None
+from .utils import get_user_registration_method, is_google_user
+
+
+class CachedReadsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        stats.reset()
+        self.user = get_user_model().objects.create_user(username='walker', password='pass1234')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_token_user_is_read_through_the_cache_until_saved(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/gpslocations/ingest-stats/').status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/gpslocations/ingest-stats/').status_code, 200)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/gpslocations/ingest-stats/').status_code, 401)
+
+    def test_cached_users_leave_the_password_hash_out(self):
+        user = cached_user(self.user.pk)
+        self.assertNotIn('password', cache.get(user_key(self.user.pk)))
+        self.assertEqual((user.username, user.is_active), ('walker', True))
+        self.assertEqual(user.get_deferred_fields(), {'password', 'phone_number', 'profile_picture'})
+
+        # Tokens issued before a password change are still refused
+        with mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+            self.assertEqual(self.client.get('/api/gpslocations/ingest-stats/').status_code, 200)
+            self.user.set_password('changed5678')
+            self.user.save()
+            self.assertEqual(self.client.get('/api/gpslocations/ingest-stats/').status_code, 401)
+
+    def test_social_providers_follow_social_account_changes(self):
+        self.assertEqual(get_user_registration_method(self.user), 'email')
+        account = SocialAccount.objects.create(user=self.user, provider='google', uid='1')
+        with self.assertNumQueries(1):
+            self.assertTrue(is_google_user(self.user))
+            self.assertEqual(get_user_registration_method(self.user), 'google')
+        account.delete()
+        self.assertEqual(social_providers(self.user), [])
+
+        out = io.StringIO()
+        call_command('cache_stats', '--reset', stdout=out)
+        self.assertIn('social_providers: 1 hits, 3 misses', out.getvalue())
+
+
+class RedisStandIn(socketserver.ThreadingTCPServer):
+    """
+    A local server speaking the part of the Redis protocol that Django's
+    RedisCache uses, so the redis backend can be tested without redis-server.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RedisStandInHandler)
+        self.data = {}
+        self.expiry = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'redis://127.0.0.1:{self.server_address[1]}/1'
+
+    def live(self, key):
+        if key in self.expiry and self.expiry[key] <= time.monotonic():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.data
+
+    def execute(self, name, args):
+        with self.lock:
+            if name in ('PING',):
+                return 'PONG'
+            if name in ('SELECT', 'CLIENT', 'FLUSHDB'):
+                if name == 'FLUSHDB':
+                    self.data.clear()
+                    self.expiry.clear()
+                return 'OK'
+            if name == 'GET':
+                return self.data[args[0]] if self.live(args[0]) else None
+            if name == 'MGET':
+                return [self.data[key] if self.live(key) else None for key in args]
+            if name == 'SET':
+                key, value, options = args[0], args[1], [option.upper() for option in args[2:]]
+                if b'NX' in options and self.live(key):
+                    return None
+                self.data[key] = value
+                self.expiry.pop(key, None)
+                if b'EX' in options:
+                    self.expiry[key] = time.monotonic() + int(options[options.index(b'EX') + 1])
+                return 'OK'
+            if name == 'MSET':
+                for key, value in zip(args[::2], args[1::2]):
+                    self.data[key] = value
+                    self.expiry.pop(key, None)
+                return 'OK'
+            if name == 'EXPIRE':
+                if not self.live(args[0]):
+                    return 0
+                self.expiry[args[0]] = time.monotonic() + int(args[1])
+                return 1
+            if name == 'PERSIST':
+                return int(self.live(args[0]) and self.expiry.pop(args[0], None) is not None)
+            if name == 'EXISTS':
+                return sum(self.live(key) for key in args)
+            if name == 'DEL':
+                count = sum(self.live(key) for key in args)
+                for key in args:
+                    self.data.pop(key, None)
+                    self.expiry.pop(key, None)
+                return count
+            if name in ('INCRBY', 'DECRBY'):
+                value = int(self.data[args[0]]) if self.live(args[0]) else 0
+                value += int(args[1]) if name == 'INCRBY' else -int(args[1])
+                self.data[args[0]] = str(value).encode()
+                return value
+            return Exception(f'unknown command {name}')
+
+
+class RedisStandInHandler(socketserver.StreamRequestHandler):
+    protocol = 2
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def encode(self, reply):
+        if reply is None:
+            return b'_\r\n' if self.protocol == 3 else b'$-1\r\n'
+        if isinstance(reply, Exception):
+            return f'-ERR {reply}\r\n'.encode()
+        if isinstance(reply, str):
+            return f'+{reply}\r\n'.encode()
+        if isinstance(reply, int):
+            return f':{reply}\r\n'.encode()
+        if isinstance(reply, dict):
+            return f'%{len(reply)}\r\n'.encode() + b''.join(
+                self.encode(key) + self.encode(value) for key, value in reply.items())
+        if isinstance(reply, list):
+            return f'*{len(reply)}\r\n'.encode() + b''.join(self.encode(item) for item in reply)
+        return f'${len(reply)}\r\n'.encode() + reply + b'\r\n'
+
+    def handle(self):
+        queued = None
+        while (args := self.read_command()) is not None:
+            name = args[0].decode().upper()
+            if name == 'HELLO':
+                # redis-py 5 and later ask for RESP3, whose null differs
+                self.protocol = int(args[1]) if len(args) > 1 else self.protocol
+                reply = {b'server': b'stand-in', b'proto': self.protocol}
+            elif name == 'MULTI':
+                queued, reply = [], 'OK'
+            elif name == 'EXEC':
+                reply, queued = [self.server.execute(*command) for command in queued], None
+            elif queued is not None:
+                queued.append((name, args[1:]))
+                reply = 'QUEUED'
+            else:
+                reply = self.server.execute(name, args[1:])
+            self.wfile.write(self.encode(reply))
+
+
+def increment_file_counter(directory, times):
+    counter = LockedFileBasedCache(directory, {})
+    for _ in range(times):
+        counter.incr('hits')
+
+
+class SharedCacheBackendTests(TestCase):
+    @skipUnless(redis, 'needs the redis package')
+    def test_redis_backend_shares_entries_and_invalidations(self):
+        server = RedisStandIn()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        backend = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': server.url,
+                   'KEY_PREFIX': 'geostar'}
+        with override_settings(CACHES={'default': backend}):
+            stats.reset()
+            user = get_user_model().objects.create_user(username='roamer', password='pass1234')
+            # Another worker's connection to the same server
+            other = caches.create_connection('default')
+            self.assertEqual(cached_user(user.pk), user)
+            self.assertEqual(other.get(user_key(user.pk))['username'], 'roamer')
+
+            user.is_active = False
+            user.save()
+            self.assertIsNone(other.get(user_key(user.pk)))
+            self.assertFalse(cached_user(user.pk).is_active)
+
+            stats.flush()
+            self.assertEqual(other.get('cache-stats:user:misses'), 2)
+            self.assertEqual(other.incr('cache-stats:user:misses', 3), 5)
+            self.assertTrue(other.add('counter', 1, timeout=None))
+            self.assertFalse(other.add('counter', 2))
+            other.set_many({'a': 1, 'b': 2}, timeout=60)
+            self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+            stats.reset()
+
+    def test_file_backend_counts_concurrent_increments(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        counter = LockedFileBasedCache(directory, {})
+        self.assertTrue(counter.add('hits', 0, timeout=None))
+        workers = [multiprocessing.get_context('fork').Process(target=increment_file_counter, args=(directory, 100))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(counter.get('hits'), 400)
+        # Still without expiry, instead of the default timeout set() would give it
+        self.assertIsNone(counter._remaining('hits', None))
+
+    def load_settings(self, **env):
+        env = dict({key: value for key, value in os.environ.items()
+                    if key not in ('CACHE_BACKEND', 'WEB_CONCURRENCY', 'DEBUG')}, **env)
+        return subprocess.run([sys.executable, '-c', 'from rbackend import settings; print(settings.CACHE_BACKEND)'],
+                              cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+
+    def test_locmem_is_refused_unless_one_worker_is_certain(self):
+        for env in ({'CACHE_BACKEND': 'locmem', 'WEB_CONCURRENCY': '4'},
+                    {'CACHE_BACKEND': 'locmem', 'DEBUG': 'False'}):
+            result = self.load_settings(**env)
+            self.assertNotEqual(result.returncode, 0, env)
+            self.assertIn('ImproperlyConfigured', result.stderr)
+        self.assertEqual(self.load_settings(CACHE_BACKEND='locmem', DEBUG='False', WEB_CONCURRENCY='1').stdout, 'locmem\n')
+        self.assertEqual(self.load_settings(DEBUG='False').stdout, 'file\n')
+        self.assertEqual(self.load_settings(DEBUG='True').stdout, 'locmem\n')
@@ -1,4 +1,4 @@
-from allauth.socialaccount.models import SocialAccount
+from .cache import social_providers
 
 def is_google_user(user):
     """
@@ -7,7 +7,7 @@ def is_google_user(user):
     """
     if not user or user.is_anonymous:
         return False
-    return SocialAccount.objects.filter(user=user, provider='google').exists()
+    return 'google' in social_providers(user)
 
 def get_social_provider(user):
     """
@@ -16,8 +16,8 @@ def get_social_provider(user):
     """
     if not user or user.is_anonymous:
         return None
-    social_account = SocialAccount.objects.filter(user=user).first()
-    return social_account.provider if social_account else None
+    providers = social_providers(user)
+    return providers[0] if providers else None
 
 def get_user_registration_method(user):
     """
@@ -26,5 +26,5 @@ def get_user_registration_method(user):
     """
     if not user or user.is_anonymous:
         return None
-    social_account = SocialAccount.objects.filter(user=user).first()
-    return social_account.provider if social_account else 'email'
\ No newline at end of file
+    providers = social_providers(user)
+    return providers[0] if providers else 'email'
\ No newline at end of file
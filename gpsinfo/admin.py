@@ -24,7 +24,7 @@ class GPSLatestAdmin(admin.ModelAdmin):
 
 @admin.register(GPSLocation)
 class GPSLocationAdmin(admin.ModelAdmin):
-    list_display = ('get_username', 'formatted_timestamp', 'latitude', 'longitude', 'altitude', 'accuracy')
+    list_display = ('get_username', 'formatted_timestamp', 'captured_at', 'latitude', 'longitude', 'altitude', 'accuracy')
     list_filter = ('timestamp', 'user')
     search_fields = ('user__username', 'user__email')
     readonly_fields = ('timestamp',)
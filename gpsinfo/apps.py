@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class GpsinfoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gpsinfo'
+
+    def ready(self):
+        import gpsinfo.signals
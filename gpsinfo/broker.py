@@ -0,0 +1,304 @@
+# gpsinfo/broker.py
+"""
+Publish/subscribe of live latest positions, between the write path and the
+live connections (the SSE stream in stream.py and the WebSocket channel in
+websocket.py).
+
+The write path publishes every committed batch once, already serialized, from
+whichever thread committed it (see signals.py). Subscriptions belong to the
+asyncio event loop of the ASGI server and to scopes (all, group:<g>,
+user:<name>, as in versions.py). GPSINFO['LIVE_BROKER'] names the LiveBroker
+class in use; InMemoryBroker reaches the subscribers of its own process only.
+
+InMemoryBroker hands a batch to each event loop with a single
+call_soon_threadsafe and fans it out there.
+Each scope is a topic holding the newest event per user, and a subscription
+is only a cursor into its topics. Dispatch costs one update per event; a
+ticker per loop then wakes each subscription with news at most once per
+flush interval, and it takes every user's newest event since its last read,
+so a slow client loses stale intermediate positions instead of growing a
+queue. A topic keeps at most ``max_pending`` users; a
+subscription that falls further behind is marked overflowed and resyncs from
+the database.
+"""
+import asyncio
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.utils.module_loading import import_string
+
+from .conf import gps_setting
+from .versions import SCOPE_ALL, group_scope, user_scope
+
+# kind is 'position' or 'remove'; data is the JSON text sent to clients
+LatestEvent = namedtuple('LatestEvent', ['kind', 'username', 'scopes', 'data'])
+
+
+def position_events(rows, members):
+    """
+    Events for committed GPSLatest rows (dicts from ingest.latest_row), given
+    {user_id: (username, user_group)}; users no longer present are skipped.
+    """
+    from django.contrib.auth import get_user_model
+
+    from .models import GPSLatest
+    from .serializers import GPSLatestSerializer
+
+    User = get_user_model()
+    rows = [row for row in rows if row['user_id'] in members]
+    instances = [
+        GPSLatest(user=User(pk=row['user_id'], username=members[row['user_id']][0]),
+                  **{name: row[name] for name in ('latitude', 'longitude', 'timestamp', 'altitude', 'accuracy')})
+        for row in rows
+    ]
+    events = []
+    for row, data in zip(rows, GPSLatestSerializer(instances, many=True).data):
+        username, group = members[row['user_id']]
+        scopes = [SCOPE_ALL, user_scope(username)] + ([group_scope(group)] if group else [])
+        events.append(LatestEvent('position', username, tuple(scopes), json.dumps(data, separators=(',', ':'))))
+    return events
+
+
+def remove_event(username, scopes):
+    return LatestEvent('remove', username, tuple(scopes), json.dumps({'username': username}, separators=(',', ':')))
+
+
+class Topic:
+    """
+    The newest event per user published in one scope, oldest first, each
+    numbered by its position in the scope's publish order. At most
+    ``max_size`` users are kept; ``floor`` is the number of the newest event
+    evicted, which subscriptions older than it can no longer catch up from.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.events = OrderedDict()
+        self.seq = 0
+        self.floor = 0
+        self.subscriptions = set()
+
+    def add(self, event):
+        self.seq += 1
+        self.events.pop(event.username, None)
+        self.events[event.username] = (self.seq, event)
+
+    def trim(self):
+        while len(self.events) > self.max_size:
+            _, (self.floor, _) = self.events.popitem(last=False)
+
+    def since(self, seq):
+        """
+        Events numbered after ``seq``, oldest first.
+        """
+        found = []
+        for number, event in reversed(self.events.values()):
+            if number <= seq:
+                break
+            found.append(event)
+        found.reverse()
+        return found
+
+
+class Subscription:
+    """
+    One viewer's position in each of its scopes' topics. Reading takes every
+    user's newest event since the last read, so updates a slow reader did
+    not get to are coalesced away.
+    """
+
+    def __init__(self, broker, loop, topics):
+        self.broker = broker
+        self.loop = loop
+        self.cursors = {topic: topic.seq for topic in topics}
+        self.overflowed = False
+        self._ready = asyncio.Event()
+
+    def notify(self):
+        self._ready.set()
+
+    async def get(self):
+        """
+        Wait for the next tick with events for this subscription, or the next
+        heartbeat, and take the events; an empty list means a heartbeat or
+        that the subscription overflowed.
+        """
+        await self._ready.wait()
+        self._ready.clear()
+        events = []
+        for topic, seq in self.cursors.items():
+            if seq < topic.floor:
+                self.overflowed = True
+            events += topic.since(seq)
+            self.cursors[topic] = topic.seq
+        return [] if self.overflowed else events
+
+    def resynced(self):
+        self.overflowed = False
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LoopTopics:
+    """
+    The topics of one event loop, and its ticker: every ``flush_s`` seconds
+    the subscriptions of topics that received events are woken once, and
+    every ``heartbeat_s`` seconds all of them are.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.topics = {}
+        self.dirty = set()
+        self.ticker = None
+        self.last_heartbeat = loop.time()
+
+
+class LiveBroker:
+    """
+    Interface of a broker. publish() may be called from any thread;
+    subscribe() is called on the subscriber's event loop and returns a
+    Subscription, whose close() calls unsubscribe() on the same loop.
+    len(broker) is the number of local subscriptions.
+    """
+
+    def listening(self):
+        """
+        Whether published events can reach anyone; the write path skips
+        building events otherwise.
+        """
+        return True
+
+    def publish(self, events):
+        raise NotImplementedError
+
+    def subscribe(self, scopes):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class InMemoryBroker(LiveBroker):
+    """
+    Topics per event loop and scope, within one process. Topics are only
+    touched on their loop.
+    """
+
+    def __init__(self, max_pending=None, flush_s=None, heartbeat_s=None):
+        self.max_pending = max_pending or gps_setting('STREAM_MAX_PENDING')
+        self.flush_s = flush_s or gps_setting('STREAM_FLUSH_MS') / 1000.0
+        self.heartbeat_s = heartbeat_s or gps_setting('STREAM_HEARTBEAT_S')
+        self._loops = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def listening(self):
+        return self._count > 0
+
+    def subscribe(self, scopes):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loops.get(loop)
+            if state is None:
+                state = self._loops[loop] = LoopTopics(loop)
+                state.ticker = loop.call_later(self.flush_s, self._tick, state)
+            subscribed = [state.topics.setdefault(scope, Topic(self.max_pending)) for scope in dict.fromkeys(scopes)]
+            self._count += 1
+        subscription = Subscription(self, loop, subscribed)
+        for topic in subscribed:
+            topic.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._count -= 1
+            state = self._loops.get(subscription.loop)
+            if state is None:
+                return
+            for scope, topic in list(state.topics.items()):
+                topic.subscriptions.discard(subscription)
+                if not topic.subscriptions:
+                    del state.topics[scope]
+                    state.dirty.discard(topic)
+            if not state.topics:
+                state.ticker.cancel()
+                del self._loops[subscription.loop]
+
+    def publish(self, events):
+        if not events:
+            return
+        with self._lock:
+            states = list(self._loops.values())
+        for state in states:
+            try:
+                state.loop.call_soon_threadsafe(self._dispatch, state, events)
+            except RuntimeError:
+                # Loop closed without its subscriptions being closed
+                with self._lock:
+                    self._loops.pop(state.loop, None)
+
+    def resync(self):
+        """
+        Send every subscription back to the database, after events may have
+        been lost.
+        """
+        with self._lock:
+            states = list(self._loops.values())
+        for state in states:
+            try:
+                state.loop.call_soon_threadsafe(self._resync, state)
+            except RuntimeError:
+                pass
+
+    def _resync(self, state):
+        for topic in state.topics.values():
+            for subscription in topic.subscriptions:
+                subscription.overflowed = True
+                subscription.notify()
+
+    def _dispatch(self, state, events):
+        topics = state.topics
+        for event in events:
+            for scope in event.scopes:
+                topic = topics.get(scope)
+                if topic is not None:
+                    topic.add(event)
+                    state.dirty.add(topic)
+
+    def _tick(self, state):
+        if self._loops.get(state.loop) is not state:
+            return
+        now = state.loop.time()
+        if now - state.last_heartbeat >= self.heartbeat_s:
+            state.last_heartbeat = now
+            woken = {sub for topic in state.topics.values() for sub in topic.subscriptions}
+        else:
+            woken = {sub for topic in state.dirty for sub in topic.subscriptions}
+        for topic in state.dirty:
+            topic.trim()
+        state.dirty.clear()
+        for subscription in woken:
+            subscription.notify()
+        state.ticker = state.loop.call_later(self.flush_s, self._tick, state)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(gps_setting('LIVE_BROKER'))()
+    return _broker
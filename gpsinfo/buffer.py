@@ -0,0 +1,190 @@
+# gpsinfo/buffer.py
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.db import close_old_connections, connection
+
+from .conf import gps_setting
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    """Raised when the write-behind buffer cannot take more points."""
+
+
+class FlushFailed(Exception):
+    """Raised to a waiting request when the batch holding its points failed to write."""
+
+
+class Ticket:
+    """
+    Handed back by WriteBehindBuffer.submit(); lets a request wait until
+    its points have been written.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.error = None
+
+    def resolve(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the points are flushed. Returns False on timeout and
+        raises FlushFailed if the write failed.
+        """
+        if not self._done.wait(timeout):
+            return False
+        if self.error is not None:
+            raise FlushFailed(str(self.error))
+        return True
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-process queue of unsaved GPSLocation instances. A background
+    thread hands them to ``writer(locations, latest_only)`` in batches every
+    ``flush_interval_ms`` milliseconds or as soon as ``flush_rows`` points are
+    waiting.
+    """
+
+    def __init__(self, writer, max_pending=20000, flush_rows=500, flush_interval_ms=200):
+        self.writer = writer
+        self.max_pending = max_pending
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._entries = deque()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, locations, latest_only=()):
+        """
+        Queue points for the next flush; ``latest_only`` points only refresh
+        GPSLatest. Raises BufferFull instead of blocking when the buffer is at
+        capacity, so callers can shed load.
+        """
+        ticket = Ticket()
+        with self._cond:
+            if self._stopping:
+                raise BufferFull("Write-behind buffer is shutting down")
+            size = len(locations) + len(latest_only)
+            if self._pending + size > self.max_pending:
+                raise BufferFull(f"Write-behind buffer is full ({self._pending} points pending)")
+            self._entries.append((locations, latest_only, ticket))
+            self._pending += size
+            if self._pending >= self.flush_rows:
+                self._cond.notify()
+        return ticket
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='gpsinfo-write-behind', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """
+        Stop accepting points and flush whatever is still queued.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        else:
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything queued so far. Normally called by the background thread.
+        """
+        with self._cond:
+            entries, self._entries = self._entries, deque()
+            self._pending = 0
+        if not entries:
+            return 0
+
+        locations = [location for batch, _, _ in entries for location in batch]
+        latest_only = [location for _, batch, _ in entries for location in batch]
+        error = None
+        try:
+            close_old_connections()
+            self.writer(locations, latest_only)
+        except Exception as exc:
+            error = exc
+            logger.exception(f"Write-behind flush of {len(locations)} GPS points failed")
+        for _, _, ticket in entries:
+            ticket.resolve(error)
+        return len(locations)
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    deadline = time.monotonic() + self.flush_interval
+                    while not self._stopping and self._pending < self.flush_rows:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    stopping = self._stopping
+                self.flush()
+                if stopping:
+                    break
+        finally:
+            connection.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """
+    Return the process-wide write-behind buffer, starting it on first use.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                from .ingest import write_locations
+                buffer = WriteBehindBuffer(
+                    write_locations,
+                    max_pending=gps_setting('WRITE_BEHIND_MAX_PENDING'),
+                    flush_rows=gps_setting('WRITE_BEHIND_FLUSH_ROWS'),
+                    flush_interval_ms=gps_setting('WRITE_BEHIND_FLUSH_MS'),
+                )
+                buffer.start()
+                _buffer = buffer
+    return _buffer
+
+
+def shutdown():
+    """
+    Flush and stop the write-behind buffer if this process started one.
+    """
+    global _buffer
+    with _buffer_lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        logger.info(f"Flushing {buffer.pending} buffered GPS points before shutdown")
+        buffer.stop()
+
+
+def install_shutdown_hook():
+    """
+    Called from the WSGI/ASGI entry points so workers flush on a graceful exit.
+    """
+    atexit.register(shutdown)
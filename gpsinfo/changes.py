@@ -0,0 +1,114 @@
+# gpsinfo/changes.py
+"""
+Change feed of latest positions: latest/?since=<cursor> returns only the
+GPSLatest rows written since the cursor, the users that left the viewer's
+scope (tombstones) and a new cursor.
+
+Every write stamps GPSLatest.seq (and GPSLatestTombstone.seq) with NextSeq:
+on PostgreSQL the id of the writing transaction, on other backends one more
+than the largest seq so far. A cursor is a seq value; rows with seq >= cursor
+are the changes. On PostgreSQL the next cursor is the oldest transaction
+still running when the feed is read, so a transaction that commits after a
+later one is never skipped; a row can occasionally be sent twice, which
+clients absorb by keeping the newest timestamp per user. The portable
+fallback relies on writers being serialized, as they are on SQLite.
+"""
+from django.db import connection
+from django.db.models import BigIntegerField, Expression
+
+from .spatial import split_bbox
+
+
+class NextSeq(Expression):
+    """
+    The seq value for a row written now, usable in ORM saves and updates.
+    """
+    output_field = BigIntegerField()
+
+    def as_sql(self, compiler, connection):
+        return next_seq_sql(connection), []
+
+
+def next_seq_sql(connection):
+    if connection.vendor == 'postgresql':
+        return 'pg_current_xact_id()::text::bigint'
+    from .models import GPSLatest, GPSLatestTombstone
+
+    qn = connection.ops.quote_name
+    latest, tombstones = (
+        f"(SELECT COALESCE(MAX({qn('seq')}), 0) FROM {qn(model._meta.db_table)})"
+        for model in (GPSLatest, GPSLatestTombstone)
+    )
+    return f'(CASE WHEN {latest} > {tombstones} THEN {latest} ELSE {tombstones} END + 1)'
+
+
+def current_cursor():
+    """
+    The cursor to hand out before reading the changes it covers.
+    """
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint'
+    else:
+        sql = f'SELECT {next_seq_sql(connection)}'
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return cursor.fetchone()[0]
+
+
+def parse_cursor(value):
+    """
+    A ?since= value that is a change cursor (a non-negative integer) rather
+    than an ISO 8601 time, or None.
+    """
+    return int(value) if value and value.isascii() and value.isdecimal() else None
+
+
+def scope_querysets(group=None, usernames=None):
+    """
+    (GPSLatest rows, GPSLatestTombstone rows) of a viewer's scope: the whole
+    fleet, one group and/or the named users.
+    """
+    from .models import GPSLatest, GPSLatestTombstone
+
+    latest = GPSLatest.objects.all()
+    tombstones = GPSLatestTombstone.objects.all()
+    if group:
+        latest = latest.filter(user__user_group=group)
+        tombstones = tombstones.filter(user_group=group)
+    else:
+        tombstones = tombstones.filter(deleted=True)
+    if usernames:
+        latest = latest.filter(user__username__in=usernames)
+        tombstones = tombstones.filter(username__in=usernames)
+    return latest, tombstones
+
+
+def bbox_contains(box, lat, lon):
+    return any(
+        min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+        for min_lat, min_lon, max_lat, max_lon in split_bbox(*box)
+    )
+
+
+def latest_changes(queryset, tombstones, cursor, box=None):
+    """
+    Return (changed GPSLatest rows, removed usernames, next cursor) for the
+    viewer's scope: ``queryset`` holds the scope's GPSLatest rows and
+    ``tombstones`` its GPSLatestTombstone rows. With a viewport ``box``, users
+    that moved out of it since the cursor are reported as removed.
+    """
+    next_cursor = current_cursor()
+    removed = {}
+    for username, seq in tombstones.filter(seq__gte=cursor).values_list('username', 'seq'):
+        removed[username] = max(seq, removed.get(username, seq))
+    changes = []
+    for row in queryset.select_related('user').filter(seq__gte=cursor).order_by('seq'):
+        username = row.user.username
+        if box is not None and not bbox_contains(box, row.latitude, row.longitude):
+            removed[username] = max(row.seq, removed.get(username, row.seq))
+            continue
+        # Left and rejoined since the cursor: the newer event wins
+        if removed.get(username, -1) <= row.seq:
+            removed.pop(username, None)
+            changes.append(row)
+    return changes, sorted(removed), next_cursor
@@ -0,0 +1,117 @@
+# gpsinfo/conf.py
+import os
+
+from django.conf import settings
+
+# Defaults for the GPSINFO settings dict. Override any key in settings.py, e.g.
+# GPSINFO = {'BATCH_MAX_POINTS': 500}
+DEFAULTS = {
+    # Maximum number of points accepted by POST /api/gpslocations/batch/
+    'BATCH_MAX_POINTS': 1000,
+    # Maximum number of points in one encoded-polyline track upload, and in
+    # one page of a my-locations?encoding=polyline download
+    'TRACK_MAX_POINTS': 100000,
+    # Rows per page of the GPS location list and my-locations, and the most
+    # a client may ask for with ?page_size=
+    'PAGE_SIZE': 500,
+    'PAGE_MAX_SIZE': 5000,
+    # Rows fetched per server-side cursor round trip by exports
+    'EXPORT_CHUNK_SIZE': 2000,
+
+    # How accepted points reach the database: 'direct', 'write_behind' or 'spool'
+    'INGEST_MODE': 'direct',
+    # Write-behind buffer: flush every N ms or as soon as M points are queued
+    'WRITE_BEHIND_FLUSH_MS': 200,
+    'WRITE_BEHIND_FLUSH_ROWS': 500,
+    # Points held in memory before requests are rejected with HTTP 429
+    'WRITE_BEHIND_MAX_PENDING': 20000,
+    # 'flush': acknowledge after the batch is written; 'enqueue': acknowledge once queued
+    'WRITE_BEHIND_ACK': 'flush',
+    # Seconds a request waits for its flush in 'flush' mode
+    'WRITE_BEHIND_ACK_TIMEOUT': 5.0,
+
+    # On-disk spool ('spool' mode); None means <BASE_DIR>/gps_spool
+    'SPOOL_DIR': None,
+    # Seal the active segment at this size or age
+    'SPOOL_SEGMENT_BYTES': 64 * 1024 * 1024,
+    'SPOOL_SEGMENT_SECONDS': 60,
+    # fsync at most this often; 0 fsyncs on every append
+    'SPOOL_FSYNC_MS': 50,
+
+    # Drop points closer than MIN_DISTANCE_M metres and MIN_INTERVAL_S seconds
+    # to the user's last stored point (GPSLatest is still refreshed)
+    'DECIMATION_ENABLED': False,
+    'DECIMATION_MIN_DISTANCE_M': 10.0,
+    'DECIMATION_MIN_INTERVAL_S': 30.0,
+    # Users whose last stored point is kept in memory per process
+    'DECIMATION_CACHE_SIZE': 50000,
+
+    # Bits per axis of the stored zkey spatial key (at most 31, about 2 cm);
+    # run manage.py gps_backfill_zkey --all after changing it
+    'ZKEY_BITS': 31,
+
+    # In-memory grid of latest positions behind /api/gpslocations/nearby/:
+    # cell size in degrees, and seconds between rebuilds from the database
+    # (which pick up positions written by other worker processes)
+    'NEARBY_CELL_DEG': 0.01,
+    'NEARBY_REFRESH_S': 60,
+    'NEARBY_DEFAULT_RADIUS_M': 1000,
+    'NEARBY_MAX_RADIUS_M': 50000,
+    'NEARBY_MAX_LIMIT': 100,
+
+    # Serialized latest positions per scope (all, group) kept by each worker
+    # process, least recently read evicted first beyond either bound
+    'LATEST_SNAPSHOT_MAX_BYTES': 64 * 1024 * 1024,
+    'LATEST_SNAPSHOT_MAX_SCOPES': 256,
+    # Seconds a snapshot stays in the shared cache tier for other workers
+    'LATEST_SNAPSHOT_TTL': 60,
+
+    # Live SSE stream (/api/gpslocations/stream/, needs ASGI): seconds
+    # between heartbeats, the shortest gap between two sends to one
+    # connection (updates in between are coalesced), users with unsent
+    # updates a connection may fall behind by before it is resynced from the
+    # database instead, client reconnect delay, and how old a change cursor
+    # must be to stamp pushed events with
+    'STREAM_HEARTBEAT_S': 15,
+    'STREAM_FLUSH_MS': 100,
+    'STREAM_MAX_PENDING': 5000,
+    'STREAM_RETRY_MS': 3000,
+    'STREAM_CURSOR_GRACE_S': 2,
+    # Seconds a stream-ticket/ ticket can be used to connect
+    'STREAM_TICKET_TTL_S': 30,
+    # Longest a latest/?wait= long poll is parked (gpsinfo/longpoll.py)
+    'LONGPOLL_MAX_WAIT_S': 30,
+    # Broker between the write path and live SSE/WebSocket connections; the
+    # in-memory one only reaches connections of the same process, use
+    # 'gpsinfo.notify.PgNotifyBroker' with several workers or nodes
+    'LIVE_BROKER': 'gpsinfo.broker.InMemoryBroker',
+
+    # PostgreSQL monthly partitions of GPSLocation (manage.py gps_partitions):
+    # months to pre-create ahead, and months to keep (None keeps everything)
+    'PARTITION_MONTHS_AHEAD': 3,
+    'PARTITION_RETAIN_MONTHS': None,
+
+    # Tiered retention (manage.py gps_retention): raw points older than
+    # RAW_DAYS are downsampled to one per BUCKET_SECONDS (plus any point
+    # MOVE_M metres away), and those become daily summaries after
+    # MINUTE_DAYS. None keeps a tier forever.
+    'RETENTION_RAW_DAYS': None,
+    'RETENTION_MINUTE_DAYS': None,
+    'RETENTION_BUCKET_SECONDS': 60,
+    'RETENTION_MOVE_M': 100.0,
+    # Days change-feed tombstones are kept (pruned by gps_retention); a
+    # client whose cursor is older can miss removals and should start over
+    # with ?since=0
+    'DELTA_TOMBSTONE_DAYS': 7,
+}
+
+
+def gps_setting(name):
+    """
+    Return a gpsinfo setting from settings.GPSINFO, falling back to DEFAULTS.
+    """
+    overrides = getattr(settings, 'GPSINFO', None) or {}
+    value = overrides.get(name, DEFAULTS[name])
+    if name == 'SPOOL_DIR' and value is None:
+        value = os.path.join(settings.BASE_DIR, 'gps_spool')
+    return value
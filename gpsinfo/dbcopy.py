@@ -0,0 +1,236 @@
+# gpsinfo/dbcopy.py
+"""
+Bulk copy of every application table between PostgreSQL databases with
+COPY ... TO/FROM STDOUT, used by ``manage.py dbcopy``.
+
+Tables are grouped into levels by foreign-key dependency; the tables of one
+level are copied in parallel worker threads, each with its own connection,
+and a level starts only when the previous one has finished, so parents are
+always loaded before their children. Export workers share one exported
+snapshot, so the dump is consistent across tables. Progress is checkpointed
+per table in ``manifest.json``, and a re-run skips tables already done.
+"""
+import gzip
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.db import connections, transaction
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+# Bytes per read when streaming a file into COPY FROM STDIN
+READ_SIZE = 1024 * 1024
+
+
+def copy_models(using='default'):
+    """
+    Every concrete, managed model (including auto-created many-to-many
+    tables) whose table exists in the database.
+    """
+    existing = set(connections[using].introspection.table_names())
+    models = {}
+    for model in apps.get_models(include_auto_created=True):
+        opts = model._meta
+        if opts.managed and not opts.proxy and not opts.swapped and opts.db_table in existing:
+            models.setdefault(opts.db_table, model)
+    return models
+
+
+def table_levels(models):
+    """
+    Group ``{table: model}`` into lists of tables whose foreign keys only
+    point at tables in earlier lists. Tables in a reference cycle end up in
+    one level; Django's deferred FK constraints let them load together.
+    """
+    dependencies = {}
+    for table, model in models.items():
+        targets = set()
+        for field in model._meta.concrete_fields:
+            if field.remote_field is not None and field.related_model is not None:
+                targets.add(field.related_model._meta.db_table)
+        dependencies[table] = targets & set(models) - {table}
+
+    levels = []
+    remaining = dict(dependencies)
+    while remaining:
+        ready = sorted(table for table, targets in remaining.items() if not targets & set(remaining))
+        if not ready:
+            ready = sorted(remaining)
+        levels.append(ready)
+        for table in ready:
+            del remaining[table]
+    return levels
+
+
+def table_columns(model):
+    return [field.column for field in model._meta.local_concrete_fields]
+
+
+def _copy_to(cursor, sql, stream):
+    raw = cursor.cursor
+    if hasattr(raw, 'copy'):
+        # psycopg 3
+        with raw.copy(sql) as copy:
+            for data in copy:
+                stream.write(data)
+    else:
+        raw.copy_expert(sql, stream, size=READ_SIZE)
+    return raw.rowcount
+
+
+def _copy_from(cursor, sql, stream):
+    raw = cursor.cursor
+    if hasattr(raw, 'copy'):
+        with raw.copy(sql) as copy:
+            while True:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                copy.write(data)
+    else:
+        raw.copy_expert(sql, stream, size=READ_SIZE)
+    return raw.rowcount
+
+
+class Manifest:
+    """
+    Per-table checkpoints in <directory>/manifest.json, rewritten atomically
+    after every table so a crash never leaves it half written.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST)
+        self._lock = threading.Lock()
+        self.data = {'version': MANIFEST_VERSION, 'tables': {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.data = json.load(f)
+
+    @property
+    def tables(self):
+        return self.data['tables']
+
+    def update(self, table, **values):
+        with self._lock:
+            self.tables.setdefault(table, {}).update(values)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.data, f, indent=2, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+
+class DBCopy:
+    """
+    Runs a parallel, resumable COPY export or import of ``models`` (a
+    ``{table: model}`` dict) against database ``using``. ``log`` receives one
+    progress line per table.
+    """
+
+    def __init__(self, directory, models, using='default', jobs=4, compress=False, compresslevel=3, log=print):
+        self.directory = directory
+        self.models = models
+        self.using = using
+        self.jobs = jobs
+        self.compress = compress
+        self.compresslevel = compresslevel
+        self.log = log
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = Manifest(directory)
+
+    def _run_levels(self, work):
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='dbcopy') as pool:
+            for level in table_levels(self.models):
+                # list() re-raises the first worker error before the next level starts
+                list(pool.map(work, level))
+
+    def export(self, restart=False):
+        if restart:
+            self.manifest.tables.clear()
+        connection = connections[self.using]
+        with transaction.atomic(using=self.using), connection.cursor() as cursor:
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            cursor.execute('SELECT pg_export_snapshot()')
+            snapshot = cursor.fetchone()[0]
+            self._run_levels(lambda table: self._export_table(table, snapshot))
+
+    def _export_table(self, table, snapshot):
+        if self.manifest.tables.get(table, {}).get('exported'):
+            return
+        model = self.models[table]
+        columns = table_columns(model)
+        qn = connections[self.using].ops.quote_name
+        column_list = ', '.join(qn(column) for column in columns)
+        # COPY (SELECT ...) also works for partitioned tables, unlike COPY <table> TO
+        sql = f'COPY (SELECT {column_list} FROM {qn(table)}) TO STDOUT WITH (FORMAT csv, HEADER)'
+        filename = table + ('.csv.gz' if self.compress else '.csv')
+        path = os.path.join(self.directory, filename)
+        connection = connections[self.using]
+        try:
+            with transaction.atomic(using=self.using), connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+                cursor.execute('SET TRANSACTION SNAPSHOT %s', [snapshot])
+                opener = gzip.open(path, 'wb', compresslevel=self.compresslevel) if self.compress else open(path, 'wb')
+                with opener as stream:
+                    rows = _copy_to(cursor, sql, stream)
+        finally:
+            connection.close()
+        self.manifest.update(table, file=filename, columns=columns, rows=rows, exported=True, imported=False)
+        self.log(f"exported {table}: {rows} rows -> {filename}")
+
+    def import_(self, restart=False):
+        tables = self.manifest.tables
+        missing = sorted(table for table in self.models if not tables.get(table, {}).get('exported'))
+        if missing:
+            raise ValueError(f"No complete export in {self.directory} for: {', '.join(missing)}")
+        if restart:
+            for table in self.models:
+                tables[table]['imported'] = False
+        pending = [table for table in self.models if not tables[table].get('imported')]
+        if pending and len(pending) == len(self.models):
+            # Fresh import: empty the targets in one statement. No CASCADE, so a
+            # table outside the copied set that references them aborts the import
+            qn = connections[self.using].ops.quote_name
+            with transaction.atomic(using=self.using), connections[self.using].cursor() as cursor:
+                cursor.execute(f"TRUNCATE {', '.join(qn(table) for table in pending)}")
+        self._run_levels(self._import_table)
+
+    def _import_table(self, table):
+        entry = self.manifest.tables[table]
+        if entry.get('imported'):
+            return
+        columns = table_columns(self.models[table])
+        if entry['columns'] != columns:
+            raise ValueError(f"{table}: exported columns {entry['columns']} do not match the target {columns}")
+        qn = connections[self.using].ops.quote_name
+        column_list = ', '.join(qn(column) for column in columns)
+        sql = f'COPY {qn(table)} ({column_list}) FROM STDIN WITH (FORMAT csv, HEADER)'
+        path = os.path.join(self.directory, entry['file'])
+        connection = connections[self.using]
+        try:
+            with transaction.atomic(using=self.using), connection.cursor() as cursor:
+                # Rows left by a run that committed but crashed before its checkpoint
+                cursor.execute(f'DELETE FROM {qn(table)}')
+                opener = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+                with opener as stream:
+                    rows = _copy_from(cursor, sql, stream)
+        finally:
+            connection.close()
+        self.manifest.update(table, imported=True)
+        self.log(f"imported {table}: {rows} rows <- {entry['file']}")
+
+    def reset_sequences(self):
+        """
+        Move every id sequence past the imported rows.
+        """
+        from django.core.management.color import no_style
+
+        connection = connections[self.using]
+        statements = connection.ops.sequence_reset_sql(no_style(), list(self.models.values()))
+        with transaction.atomic(using=self.using), connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
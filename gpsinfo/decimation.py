@@ -0,0 +1,84 @@
+# gpsinfo/decimation.py
+import threading
+from collections import OrderedDict
+
+from .conf import gps_setting
+from .geo import haversine_m
+
+
+def point_time(location):
+    return location.captured_at or location.timestamp
+
+
+class Decimator:
+    """
+    Drops points that are closer than ``min_distance_m`` metres *and*
+    ``min_interval_s`` seconds to the last point stored for the same user.
+    The last stored point per user is kept in a bounded in-process LRU, so no
+    database read is needed; a user missing from the cache always gets their
+    next point stored. Also counts stored and dropped points per user.
+    """
+
+    def __init__(self, min_distance_m=10.0, min_interval_s=30.0, cache_size=50000):
+        self.min_distance_m = min_distance_m
+        self.min_interval_s = min_interval_s
+        self.cache_size = cache_size
+        # user_id -> [latitude, longitude, time, stored, dropped]
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, user_id, locations):
+        """
+        Split one user's points (oldest first) into (kept, dropped).
+        """
+        kept, dropped = [], []
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            for location in locations:
+                when = point_time(location)
+                if entry is not None and self._is_redundant(entry, location, when):
+                    dropped.append(location)
+                    entry[4] += 1
+                    continue
+                kept.append(location)
+                stored, skipped = (entry[3], entry[4]) if entry else (0, 0)
+                entry = [location.latitude, location.longitude, when, stored + 1, skipped]
+            self._users[user_id] = entry
+            while len(self._users) > self.cache_size:
+                self._users.popitem(last=False)
+        return kept, dropped
+
+    def _is_redundant(self, entry, location, when):
+        if abs((when - entry[2]).total_seconds()) >= self.min_interval_s:
+            return False
+        return haversine_m(entry[0], entry[1], location.latitude, location.longitude) < self.min_distance_m
+
+    def stats(self, user_id=None):
+        """
+        Stored/dropped counters for one user, or for every cached user.
+        """
+        with self._lock:
+            if user_id is not None:
+                entry = self._users.get(user_id)
+                return {'stored': entry[3], 'dropped': entry[4]} if entry else {'stored': 0, 'dropped': 0}
+            return {uid: {'stored': e[3], 'dropped': e[4]} for uid, e in self._users.items()}
+
+
+_decimator = None
+_decimator_lock = threading.Lock()
+
+
+def get_decimator():
+    """
+    Return the process-wide decimator built from GPSINFO settings.
+    """
+    global _decimator
+    if _decimator is None:
+        with _decimator_lock:
+            if _decimator is None:
+                _decimator = Decimator(
+                    min_distance_m=gps_setting('DECIMATION_MIN_DISTANCE_M'),
+                    min_interval_s=gps_setting('DECIMATION_MIN_INTERVAL_S'),
+                    cache_size=gps_setting('DECIMATION_CACHE_SIZE'),
+                )
+    return _decimator
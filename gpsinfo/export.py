@@ -0,0 +1,160 @@
+# gpsinfo/export.py
+"""
+Streaming export of GPSLocation history as GeoJSON, GPX or CSV.
+
+Rows are read with QuerySet.iterator(chunk_size=...) (a server-side cursor on
+PostgreSQL) and rendered by generators, so memory stays flat however many
+rows are exported. The document header is yielded before the query runs, and
+the output can be gzipped on the fly.
+"""
+import csv
+import json
+import math
+import zlib
+from xml.sax.saxutils import escape
+
+EXPORT_FIELDS = ['user__username', 'latitude', 'longitude', 'altitude', 'accuracy', 'timestamp', 'captured_at', 'device_seq']
+CSV_HEADER = ['username', 'latitude', 'longitude', 'altitude', 'accuracy', 'timestamp', 'captured_at', 'device_seq']
+
+# format -> (content type, file extension)
+FORMATS = {
+    'geojson': ('application/geo+json', 'geojson'),
+    'gpx': ('application/gpx+xml', 'gpx'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# Rendered text is handed on in pieces of about this many characters
+CHUNK_CHARS = 64 * 1024
+
+
+def export_rows(queryset, chunk_size=2000):
+    """
+    Stream (username, latitude, longitude, altitude, accuracy, timestamp,
+    captured_at, device_seq) tuples, grouped by user and oldest first.
+    """
+    return queryset.order_by('user_id', 'timestamp', 'id').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _coalesce(pieces):
+    """
+    Join small rendered pieces into chunks of roughly CHUNK_CHARS.
+    """
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_CHARS:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _finite(value):
+    return value is not None and math.isfinite(value)
+
+
+def _json_number(value):
+    # JSON has no literal for inf or nan
+    return repr(value) if _finite(value) else 'null'
+
+
+def _json_time(value):
+    return 'null' if value is None else f'"{value.isoformat()}"'
+
+
+def geojson_chunks(rows):
+    yield '{"type":"FeatureCollection","features":['
+
+    def features():
+        # Formatted by hand: json.dumps() of a nested dict per row is several times slower
+        separator = ''
+        current, name = object(), None
+        for username, lat, lon, alt, acc, timestamp, captured_at, device_seq in rows:
+            if username != current:
+                current, name = username, json.dumps(username)
+            coordinates = f'{lon!r},{lat!r},{alt!r}' if _finite(alt) else f'{lon!r},{lat!r}'
+            yield (
+                f'{separator}{{"type":"Feature","geometry":{{"type":"Point","coordinates":[{coordinates}]}},'
+                f'"properties":{{"username":{name},"timestamp":{_json_time(timestamp)},'
+                f'"captured_at":{_json_time(captured_at)},"accuracy":{_json_number(acc)},'
+                f'"device_seq":{_json_number(device_seq)}}}}}'
+            )
+            separator = ','
+
+    yield from _coalesce(features())
+    yield ']}\n'
+
+
+def gpx_chunks(rows):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="GEOStarA" xmlns="http://www.topografix.com/GPX/1/1">\n')
+
+    def points():
+        # One <trk> per user; rows arrive grouped by user
+        in_track, current = False, None
+        for username, lat, lon, alt, acc, timestamp, captured_at, device_seq in rows:
+            if not in_track or username != current:
+                if in_track:
+                    yield '</trkseg></trk>\n'
+                yield f'<trk><name>{escape(username or "unknown")}</name><trkseg>\n'
+                in_track, current = True, username
+            ele = f'<ele>{alt}</ele>' if _finite(alt) else ''
+            when = (captured_at or timestamp).isoformat()
+            yield f'<trkpt lat="{lat}" lon="{lon}">{ele}<time>{when}</time></trkpt>\n'
+        if in_track:
+            yield '</trkseg></trk>\n'
+
+    yield from _coalesce(points())
+    yield '</gpx>\n'
+
+
+def csv_chunks(rows):
+    class Echo:
+        def write(self, value):
+            return value
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+
+    def lines():
+        for username, lat, lon, alt, acc, timestamp, captured_at, device_seq in rows:
+            yield writer.writerow([username, lat, lon, alt, acc, timestamp.isoformat(), _isoformat(captured_at), device_seq])
+
+    yield from _coalesce(lines())
+
+
+RENDERERS = {
+    'geojson': geojson_chunks,
+    'gpx': gpx_chunks,
+    'csv': csv_chunks,
+}
+
+
+def gzip_chunks(chunks):
+    """
+    Gzip a stream of bytes on the fly. The first chunk is sync-flushed so the
+    client receives bytes before the first query page is read.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    first = True
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if first:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(queryset, fmt, compress=False, chunk_size=2000):
+    """
+    Render ``queryset`` (GPSLocation rows) in ``fmt`` as an iterator of bytes.
+    """
+    chunks = (text.encode() for text in RENDERERS[fmt](export_rows(queryset, chunk_size)))
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,58 @@
+# gpsinfo/geo.py
+import math
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in metres between two points given in decimal degrees.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Bits per axis of a stored zkey; 2 * 31 bits fit a signed 64-bit column and
+# resolve about 2 cm
+ZKEY_MAX_BITS = 31
+
+
+def _spread_bits(value):
+    """
+    Move the low 32 bits of ``value`` to the even bit positions of a 64-bit integer.
+    """
+    value &= 0xFFFFFFFF
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+
+def interleave(x, y):
+    return _spread_bits(x) | (_spread_bits(y) << 1)
+
+
+def grid_cell(lat, lon, bits=ZKEY_MAX_BITS):
+    """
+    (x, y) of the cell containing a point on a 2**bits x 2**bits grid over
+    longitude [-180, 180] and latitude [-90, 90].
+    """
+    size = 1 << bits
+    x = int((lon + 180.0) / 360.0 * size)
+    y = int((lat + 90.0) / 180.0 * size)
+    return min(max(x, 0), size - 1), min(max(y, 0), size - 1)
+
+
+def zkey(lat, lon, bits=ZKEY_MAX_BITS):
+    """
+    Z-order (Morton) key of a point: the grid cell's x (longitude) and y
+    (latitude) bits interleaved. Like a geohash, nearby points share a key
+    prefix, and every cell at a coarser level is one contiguous key range.
+    """
+    return interleave(*grid_cell(lat, lon, bits))
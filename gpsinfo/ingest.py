@@ -0,0 +1,233 @@
+# gpsinfo/ingest.py
+from itertools import chain
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, transaction
+from .buffer import FlushFailed, get_buffer
+from .changes import NextSeq, next_seq_sql
+from .conf import gps_setting
+from .decimation import get_decimator, point_time
+from .models import GPSLocation, GPSLatest
+from .signals import latest_changed
+from .spatial import point_zkey
+from .spool import get_spool
+
+LATEST_FIELDS = ['latitude', 'longitude', 'altitude', 'accuracy', 'timestamp', 'zkey']
+
+
+def latest_row(location):
+    """
+    Build the GPSLatest values for a GPSLocation. The device capture time is
+    preferred over the server receive time so ordering follows the device.
+    """
+    row = {'user_id': location.user_id}
+    for name in LATEST_FIELDS:
+        row[name] = getattr(location, name)
+    if location.captured_at is not None:
+        row['timestamp'] = location.captured_at
+    return row
+
+
+def coalesce_latest(rows):
+    """
+    Keep only the newest row per user; on equal timestamps the later row wins.
+    """
+    newest = {}
+    for row in rows:
+        current = newest.get(row['user_id'])
+        if current is None or row['timestamp'] >= current['timestamp']:
+            newest[row['user_id']] = row
+    return list(newest.values())
+
+
+def upsert_latest(rows):
+    """
+    Advance GPSLatest for each user to the given position, but only when it is
+    newer than the stored one. Runs as a single INSERT ... ON CONFLICT DO UPDATE
+    on backends that support it, so concurrent writers cannot interleave a
+    SELECT and an UPDATE, and a delayed older point never overwrites a newer one.
+    """
+    rows = coalesce_latest(rows)
+    if not rows:
+        return
+    if connection.features.supports_update_conflicts_with_target:
+        applied = _upsert_latest_sql(rows)
+    else:
+        applied = _upsert_latest_orm(rows)
+    if applied is not None:
+        rows = [row for row in rows if row['user_id'] in applied]
+    if rows:
+        transaction.on_commit(lambda: latest_changed.send(sender=GPSLatest, rows=rows))
+
+
+def _upsert_latest_sql(rows):
+    # Returns the user ids whose row was written, or None if the backend cannot say
+    qn = connection.ops.quote_name
+    table = qn(GPSLatest._meta.db_table)
+    names = ['user_id'] + LATEST_FIELDS
+    columns = [qn(GPSLatest._meta.get_field(name).column) for name in names]
+    timestamp = qn(GPSLatest._meta.get_field('timestamp').column)
+
+    placeholders = '(' + ', '.join(['%s'] * len(columns) + [next_seq_sql(connection)]) + ')'
+    columns.append(qn(GPSLatest._meta.get_field('seq').column))
+    params = []
+    for row in rows:
+        for name in names:
+            value = row[name]
+            if name == 'timestamp':
+                value = connection.ops.adapt_datetimefield_value(value)
+            params.append(value)
+
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES {', '.join([placeholders] * len(rows))} "
+        f"ON CONFLICT ({columns[0]}) DO UPDATE SET "
+        + ', '.join(f"{column} = EXCLUDED.{column}" for column in columns[1:])
+        + f" WHERE {table}.{timestamp} < EXCLUDED.{timestamp}"
+    )
+    returning = connection.features.can_return_rows_from_bulk_insert
+    if returning:
+        sql += f" RETURNING {columns[0]}"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {user_id for user_id, in cursor.fetchall()} if returning else None
+
+
+def _upsert_latest_orm(rows):
+    # Portable fallback: a guarded UPDATE, then INSERT if the user has no row yet
+    applied = set()
+    for row in rows:
+        values = {name: row[name] for name in LATEST_FIELDS}
+        values['seq'] = NextSeq()
+        updated = GPSLatest.objects.filter(
+            user_id=row['user_id'], timestamp__lt=row['timestamp']
+        ).update(**values)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    GPSLatest.objects.create(user_id=row['user_id'], **{name: row[name] for name in LATEST_FIELDS})
+                updated = 1
+            except IntegrityError:
+                # Row exists and is already newer, or a concurrent writer won; retry the guarded update
+                updated = GPSLatest.objects.filter(
+                    user_id=row['user_id'], timestamp__lt=row['timestamp']
+                ).update(**values)
+        if updated:
+            applied.add(row['user_id'])
+    return applied
+
+
+def update_latest(user, location):
+    """
+    Point the user's GPSLatest row at the given GPSLocation if it is newer.
+    """
+    upsert_latest([latest_row(location)])
+
+
+def insert_locations(locations):
+    """
+    INSERT ... ON CONFLICT DO NOTHING the GPSLocation instances and return
+    those actually written, with their ids set from RETURNING. Points whose
+    (user, device_seq) is already stored are left out. Backends without
+    RETURNING get bulk_create(), and every point is returned without an id.
+    """
+    if not connection.features.can_return_rows_from_bulk_insert:
+        GPSLocation.objects.bulk_create(locations, ignore_conflicts=True)
+        return locations
+    qn = connection.ops.quote_name
+    fields = [field for field in GPSLocation._meta.concrete_fields if not field.primary_key]
+    returned = [qn(GPSLocation._meta.get_field(name).column) for name in ('id', 'user', 'device_seq')]
+    batch_size = connection.ops.bulk_batch_size(fields, locations)
+    stored = []
+    for start in range(0, len(locations), batch_size):
+        batch = locations[start:start + batch_size]
+        params = [field.get_db_prep_save(field.pre_save(location, True), connection)
+                  for location in batch for field in fields]
+        placeholders = '(' + ', '.join(['%s'] * len(fields)) + ')'
+        sql = (
+            f"INSERT INTO {qn(GPSLocation._meta.db_table)} ({', '.join(qn(field.column) for field in fields)}) "
+            f"VALUES {', '.join([placeholders] * len(batch))} "
+            f"ON CONFLICT DO NOTHING RETURNING {', '.join(returned)}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        # Keyed rows are matched by key; unkeyed ones never conflict and come back in order
+        keyed = {(user_id, device_seq): pk for pk, user_id, device_seq in rows if device_seq is not None}
+        unkeyed = iter([pk for pk, user_id, device_seq in rows if device_seq is None])
+        for location in batch:
+            if location.device_seq is None:
+                location.pk = next(unkeyed)
+            else:
+                location.pk = keyed.pop((location.user_id, location.device_seq), None)
+                if location.pk is None:
+                    continue
+            location._state.adding = False
+            location._state.db = connection.alias
+            stored.append(location)
+    return stored
+
+
+def write_locations(locations, latest_only=()):
+    """
+    Insert unsaved GPSLocation instances (any mix of users) with a single bulk
+    INSERT and refresh GPSLatest with one upsert, coalesced to the newest point
+    per user. ``latest_only`` points (dropped by decimation) only refresh
+    GPSLatest. Points whose (user, device_seq) already exists are skipped by
+    ON CONFLICT DO NOTHING, so client retries are absorbed without a
+    read-before-write, and do not move GPSLatest either. On the partitioned
+    table that holds within a month of receive time only (see partitions.py).
+    Returns the points written (see insert_locations).
+    """
+    if not locations and not latest_only:
+        return []
+    # The INSERT bypasses save(), so the spatial key is filled in here
+    for location in chain(locations, latest_only):
+        location.zkey = point_zkey(location.latitude, location.longitude)
+    with transaction.atomic():
+        stored = insert_locations(locations) if locations else []
+        upsert_latest(latest_row(location) for location in chain(stored, latest_only))
+    return stored
+
+
+def accept_locations(user, items):
+    """
+    Entry point for the API: store validated points according to
+    GPSINFO['INGEST_MODE'] and return (stored, dropped) lists of the
+    (possibly not yet saved) instances. With DECIMATION_ENABLED, redundant
+    points are dropped first but still refresh GPSLatest. In 'direct' mode
+    replays of a stored device_seq are in neither list, and stored points
+    have their ids.
+
+    'direct'        write in the request.
+    'write_behind'  hand the points to the background buffer; with
+                    WRITE_BEHIND_ACK = 'flush' the request waits for the batch
+                    to be written, with 'enqueue' it returns immediately.
+    'spool'         append the points to the on-disk spool and return;
+                    manage.py drain_gps_spool writes them to the database.
+    Raises buffer.BufferFull when the write-behind buffer is at capacity.
+    """
+    locations = [GPSLocation(user=user, **item) for item in items]
+    dropped = []
+    if gps_setting('DECIMATION_ENABLED'):
+        locations, dropped = get_decimator().filter(user.pk, locations)
+    # Only the newest dropped point can still move GPSLatest
+    latest_only = [max(dropped, key=point_time)] if dropped else []
+
+    mode = gps_setting('INGEST_MODE')
+    if mode == 'direct':
+        locations = write_locations(locations, latest_only)
+    elif mode == 'spool':
+        try:
+            get_spool().append(locations, latest_only)
+        except OSError as exc:
+            raise FlushFailed(f"Could not append to the GPS spool: {exc}")
+    elif mode == 'write_behind':
+        ticket = get_buffer().submit(locations, latest_only)
+        if gps_setting('WRITE_BEHIND_ACK') == 'flush':
+            if not ticket.wait(gps_setting('WRITE_BEHIND_ACK_TIMEOUT')):
+                raise FlushFailed("Timed out waiting for the write-behind flush")
+    else:
+        raise ImproperlyConfigured(f"Unknown GPSINFO['INGEST_MODE']: {mode!r}")
+    return locations, dropped
+
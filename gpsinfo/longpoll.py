@@ -0,0 +1,125 @@
+# gpsinfo/longpoll.py
+"""
+Long-poll mode of latest/: ?wait=<seconds>&since=<cursor>.
+
+For clients that cannot keep an SSE or WebSocket connection open through
+their proxies. Instead of polling every second they ask for the changes
+since their cursor and the request is parked, as a coroutine on a broker
+subscription (broker.py), until a change in its scope commits or ``wait``
+seconds (at most LONGPOLL_MAX_WAIT_S) pass. The answer is the usual change
+feed, {cursor, changes, removed}, possibly empty on timeout; the client
+polls again with the new cursor right away.
+
+Parking needs the ASGI server, so the view is only mounted by its URLconf
+(rbackend/asgi_urls.py, see rbackend/middleware.py); there requests without
+?wait= are handed on to the regular latest/ action. Served through WSGI, latest/ is that action alone
+and answers ?wait= at once.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from .broker import get_broker
+from .changes import bbox_contains, parse_cursor
+from .conf import gps_setting
+from .spatial import parse_bbox
+from .stream import authenticate, get_stable_cursor, scope_state, subscription_scopes
+from .versions import group_scope
+from .views import GPSLocationViewSet
+from .websocket import database
+
+latest_view = GPSLocationViewSet.as_view({'get': 'get_latest_locations'})
+
+
+def render_latest(request):
+    response = latest_view(request)
+    # DRF Responses render lazily; snapshots come as plain HttpResponses
+    return response.render() if hasattr(response, 'render') else response
+
+
+def delta_response(cursor, positions, removed):
+    # positions are JSON texts already; splice them in rather than re-encode
+    response = HttpResponse(
+        f'{{"cursor":"{cursor}","changes":[{",".join(positions)}],"removed":{json.dumps(removed)}}}',
+        content_type='application/json',
+    )
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def relevant(events, group, usernames, box):
+    """
+    (position JSON texts, removed usernames) among the broker's events for a
+    viewer of the scope, minus users outside the viewport.
+    """
+    positions, removed = [], []
+    for event in events:
+        if usernames and event.username not in usernames:
+            continue
+        if group and group_scope(group) not in event.scopes:
+            continue
+        if event.kind == 'remove':
+            removed.append(event.username)
+        elif box is None:
+            positions.append(event.data)
+        else:
+            row = json.loads(event.data)
+            if bbox_contains(box, row['latitude'], row['longitude']):
+                positions.append(event.data)
+            else:
+                removed.append(event.username)
+    return positions, removed
+
+
+@csrf_exempt
+async def latest_long_poll(request):
+    """
+    latest/, parking ?wait= requests until their scope changes.
+    """
+    if request.method != 'GET' or 'wait' not in request.GET:
+        return await sync_to_async(render_latest)(request)
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse({"error": "User not authenticated"}, status=401)
+    wait = request.GET['wait']
+    if not (wait.isascii() and wait.isdecimal()):
+        return JsonResponse({"error": "wait must be a number of seconds"}, status=400)
+    wait = min(int(wait), gps_setting('LONGPOLL_MAX_WAIT_S'))
+    cursor = parse_cursor(request.GET.get('since'))
+    if cursor is None:
+        return JsonResponse({"error": "wait needs a change cursor in since"}, status=400)
+    group = request.GET.get('group')
+    usernames = [name for name in request.GET.get('users', '').split(',') if name]
+    try:
+        box = parse_bbox(request.GET['bbox']) if request.GET.get('bbox') else None
+    except ValueError:
+        return JsonResponse({"error": "Expected bbox=minLon,minLat,maxLon,maxLat in decimal degrees"}, status=400)
+
+    # Subscribe before reading the changes, so no write falls between
+    subscription = get_broker().subscribe(subscription_scopes(group, usernames))
+    try:
+        next_cursor, positions, removed = await database(scope_state)(group, usernames, cursor, box)
+        deadline = asyncio.get_running_loop().time() + wait
+        while not positions and not removed:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                events = await asyncio.wait_for(subscription.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if subscription.overflowed:
+                subscription.resynced()
+                next_cursor, positions, removed = await database(scope_state)(group, usernames, cursor, box)
+            elif events:
+                # Answer from the pushed events, without another query
+                positions, removed = relevant(events, group, usernames, box)
+                stable = await get_stable_cursor().get()
+                if stable is not None and stable > next_cursor:
+                    next_cursor = stable
+        return delta_response(next_cursor, positions, removed)
+    finally:
+        subscription.close()
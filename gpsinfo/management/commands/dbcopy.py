@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from gpsinfo.dbcopy import DBCopy, copy_models, table_levels
+
+
+class Command(BaseCommand):
+    help = 'Export or import every application table with PostgreSQL COPY, in parallel and resumably'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['export', 'import'])
+        parser.add_argument('directory', help='Directory holding the table files and manifest.json')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--jobs', type=int, default=4, help='Tables copied in parallel')
+        parser.add_argument('--compress', action='store_true', help='Gzip the exported files')
+        parser.add_argument('--compress-level', type=int, default=3, choices=range(1, 10))
+        parser.add_argument('--tables', default=None, help='Comma-separated subset of tables')
+        parser.add_argument('--exclude', default='', help='Comma-separated tables to skip')
+        parser.add_argument('--restart', action='store_true', help='Ignore checkpoints and copy every table again')
+        parser.add_argument('--plan', action='store_true', help='Only print the dependency levels')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if connections[using].vendor != 'postgresql':
+            raise CommandError("dbcopy needs a PostgreSQL database")
+
+        models = copy_models(using)
+        if options['tables']:
+            wanted = {name.strip() for name in options['tables'].split(',') if name.strip()}
+            unknown = wanted - set(models)
+            if unknown:
+                raise CommandError(f"Unknown tables: {', '.join(sorted(unknown))}")
+            models = {table: model for table, model in models.items() if table in wanted}
+        for table in options['exclude'].split(','):
+            models.pop(table.strip(), None)
+
+        if options['plan']:
+            for number, level in enumerate(table_levels(models), 1):
+                self.stdout.write(f"level {number}: {', '.join(level)}")
+            return
+
+        copier = DBCopy(
+            options['directory'],
+            models,
+            using=using,
+            jobs=options['jobs'],
+            compress=options['compress'],
+            compresslevel=options['compress_level'],
+            log=self.stdout.write,
+        )
+        started = time.perf_counter()
+        try:
+            if options['action'] == 'export':
+                copier.export(restart=options['restart'])
+            else:
+                copier.import_(restart=options['restart'])
+                copier.reset_sequences()
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['action'].capitalize()}ed {len(models)} tables in {time.perf_counter() - started:.2f}s"
+        ))
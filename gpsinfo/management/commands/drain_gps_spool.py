@@ -0,0 +1,30 @@
+# gpsinfo/management/commands/drain_gps_spool.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from gpsinfo.conf import gps_setting
+from gpsinfo.spool import drain_segment, pending_segments
+
+
+class Command(BaseCommand):
+    help = 'Replay sealed GPS spool segments into GPSLocation/GPSLatest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spool-dir', default=None, help="Defaults to GPSINFO['SPOOL_DIR']")
+        parser.add_argument('--batch-size', type=int, default=1000, help='Points per INSERT/checkpoint')
+        parser.add_argument('--follow', action='store_true', help='Keep running and drain new segments as they are sealed')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between scans with --follow')
+
+    def handle(self, *args, **options):
+        directory = options['spool_dir'] or gps_setting('SPOOL_DIR')
+        while True:
+            for path in pending_segments(directory):
+                started = time.perf_counter()
+                written = drain_segment(path, batch_size=options['batch_size'])
+                self.stdout.write(self.style.SUCCESS(
+                    f"Drained {written} points from {path} in {time.perf_counter() - started:.2f}s"
+                ))
+            if not options['follow']:
+                break
+            time.sleep(options['interval'])
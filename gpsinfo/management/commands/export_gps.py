@@ -0,0 +1,54 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from gpsinfo.conf import gps_setting
+from gpsinfo.export import FORMATS, stream_export
+from gpsinfo.models import GPSLocation
+
+
+class Command(BaseCommand):
+    help = 'Stream GPSLocation history to a GeoJSON, GPX or CSV file with flat memory use'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', choices=list(FORMATS), default='geojson')
+        parser.add_argument('--output', '-o', default='-', help="File to write, or '-' for stdout")
+        parser.add_argument('--user', action='append', default=[], help='Username to export (repeatable); defaults to everyone')
+        parser.add_argument('--since', default=None, help='Inclusive ISO 8601 lower bound on timestamp')
+        parser.add_argument('--until', default=None, help='Exclusive ISO 8601 upper bound on timestamp')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output on the fly')
+        parser.add_argument('--chunk-size', type=int, default=None, help="Defaults to GPSINFO['EXPORT_CHUNK_SIZE']")
+
+    def handle(self, *args, **options):
+        queryset = GPSLocation.objects.all()
+        if options['user']:
+            queryset = queryset.filter(user__username__in=options['user'])
+        for name, lookup in (('since', 'timestamp__gte'), ('until', 'timestamp__lt')):
+            if options[name]:
+                value = parse_datetime(options[name])
+                if value is None:
+                    raise CommandError(f"--{name} must be an ISO 8601 datetime")
+                queryset = queryset.filter(**{lookup: value})
+
+        chunks = stream_export(
+            queryset,
+            options['export_format'],
+            compress=options['gzip'],
+            chunk_size=options['chunk_size'] or gps_setting('EXPORT_CHUNK_SIZE'),
+        )
+        started = time.perf_counter()
+        written = 0
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {written} bytes to {options['output']} in {time.perf_counter() - started:.2f}s"
+            ))
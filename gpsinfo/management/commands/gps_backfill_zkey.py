@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from gpsinfo.models import GPSLatest, GPSLocation
+from gpsinfo.spatial import point_zkey
+
+
+class Command(BaseCommand):
+    help = 'Fill in the zkey spatial key of GPSLocation and GPSLatest rows in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per UPDATE transaction')
+        parser.add_argument('--all', action='store_true', help='Recompute every row, e.g. after changing ZKEY_BITS')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        for model in (GPSLatest, GPSLocation):
+            started = time.perf_counter()
+            updated = self.backfill(model, options['batch_size'], options['all'], options['sleep'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{model._meta.label}: set zkey on {updated} rows in {time.perf_counter() - started:.2f}s"
+            ))
+
+    def backfill(self, model, batch_size, recompute, pause):
+        queryset = model.objects.all() if recompute else model.objects.filter(zkey__isnull=True)
+        last_pk = None
+        updated = 0
+        while True:
+            batch = queryset.order_by('pk')
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            rows = list(batch.values_list('pk', 'latitude', 'longitude')[:batch_size])
+            if not rows:
+                return updated
+            keys = [(pk, point_zkey(latitude, longitude)) for pk, latitude, longitude in rows]
+            with transaction.atomic():
+                self.update_keys(model, keys)
+            updated += len(keys)
+            last_pk = rows[-1][0]
+            if pause:
+                time.sleep(pause)
+
+    def update_keys(self, model, keys):
+        if connection.vendor == 'postgresql':
+            # One UPDATE joined to a VALUES list is several times faster than
+            # bulk_update()'s CASE expression, especially on a partitioned table
+            qn = connection.ops.quote_name
+            pk = qn(model._meta.pk.column)
+            sql = (
+                f"UPDATE {qn(model._meta.db_table)} AS t SET zkey = v.zkey "
+                f"FROM (VALUES {', '.join(['(%s::bigint, %s::bigint)'] * len(keys))}) AS v(pk, zkey) "
+                f"WHERE t.{pk} = v.pk"
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [value for pair in keys for value in pair])
+        else:
+            model.objects.bulk_update([model(pk=pk, zkey=key) for pk, key in keys], ['zkey'])
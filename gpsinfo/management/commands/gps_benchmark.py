@@ -0,0 +1,303 @@
+# gpsinfo/management/commands/gps_benchmark.py
+import asyncio
+import io
+import json
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.template.response import SimpleTemplateResponse
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from gpsinfo.models import GPSLatest
+from gpsinfo.parsers import PackedGPSParser
+from gpsinfo.serializers import GPSLocationSerializer
+from gpsinfo.spatial import point_zkey
+from gpsinfo.stream import issue_ticket
+from gpsinfo.views import GPSLocationViewSet
+from gpsinfo.websocket import LIVE_PATH, with_live_tracking
+from gpsinfo.wire import MEDIA_TYPE, encode_points
+
+
+class RollbackBenchmark(Exception):
+    """Raised to roll back everything a benchmark run wrote."""
+
+
+def random_point(rng, seq=None):
+    point = {
+        'latitude': 22.3 + rng.random() * 0.1,
+        'longitude': 114.1 + rng.random() * 0.1,
+        'altitude': rng.random() * 100,
+        'accuracy': 5 + rng.random() * 20,
+    }
+    if seq is not None:
+        point['captured_at'] = 1755000000000 + seq * 1000
+        point['device_seq'] = seq
+    return point
+
+
+class BenchmarkSocket:
+    """
+    One WebSocket connection to an ASGI application, driven in memory.
+    """
+
+    def __init__(self, application, ticket):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': LIVE_PATH, 'query_string': f'ticket={ticket}'.encode()}
+        self.task = asyncio.create_task(application(scope, self.incoming.get, self.outgoing.put))
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        message = await self.outgoing.get()
+        assert message['type'] == 'websocket.accept', message
+
+    async def send(self, message):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    async def receive(self):
+        # A socket whose task died never answers; fail instead of hanging
+        return json.loads((await asyncio.wait_for(self.outgoing.get(), 10))['text'])
+
+    async def close(self):
+        await self.incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await self.task
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark GPS ingest paths against the configured database. '
+        'Everything written is rolled back, or deleted for the websocket scenario, at the end. '
+        'JWT authentication is bypassed, so numbers exclude token checks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', nargs='?', default='ingest',
+                            choices=['ingest', 'wire', 'viewport', 'websocket'], help='Which benchmark to run')
+        parser.add_argument('--points', type=int, default=2000, help='Number of points to send per path')
+        parser.add_argument('--batch-size', type=int, default=500, help='Points per batch request')
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Synthetic users with a latest position, for the viewport benchmark')
+        parser.add_argument('--devices', type=int, default=20,
+                            help='Sockets pushing fixes, for the websocket benchmark')
+        parser.add_argument('--viewers', type=int, default=10000,
+                            help='Sockets following the whole fleet, for the websocket benchmark')
+        parser.add_argument('--seconds', type=float, default=10, help='Duration of the websocket benchmark')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.factory = APIRequestFactory()
+        if options['scenario'] == 'websocket':
+            # Sockets write from their own database threads, which only see
+            # committed users, so this one deletes what it wrote instead
+            self.bench_websocket(options)
+            return
+        try:
+            with transaction.atomic():
+                self.user = get_user_model().objects.create_user(username='__gps_benchmark__')
+                getattr(self, 'bench_' + options['scenario'])(options)
+                raise RollbackBenchmark()
+        except RollbackBenchmark:
+            pass
+
+    def report(self, label, count, elapsed, unit='points'):
+        rate = count / elapsed if elapsed else float('inf')
+        self.stdout.write(self.style.SUCCESS(
+            f"{label:<28} {count:>9} {unit} in {elapsed:8.3f}s  = {rate:12.1f} {unit}/sec"
+        ))
+
+    def get(self, view, path, params):
+        request = self.factory.get(path, params)
+        force_authenticate(request, user=self.user)
+        response = view(request)
+        # DRF Responses render lazily; snapshots come as plain HttpResponses
+        if isinstance(response, SimpleTemplateResponse):
+            response.render()
+        return response
+
+    def post(self, view, path, data, **extra):
+        if 'content_type' not in extra:
+            extra['format'] = 'json'
+        request = self.factory.post(path, data, **extra)
+        force_authenticate(request, user=self.user)
+        return view(request)
+
+    def bench_ingest(self, options):
+        total = options['points']
+        batch_size = options['batch_size']
+        single_view = GPSLocationViewSet.as_view({'post': 'create'})
+        batch_view = GPSLocationViewSet.as_view({'post': 'batch_create'})
+
+        start = time.perf_counter()
+        for _ in range(total):
+            response = self.post(single_view, '/api/gpslocations/', random_point(self.rng))
+            assert response.status_code == 201, response.data
+        self.report('single POST /gpslocations/', total, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        sent = 0
+        while sent < total:
+            size = min(batch_size, total - sent)
+            points = [random_point(self.rng) for _ in range(size)]
+            response = self.post(batch_view, '/api/gpslocations/batch/', points)
+            assert response.status_code == 201, response.data
+            sent += size
+        self.report(f'batch POST (size {batch_size})', total, time.perf_counter() - start)
+
+    def bench_wire(self, options):
+        total = options['points']
+        batch_size = options['batch_size']
+        points = [random_point(self.rng, seq) for seq in range(total)]
+        json_points = [
+            dict(point, captured_at=f"2025-08-12T12:{seq // 60 % 60:02d}:{seq % 60:02d}Z")
+            for seq, point in enumerate(points)
+        ]
+        json_body = json.dumps(json_points).encode()
+        packed_body = encode_points(points)
+        self.stdout.write(f"JSON   {len(json_body):>10} bytes  ({len(json_body) / total:6.1f} bytes/point)")
+        self.stdout.write(f"packed {len(packed_body):>10} bytes  ({len(packed_body) / total:6.1f} bytes/point)")
+
+        # Parse cost: what the batch endpoint does before touching the database
+        start = time.perf_counter()
+        parsed = JSONParser().parse(io.BytesIO(json_body))
+        for point in parsed:
+            serializer = GPSLocationSerializer(data=point)
+            serializer.is_valid(raise_exception=True)
+        self.report('JSON parse + validate', total, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        PackedGPSParser().parse(io.BytesIO(packed_body))
+        self.report('packed parse', total, time.perf_counter() - start)
+
+        # End to end through the batch endpoint
+        batch_view = GPSLocationViewSet.as_view({'post': 'batch_create'})
+        for label, make_body, extra in (
+            ('batch POST JSON', lambda chunk: json_points[chunk], {}),
+            ('batch POST packed', lambda chunk: encode_points(points[chunk]), {'content_type': MEDIA_TYPE}),
+        ):
+            start = time.perf_counter()
+            for offset in range(0, total, batch_size):
+                response = self.post(batch_view, '/api/gpslocations/batch/',
+                                     make_body(slice(offset, offset + batch_size)), **extra)
+                assert response.status_code == 201, response.data
+            self.report(label, total, time.perf_counter() - start)
+            self.user.gps_locations.all().delete()
+
+    def bench_viewport(self, options):
+        total = options['rows']
+        now = timezone.now()
+        User = get_user_model()
+        start = time.perf_counter()
+        for offset in range(0, total, 10000):
+            users = User.objects.bulk_create([
+                User(username=f'__gps_benchmark_{n}__') for n in range(offset, min(offset + 10000, total))
+            ])
+            rows = []
+            for user in users:
+                # A fleet spread over a 1 x 1 degree metro area, updated within the last day
+                lat, lon = 22.0 + self.rng.random(), 113.6 + self.rng.random()
+                rows.append(GPSLatest(user=user, latitude=lat, longitude=lon, zkey=point_zkey(lat, lon),
+                                      timestamp=now - timedelta(seconds=self.rng.random() * 86400)))
+            GPSLatest.objects.bulk_create(rows)
+        if connection.vendor == 'postgresql':
+            # Autovacuum cannot see uncommitted rows; without statistics the
+            # planner would join the users table as if it were empty
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {GPSLatest._meta.db_table}, {User._meta.db_table}')
+        self.report('seed GPSLatest', total, time.perf_counter() - start, unit='rows')
+
+        view = GPSLocationViewSet.as_view({'get': 'get_latest_locations'})
+        since = (now - timedelta(minutes=10)).isoformat()
+        cases = []
+        for size in (0.01, 0.05, 0.2):
+            bbox = f'{114.1 - size / 2},{22.5 - size / 2},{114.1 + size / 2},{22.5 + size / 2}'
+            cases.append((f'bbox {size} deg', {'bbox': bbox}))
+        cases.append(('bbox 0.2 deg + since 10 min', {'bbox': cases[-1][1]['bbox'], 'since': since}))
+        cases.append(('since 10 min', {'since': since}))
+        # Last: its million-row response would slow down everything measured after it
+        cases.append(('whole fleet', {}))
+        for label, params in cases:
+            repeat = 1 if not params else 5
+            start = time.perf_counter()
+            for _ in range(repeat):
+                response = self.get(view, '/api/gpslocations/latest/', params)
+                assert response.status_code == 200, response.content
+            elapsed = (time.perf_counter() - start) / repeat
+            rows = len(json.loads(response.content))
+            self.stdout.write(self.style.SUCCESS(
+                f"{label:<28} {rows:>9} rows {len(response.content):>11} bytes in {elapsed * 1000:9.1f} ms"
+            ))
+
+    def bench_websocket(self, options):
+        User = get_user_model()
+        prefix = '__gps_benchmark_ws'
+        User.objects.bulk_create([
+            User(username=f'{prefix}_{n}__') for n in range(options['devices'] + options['viewers'])
+        ])
+        try:
+            users = list(User.objects.filter(username__startswith=prefix).order_by('pk'))
+            tickets = [issue_ticket(user) for user in users]
+            asyncio.run(self.drive_sockets(tickets[:options['devices']], tickets[options['devices']:],
+                                           options['seconds']))
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
+
+    async def drive_sockets(self, device_tickets, viewer_tickets, seconds):
+        """
+        Devices push fixes one at a time, each waiting for its ack, for
+        ``seconds`` while every viewer follows the whole fleet.
+        """
+        application = with_live_tracking(get_asgi_application())
+        devices = [BenchmarkSocket(application, ticket) for ticket in device_tickets]
+        viewers = [BenchmarkSocket(application, ticket) for ticket in viewer_tickets]
+        for socket in devices + viewers:
+            await socket.connect()
+        for viewer in viewers:
+            await viewer.send({'type': 'subscribe'})
+            message = await viewer.receive()
+            assert message['type'] == 'updates', message
+
+        counts = {'acks': 0, 'updates': 0, 'positions': 0}
+
+        async def push(socket):
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + seconds
+            ref = 0
+            while loop.time() < deadline:
+                ref += 1
+                await socket.send(dict(random_point(self.rng), type='fix', ref=ref))
+                message = await socket.receive()
+                while message['type'] != 'ack':
+                    assert message['type'] != 'error', message
+                    message = await socket.receive()
+                counts['acks'] += 1
+
+        async def follow(socket):
+            while True:
+                message = await socket.receive()
+                if message['type'] == 'updates':
+                    counts['updates'] += 1
+                    counts['positions'] += len(message['positions'])
+
+        followers = [asyncio.create_task(follow(viewer)) for viewer in viewers]
+        start = time.perf_counter()
+        await asyncio.gather(*(push(device) for device in devices))
+        elapsed = time.perf_counter() - start
+        # Let the last coalesced batch reach the viewers
+        await asyncio.sleep(0.5)
+        for task in followers:
+            task.cancel()
+        await asyncio.gather(*followers, return_exceptions=True)
+        for socket in devices + viewers:
+            await socket.close()
+
+        self.report(f'fixes acked (devices={len(devices)})', counts['acks'], elapsed, unit='msgs')
+        self.report(f'updates sent (viewers={len(viewers)})', counts['updates'], elapsed, unit='msgs')
+        self.report('positions delivered', counts['positions'], elapsed, unit='positions')
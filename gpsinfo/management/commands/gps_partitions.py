@@ -0,0 +1,64 @@
+# gpsinfo/management/commands/gps_partitions.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from gpsinfo import partitions
+from gpsinfo.conf import gps_setting
+
+
+class Command(BaseCommand):
+    help = (
+        'Pre-create future monthly GPSLocation partitions and detach/drop '
+        'partitions older than the retention window (PostgreSQL only)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=None,
+                            help="Months to create ahead of the current one (default GPSINFO['PARTITION_MONTHS_AHEAD'])")
+        parser.add_argument('--retain-months', type=int, default=None,
+                            help="Drop partitions entirely older than this many months "
+                                 "(default GPSINFO['PARTITION_RETAIN_MONTHS']; unset keeps everything)")
+        parser.add_argument('--detach-only', action='store_true',
+                            help='Detach expired partitions but keep them as standalone tables')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('GPSLocation partitioning requires PostgreSQL')
+
+        ahead = options['ahead'] if options['ahead'] is not None else gps_setting('PARTITION_MONTHS_AHEAD')
+        retain = options['retain_months']
+        if retain is None:
+            retain = gps_setting('PARTITION_RETAIN_MONTHS')
+        dry_run = options['dry_run']
+        current = partitions.month_start(timezone.now())
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                raise CommandError('gpsinfo_gpslocation is not partitioned; run migrate first')
+
+            if dry_run:
+                existing = set(partitions.list_partitions(cursor))
+                missing = [
+                    partitions.partition_name(partitions.add_months(current, offset))
+                    for offset in range(ahead + 1)
+                ]
+                for name in missing:
+                    if name not in existing:
+                        self.stdout.write(f"Would create {name}")
+            else:
+                for name in partitions.ensure_partitions(cursor, current, partitions.add_months(current, ahead)):
+                    self.stdout.write(self.style.SUCCESS(f"Created {name}"))
+
+            if retain is None:
+                return
+            cutoff = partitions.add_months(current, -retain)
+            for name in partitions.expired_partitions(cursor, cutoff):
+                if dry_run:
+                    self.stdout.write(f"Would {'detach' if options['detach_only'] else 'detach and drop'} {name}")
+                    continue
+                partitions.detach_partition(cursor, name, drop=not options['detach_only'])
+                self.stdout.write(self.style.SUCCESS(
+                    f"{'Detached' if options['detach_only'] else 'Detached and dropped'} {name}"
+                ))
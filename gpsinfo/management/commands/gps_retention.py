@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from gpsinfo.conf import gps_setting
+from gpsinfo.models import GPSLatestTombstone
+from gpsinfo.retention import downsample_raw_chunk, summarize_day_chunk, tier_cutoff
+
+
+class Command(BaseCommand):
+    help = 'Downsample aged GPS history into the minute and daily tiers (safe to interrupt and re-run)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raw-days', type=int, default=None, help="Defaults to GPSINFO['RETENTION_RAW_DAYS']")
+        parser.add_argument('--minute-days', type=int, default=None, help="Defaults to GPSINFO['RETENTION_MINUTE_DAYS']")
+        parser.add_argument('--window-minutes', type=int, default=60, help='Raw points per chunk, as a time window per user')
+        parser.add_argument('--max-chunks', type=int, default=None, help='Stop after this many chunks; the next run resumes')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Seconds to pause between chunks')
+        parser.add_argument('--user', type=int, default=None, help='Only process this user id')
+
+    def handle(self, *args, **options):
+        tombstone_cutoff = tier_cutoff(gps_setting('DELTA_TOMBSTONE_DAYS'))
+        if tombstone_cutoff is not None:
+            pruned, _ = GPSLatestTombstone.objects.filter(created_at__lt=tombstone_cutoff).delete()
+            self.stdout.write(f"Pruned {pruned} change-feed tombstones")
+
+        raw_days = options['raw_days'] if options['raw_days'] is not None else gps_setting('RETENTION_RAW_DAYS')
+        minute_days = options['minute_days'] if options['minute_days'] is not None else gps_setting('RETENTION_MINUTE_DAYS')
+        if raw_days is None and minute_days is None:
+            self.stdout.write("Retention is disabled (RETENTION_RAW_DAYS and RETENTION_MINUTE_DAYS are None)")
+            return
+        if raw_days is not None and minute_days is not None and minute_days < raw_days:
+            raise CommandError("--minute-days must not be shorter than --raw-days")
+
+        raw_cutoff = tier_cutoff(raw_days)
+        minute_cutoff = tier_cutoff(minute_days)
+        window = timedelta(minutes=options['window_minutes'])
+        bucket_seconds = gps_setting('RETENTION_BUCKET_SECONDS')
+        move_m = gps_setting('RETENTION_MOVE_M')
+
+        stages = []
+        if raw_cutoff is not None:
+            stages.append(('raw', lambda user_id: downsample_raw_chunk(user_id, raw_cutoff, window, bucket_seconds, move_m)))
+        if minute_cutoff is not None:
+            stages.append(('minute', lambda user_id: summarize_day_chunk(user_id, minute_cutoff)))
+
+        if options['user'] is not None:
+            user_ids = [options['user']]
+        else:
+            user_ids = get_user_model().objects.order_by('pk').values_list('pk', flat=True).iterator()
+
+        started = time.perf_counter()
+        chunks = 0
+        totals = {name: [0, 0] for name, _ in stages}
+        for user_id in user_ids:
+            for name, stage in stages:
+                while options['max_chunks'] is None or chunks < options['max_chunks']:
+                    result = stage(user_id)
+                    if result is None:
+                        break
+                    chunks += 1
+                    totals[name][0] += result[0]
+                    totals[name][1] += result[1]
+                    if options['sleep']:
+                        time.sleep(options['sleep'])
+
+        for name, (read, written) in totals.items():
+            target = 'minute points' if name == 'raw' else 'daily summaries'
+            self.stdout.write(f"{name}: {read} rows folded into {written} {target}")
+        self.stdout.write(self.style.SUCCESS(f"Processed {chunks} chunks in {time.perf_counter() - started:.2f}s"))
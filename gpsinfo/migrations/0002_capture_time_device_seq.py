@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:14
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpslocation',
+            name='captured_at',
+            field=models.DateTimeField(blank=True, help_text='Time when the device captured the location (optional, from device).', null=True),
+        ),
+        migrations.AddField(
+            model_name='gpslocation',
+            name='device_seq',
+            field=models.BigIntegerField(blank=True, help_text='Client sequence number / idempotency key, unique per user (optional, from device).', null=True),
+        ),
+        migrations.AlterField(
+            model_name='gpslocation',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Time when the location was received by the server.'),
+        ),
+        migrations.AddConstraint(
+            model_name='gpslocation',
+            constraint=models.UniqueConstraint(fields=('user', 'device_seq'), name='gpsinfo_gpslocation_user_seq_uniq'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0002_capture_time_device_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GPSSpoolCheckpoint',
+            fields=[
+                ('segment', models.CharField(help_text='File name of the spool segment being drained.', max_length=255, primary_key=True, serialize=False)),
+                ('offset', models.BigIntegerField(default=0, help_text='Byte offset up to which the segment has been written to the database.')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'GPS Spool Checkpoint',
+                'verbose_name_plural': 'GPS Spool Checkpoints',
+            },
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Converts gpsinfo_gpslocation into a table range-partitioned by month on
+# "timestamp" (PostgreSQL only; other databases keep the plain table).
+#
+# The Django model is unchanged: the ORM still sees "id" as the primary key,
+# while the database key is (id, timestamp) because PostgreSQL requires the
+# partition key in every unique constraint. For the same reason the
+# (user, device_seq) unique constraint is recreated per partition.
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+from gpsinfo import partitions
+
+MONTHS_AHEAD = 3
+
+
+def partition_gpslocation(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    user_table = apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+    columns = 'id, latitude, longitude, "timestamp", altitude, accuracy, user_id, captured_at, device_seq'
+
+    with connection.cursor() as cursor:
+        if partitions.is_partitioned(cursor):
+            return
+
+        cursor.execute('ALTER TABLE gpsinfo_gpslocation RENAME TO gpsinfo_gpslocation_legacy')
+        # Free the index/constraint names for the new table
+        cursor.execute('ALTER TABLE gpsinfo_gpslocation_legacy DROP CONSTRAINT gpsinfo_gpslocation_user_seq_uniq')
+        cursor.execute('DROP INDEX gpsinfo_gps_user_id_a56d44_idx')
+
+        cursor.execute('CREATE SEQUENCE gpsinfo_gpslocation_part_id_seq AS bigint')
+        cursor.execute(f'''
+            CREATE TABLE gpsinfo_gpslocation (
+                id bigint NOT NULL DEFAULT nextval('gpsinfo_gpslocation_part_id_seq'),
+                latitude double precision NOT NULL,
+                longitude double precision NOT NULL,
+                "timestamp" timestamp with time zone NOT NULL,
+                altitude double precision NULL,
+                accuracy double precision NULL,
+                user_id bigint NULL REFERENCES "{user_table}" (id) DEFERRABLE INITIALLY DEFERRED,
+                captured_at timestamp with time zone NULL,
+                device_seq bigint NULL,
+                PRIMARY KEY (id, "timestamp")
+            ) PARTITION BY RANGE ("timestamp")
+        ''')
+        cursor.execute('ALTER SEQUENCE gpsinfo_gpslocation_part_id_seq OWNED BY gpsinfo_gpslocation.id')
+
+        cursor.execute('SELECT min("timestamp"), max("timestamp") FROM gpsinfo_gpslocation_legacy')
+        first, last = cursor.fetchone()
+        now = timezone.now()
+        first = min(first or now, now)
+        last = max(last or now, now)
+        partitions.ensure_partitions(cursor, first, partitions.add_months(partitions.month_start(last), MONTHS_AHEAD))
+        partitions.create_default_partition(cursor)
+        # Same name as the model's index so Django's state still matches;
+        # created on the parent, it cascades to every partition
+        cursor.execute('CREATE INDEX gpsinfo_gps_user_id_a56d44_idx ON gpsinfo_gpslocation (user_id, "timestamp")')
+
+        cursor.execute(f'INSERT INTO gpsinfo_gpslocation ({columns}) SELECT {columns} FROM gpsinfo_gpslocation_legacy')
+        cursor.execute(
+            "SELECT setval('gpsinfo_gpslocation_part_id_seq', "
+            "COALESCE((SELECT max(id) FROM gpsinfo_gpslocation), 0) + 1, false)"
+        )
+        # Run the deferred FK checks for the copied rows before dropping the old table
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute('DROP TABLE gpsinfo_gpslocation_legacy')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0003_spool_checkpoint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Irreversible in place: the partitioned table keeps working with the
+        # previous migrations' model state, so reversing is a no-op.
+        migrations.RunPython(partition_gpslocation, migrations.RunPython.noop),
+    ]
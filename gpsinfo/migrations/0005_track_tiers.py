@@ -0,0 +1,59 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0004_partition_gpslocation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GPSTrackDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='UTC day summarised by this row.')),
+                ('timestamp', models.DateTimeField(help_text='Time of the last point of the day.')),
+                ('first_at', models.DateTimeField(help_text='Time of the first point of the day.')),
+                ('latitude', models.FloatField(help_text='Latitude of the last point of the day.')),
+                ('longitude', models.FloatField(help_text='Longitude of the last point of the day.')),
+                ('min_latitude', models.FloatField()),
+                ('max_latitude', models.FloatField()),
+                ('min_longitude', models.FloatField()),
+                ('max_longitude', models.FloatField()),
+                ('distance_m', models.FloatField(default=0, help_text='Distance travelled along the downsampled track, in meters.')),
+                ('samples', models.PositiveIntegerField(default=0, help_text='Number of raw points summarised by this row.')),
+                ('user', models.ForeignKey(help_text='The user associated with this daily summary.', on_delete=django.db.models.deletion.CASCADE, related_name='gps_track_days', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'GPS Track Day',
+                'verbose_name_plural': 'GPS Track Days',
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='gpsinfo_gpstrackdaily_user_day_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='GPSTrackMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(help_text='Time of the kept point (device capture time when known).')),
+                ('latitude', models.FloatField(help_text='Latitude in decimal degrees (e.g., 37.7749).')),
+                ('longitude', models.FloatField(help_text='Longitude in decimal degrees (e.g., -122.4194).')),
+                ('altitude', models.FloatField(blank=True, help_text='Altitude in meters (optional, for future use).', null=True)),
+                ('accuracy', models.FloatField(blank=True, help_text='GPS accuracy in meters (optional, from device).', null=True)),
+                ('samples', models.PositiveIntegerField(default=1, help_text='Number of raw points this point stands for.')),
+                ('user', models.ForeignKey(help_text='The user associated with this track point.', on_delete=django.db.models.deletion.CASCADE, related_name='gps_track_minutes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'GPS Track Minute',
+                'verbose_name_plural': 'GPS Track Minutes',
+                'ordering': ['-timestamp'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'timestamp'), name='gpsinfo_gpstrackminute_user_ts_uniq')],
+            },
+        ),
+    ]
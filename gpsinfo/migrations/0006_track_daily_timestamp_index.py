@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0005_track_tiers'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gpstrackdaily',
+            index=models.Index(fields=['user', 'timestamp'], name='gpsinfo_gps_user_id_156c32_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0006_track_daily_timestamp_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpslatest',
+            name='zkey',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, help_text='Z-order spatial cell key of (latitude, longitude), see gpsinfo/spatial.py.', null=True),
+        ),
+        migrations.AddField(
+            model_name='gpslocation',
+            name='zkey',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='Z-order spatial cell key of (latitude, longitude), see gpsinfo/spatial.py.', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='gpslocation',
+            index=models.Index(fields=['zkey'], name='gpsinfo_gps_zkey_d8b336_idx'),
+        ),
+    ]
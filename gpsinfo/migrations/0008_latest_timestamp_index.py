@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0007_spatial_zkey'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gpslatest',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, help_text='Time when the location was recorded.'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0008_latest_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GPSLatestTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField(help_text='Id of the user (kept after the user itself is deleted).')),
+                ('username', models.CharField(max_length=150)),
+                ('user_group', models.CharField(blank=True, help_text='Group the user left, or the group at deletion time.', max_length=15)),
+                ('deleted', models.BooleanField(default=False, help_text='True if the latest position was removed altogether.')),
+                ('seq', models.BigIntegerField(db_index=True, default=0, help_text='Update sequence of the removal (see gpsinfo/changes.py).')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Latest GPS Tombstone',
+                'verbose_name_plural': 'Latest GPS Tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='gpslatest',
+            name='seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, help_text='Update sequence of the last write, for the change feed (see gpsinfo/changes.py).'),
+        ),
+    ]
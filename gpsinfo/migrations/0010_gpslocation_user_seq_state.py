@@ -0,0 +1,23 @@
+# Drops the (user, device_seq) unique constraint from the model state only.
+#
+# On PostgreSQL 0004 replaced it with one unique index per monthly partition,
+# so the state no longer matched the database there. Other databases keep the
+# constraint from 0002 in the table; ingest relies on it through
+# ON CONFLICT DO NOTHING / INSERT OR IGNORE, which needs no declared target.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0009_latest_change_feed'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveConstraint(model_name='gpslocation', name='gpsinfo_gpslocation_user_seq_uniq'),
+            ],
+        ),
+    ]
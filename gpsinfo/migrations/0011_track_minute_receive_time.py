@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0010_gpslocation_user_seq_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gpstrackminute',
+            name='timestamp',
+            field=models.DateTimeField(help_text='Time the kept point was received by the server, as in GPSLocation.'),
+        ),
+    ]
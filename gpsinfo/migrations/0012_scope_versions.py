@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0011_track_minute_receive_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GPSScopeVersion',
+            fields=[
+                ('scope', models.CharField(max_length=600, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(help_text="Advanced by every committed change to the scope's latest positions.")),
+                ('modified', models.DateTimeField(help_text='Time of the last change, for Last-Modified.')),
+            ],
+            options={
+                'verbose_name': 'GPS Scope Version',
+                'verbose_name_plural': 'GPS Scope Versions',
+            },
+        ),
+    ]
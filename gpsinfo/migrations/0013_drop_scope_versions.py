@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:31
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gpsinfo', '0012_scope_versions'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='GPSScopeVersion',
+        ),
+    ]
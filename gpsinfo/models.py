@@ -1,7 +1,10 @@
 # gpsinfo/models.py
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from .changes import NextSeq
+from .spatial import SpatialQuerySet, point_zkey
 
 class GPSLocation(models.Model):
     """
@@ -21,8 +24,18 @@ class GPSLocation(models.Model):
         help_text="Longitude in decimal degrees (e.g., -122.4194)."
     )
     timestamp = models.DateTimeField(
-        auto_now_add=True,
-        help_text="Time when the location was recorded."
+        default=timezone.now,
+        help_text="Time when the location was received by the server."
+    )
+    captured_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Time when the device captured the location (optional, from device)."
+    )
+    device_seq = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text="Client sequence number / idempotency key, unique per user (optional, from device)."
     )
     altitude = models.FloatField(
         null=True,
@@ -34,15 +47,36 @@ class GPSLocation(models.Model):
         blank=True,
         help_text="GPS accuracy in meters (optional, from device)."
     )
+    zkey = models.BigIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Z-order spatial cell key of (latitude, longitude), see gpsinfo/spatial.py."
+    )
+
+    objects = SpatialQuerySet.as_manager()
 
     class Meta:
         indexes = [
             models.Index(fields=['user', 'timestamp']),
+            models.Index(fields=['zkey']),
         ]
+        # (user, device_seq) is unique in the database but not declared here:
+        # a table constraint on SQLite (migration 0002), one index per monthly
+        # partition on PostgreSQL (partitions.py), so there only within a
+        # month. Replayed uploads carry the same device_seq and are dropped
+        # by ON CONFLICT DO NOTHING.
         ordering = ['-timestamp']
         verbose_name = 'GPS Location'
         verbose_name_plural = 'GPS Locations'
 
+    def save(self, *args, **kwargs):
+        self.zkey = point_zkey(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'zkey'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         if self.user:
             # Use username instead of email for display
@@ -78,13 +112,203 @@ class GPSLatest(models.Model):
         help_text="GPS accuracy in meters (optional, from device)."
     )
     timestamp = models.DateTimeField(
+        db_index=True,
         help_text="Time when the location was recorded."
     )
+    zkey = models.BigIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="Z-order spatial cell key of (latitude, longitude), see gpsinfo/spatial.py."
+    )
+    seq = models.BigIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        help_text="Update sequence of the last write, for the change feed (see gpsinfo/changes.py)."
+    )
+
+    objects = SpatialQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Latest GPS Location'
         verbose_name_plural = 'Latest GPS Locations'
 
+    def save(self, *args, **kwargs):
+        self.zkey = point_zkey(self.latitude, self.longitude)
+        self.seq = NextSeq()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'seq'}
+            if {'latitude', 'longitude'} & set(update_fields):
+                kwargs['update_fields'] |= {'zkey'}
+        super().save(*args, **kwargs)
+        # The stored value is only known to the database
+        self.refresh_from_db(fields=['seq'])
+
     def __str__(self):
         # Use username instead of email for display
-        return f"{self.user.username}'s latest at ({self.latitude}, {self.longitude}) on {self.timestamp}"
\ No newline at end of file
+        return f"{self.user.username}'s latest at ({self.latitude}, {self.longitude}) on {self.timestamp}"
+
+class GPSSpoolCheckpoint(models.Model):
+    """
+    Replay progress of one spool segment, committed together with the points
+    it covers so drain_gps_spool can resume without duplicating rows.
+    """
+    segment = models.CharField(
+        max_length=255,
+        primary_key=True,
+        help_text="File name of the spool segment being drained."
+    )
+    offset = models.BigIntegerField(
+        default=0,
+        help_text="Byte offset up to which the segment has been written to the database."
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'GPS Spool Checkpoint'
+        verbose_name_plural = 'GPS Spool Checkpoints'
+
+    def __str__(self):
+        return f"{self.segment} @ {self.offset}"
+
+class GPSTrackMinute(models.Model):
+    """
+    Downsampled history: at most one point per minute (plus extra points on
+    significant movement) kept after raw GPSLocation rows age out.
+    Written by manage.py gps_retention.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='gps_track_minutes',
+        help_text="The user associated with this track point."
+    )
+    timestamp = models.DateTimeField(
+        help_text="Time the kept point was received by the server, as in GPSLocation."
+    )
+    latitude = models.FloatField(
+        help_text="Latitude in decimal degrees (e.g., 37.7749)."
+    )
+    longitude = models.FloatField(
+        help_text="Longitude in decimal degrees (e.g., -122.4194)."
+    )
+    altitude = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Altitude in meters (optional, for future use)."
+    )
+    accuracy = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="GPS accuracy in meters (optional, from device)."
+    )
+    samples = models.PositiveIntegerField(
+        default=1,
+        help_text="Number of raw points this point stands for."
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'timestamp'], name='gpsinfo_gpstrackminute_user_ts_uniq'),
+        ]
+        ordering = ['-timestamp']
+        verbose_name = 'GPS Track Minute'
+        verbose_name_plural = 'GPS Track Minutes'
+
+    def __str__(self):
+        return f"{self.user.username} at ({self.latitude}, {self.longitude}) on {self.timestamp} x{self.samples}"
+
+class GPSTrackDaily(models.Model):
+    """
+    Oldest history tier: one summary row per user and UTC day, built from
+    GPSTrackMinute rows once they age out.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='gps_track_days',
+        help_text="The user associated with this daily summary."
+    )
+    day = models.DateField(
+        help_text="UTC day summarised by this row."
+    )
+    timestamp = models.DateTimeField(
+        help_text="Time of the last point of the day."
+    )
+    first_at = models.DateTimeField(
+        help_text="Time of the first point of the day."
+    )
+    latitude = models.FloatField(
+        help_text="Latitude of the last point of the day."
+    )
+    longitude = models.FloatField(
+        help_text="Longitude of the last point of the day."
+    )
+    min_latitude = models.FloatField()
+    max_latitude = models.FloatField()
+    min_longitude = models.FloatField()
+    max_longitude = models.FloatField()
+    distance_m = models.FloatField(
+        default=0,
+        help_text="Distance travelled along the downsampled track, in meters."
+    )
+    samples = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of raw points summarised by this row."
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'timestamp']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='gpsinfo_gpstrackdaily_user_day_uniq'),
+        ]
+        ordering = ['-day']
+        verbose_name = 'GPS Track Day'
+        verbose_name_plural = 'GPS Track Days'
+
+    def __str__(self):
+        return f"{self.user.username} on {self.day}: {self.samples} points, {self.distance_m:.0f} m"
+
+class GPSLatestTombstone(models.Model):
+    """
+    A user whose latest position left a viewer scope, so the change feed can
+    tell clients to drop it: the GPSLatest row was deleted, or the user moved
+    out of ``user_group``.
+    """
+    user_id = models.BigIntegerField(
+        help_text="Id of the user (kept after the user itself is deleted)."
+    )
+    username = models.CharField(max_length=150)
+    user_group = models.CharField(
+        max_length=15,
+        blank=True,
+        help_text="Group the user left, or the group at deletion time."
+    )
+    deleted = models.BooleanField(
+        default=False,
+        help_text="True if the latest position was removed altogether."
+    )
+    seq = models.BigIntegerField(
+        default=0,
+        db_index=True,
+        help_text="Update sequence of the removal (see gpsinfo/changes.py)."
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Latest GPS Tombstone'
+        verbose_name_plural = 'Latest GPS Tombstones'
+
+    def save(self, *args, **kwargs):
+        self.seq = NextSeq()
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['seq'])
+
+    def __str__(self):
+        return f"{self.username} left {self.user_group or 'all'} at seq {self.seq}"
+
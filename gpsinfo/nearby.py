@@ -0,0 +1,256 @@
+# gpsinfo/nearby.py
+"""
+In-memory grid index of every user's latest position, for k-nearest queries
+without reading the whole GPSLatest table.
+
+The index is built from GPSLatest and kept current by the ``latest_changed``
+signal sent from the ingest write path. A background thread, started with the
+app server (rbackend/wsgi.py, asgi.py) or else on first use, builds it and
+then rebuilds it every NEARBY_REFRESH_S seconds to pick up positions written
+by other worker processes. Each rebuild is swapped in whole, with the writes
+applied while it was being read replayed onto it, so requests never wait for
+one and never see a half-built grid.
+"""
+import heapq
+import logging
+import math
+import threading
+import time
+
+from django.db import close_old_connections, connection
+
+from .conf import gps_setting
+from .geo import EARTH_RADIUS_M, haversine_m
+
+logger = logging.getLogger(__name__)
+
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+
+
+class LatestGrid:
+    """
+    Uniform latitude/longitude grid of ``cell_deg`` degree cells mapping
+    cells to users, with each user's latest (latitude, longitude, timestamp).
+    """
+
+    def __init__(self, cell_deg=0.01):
+        self.cell_deg = cell_deg
+        self.columns = int(math.ceil(360.0 / cell_deg))
+        self.rows = int(math.ceil(180.0 / cell_deg))
+        self._cells = {}
+        self._points = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat, lon):
+        x = int((lon + 180.0) / self.cell_deg) % self.columns
+        y = min(int((lat + 90.0) / self.cell_deg), self.rows - 1)
+        return x, y
+
+    def update(self, user_id, lat, lon, timestamp):
+        """
+        Move a user to a new position unless the indexed one is newer.
+        """
+        cell = self._cell(lat, lon)
+        with self._lock:
+            current = self._points.get(user_id)
+            if current is not None:
+                if current[2] > timestamp:
+                    return
+                old = self._cells.get(current[3])
+                if old is not None and current[3] != cell:
+                    old.discard(user_id)
+                    if not old:
+                        del self._cells[current[3]]
+            self._points[user_id] = (lat, lon, timestamp, cell)
+            self._cells.setdefault(cell, set()).add(user_id)
+
+    def remove(self, user_id):
+        with self._lock:
+            current = self._points.pop(user_id, None)
+            if current is not None:
+                members = self._cells.get(current[3])
+                if members is not None:
+                    members.discard(user_id)
+                    if not members:
+                        del self._cells[current[3]]
+
+    def nearest(self, lat, lon, radius_m, limit, exclude=None):
+        """
+        Up to ``limit`` (distance_m, user_id) pairs within ``radius_m`` of the
+        point, nearest first. Searches rings of cells outwards from the
+        point's cell and stops once no unvisited cell can hold anything
+        closer than the candidates found.
+        """
+        with self._lock:
+            points = self._points
+            # Metres covered by one ring, using the narrowest cell width the search can reach
+            reach = min(89.9, abs(lat) + radius_m / METRES_PER_DEGREE)
+            ring_m = self.cell_deg * METRES_PER_DEGREE * math.cos(math.radians(reach))
+            max_ring = int(radius_m / max(ring_m, 1e-9)) + 1
+            if (2 * max_ring + 1) ** 2 >= len(points):
+                # Fewer users than cells to visit: checking everyone is cheaper
+                return self._scan(points, lat, lon, radius_m, limit, exclude)
+
+            cx, cy = self._cell(lat, lon)
+            found = []
+            for ring in range(max_ring + 1):
+                for x, y in self._ring(cx, cy, ring):
+                    for user_id in self._cells.get((x, y), ()):
+                        if user_id == exclude:
+                            continue
+                        point = points[user_id]
+                        distance = haversine_m(lat, lon, point[0], point[1])
+                        if distance <= radius_m:
+                            found.append((distance, user_id))
+                # Anything in ring + 1 or beyond is at least ring * ring_m away
+                if len(found) >= limit and heapq.nsmallest(limit, found)[-1][0] <= ring * ring_m:
+                    break
+            return heapq.nsmallest(limit, found)
+
+    def _ring(self, cx, cy, ring):
+        if ring == 0:
+            yield cx, cy
+            return
+        for dx in range(-ring, ring + 1):
+            for dy in (-ring, ring) if abs(dx) != ring else range(-ring, ring + 1):
+                y = cy + dy
+                if 0 <= y < self.rows:
+                    yield (cx + dx) % self.columns, y
+
+    @staticmethod
+    def _scan(points, lat, lon, radius_m, limit, exclude):
+        found = []
+        for user_id, point in points.items():
+            if user_id == exclude:
+                continue
+            distance = haversine_m(lat, lon, point[0], point[1])
+            if distance <= radius_m:
+                found.append((distance, user_id))
+        return heapq.nsmallest(limit, found)
+
+
+class LatestIndex:
+    """
+    The process-wide LatestGrid plus its refresh from the database.
+    """
+
+    def __init__(self, cell_deg, refresh_s):
+        self.cell_deg = cell_deg
+        self.refresh_s = refresh_s
+        self.grid = None
+        self.built_at = 0.0
+        self._build_lock = threading.Lock()
+        # Changes applied while a rebuild reads GPSLatest, replayed onto it
+        self._journal = None
+        self._journal_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def get(self):
+        """
+        The current grid. Only a process whose background build has not
+        finished yet waits for (or does) one.
+        """
+        if self.grid is None:
+            with self._build_lock:
+                if self.grid is None:
+                    self._rebuild()
+        self.start()
+        return self.grid
+
+    def start(self):
+        """
+        Start the background thread building and refreshing the grid,
+        unless it runs already (a fork leaves it behind in the parent).
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='gpsinfo-nearby', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            wait = self.refresh_s
+            if self.grid is None or time.monotonic() - self.built_at >= self.refresh_s:
+                try:
+                    close_old_connections()
+                    self.rebuild()
+                except Exception:
+                    logger.exception("Rebuilding the nearby index failed")
+                finally:
+                    connection.close()
+            else:
+                wait = self.built_at + self.refresh_s - time.monotonic()
+            self._stopping.wait(wait)
+
+    def rebuild(self):
+        with self._build_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        from .models import GPSLatest
+
+        with self._journal_lock:
+            self._journal = []
+        try:
+            grid = LatestGrid(self.cell_deg)
+            for user_id, lat, lon, timestamp in GPSLatest.objects.values_list(
+                    'user_id', 'latitude', 'longitude', 'timestamp').iterator(chunk_size=5000):
+                grid.update(user_id, lat, lon, timestamp)
+            with self._journal_lock:
+                for change in self._journal:
+                    if change[0] == 'remove':
+                        grid.remove(change[1])
+                    else:
+                        grid.update(*change[1:])
+                self.grid = grid
+                self.built_at = time.monotonic()
+        finally:
+            with self._journal_lock:
+                self._journal = None
+
+    def apply(self, rows):
+        """
+        Feed committed GPSLatest rows (dicts from ingest.latest_row) into the
+        grid and any rebuild in progress; a grid not built yet will read them
+        from the database anyway.
+        """
+        changes = [('update', row['user_id'], row['latitude'], row['longitude'], row['timestamp']) for row in rows]
+        self._record(changes)
+
+    def discard(self, user_id):
+        self._record([('remove', user_id)])
+
+    def _record(self, changes):
+        with self._journal_lock:
+            grid = self.grid
+            if self._journal is not None:
+                self._journal.extend(changes)
+        if grid is not None:
+            for change in changes:
+                if change[0] == 'remove':
+                    grid.remove(change[1])
+                else:
+                    grid.update(*change[1:])
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_latest_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LatestIndex(gps_setting('NEARBY_CELL_DEG'), gps_setting('NEARBY_REFRESH_S'))
+    return _index
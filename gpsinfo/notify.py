@@ -0,0 +1,270 @@
+# gpsinfo/notify.py
+"""
+Live position fan-out across worker processes and nodes through PostgreSQL
+LISTEN/NOTIFY, with GPSINFO['LIVE_BROKER'] = 'gpsinfo.notify.PgNotifyBroker'.
+
+Publishing sends the committed events with pg_notify on the
+``gpsinfo_latest`` channel, packed into as few notifications as the 8000
+byte payload limit allows, in one statement. Each process that has live
+subscribers keeps one LISTEN connection in a listener thread, which drains
+the notifications that arrived during a tick and hands them to the local
+InMemoryBroker in one batch; publishing processes receive their own events
+the same way. After the listener reconnects, notifications sent meanwhile
+are lost, so every local subscriber resyncs from the database.
+
+Writes only build and send events while some process has live subscribers:
+those processes keep a presence entry in the shared cache tier
+(rbackend/cache.py) alive, and publishers look it up at most every CHECK_S
+seconds. A process getting its first subscriber resyncs it once that long
+later, for the events of publishers that had not seen it yet.
+
+On other databases (SQLite in tests and development) notifications go
+through LocalNotifyChannel, an in-process stand-in with the same payloads,
+batching and threading.
+"""
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+
+from .broker import InMemoryBroker, LatestEvent
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'gpsinfo_latest'
+PRESENCE_KEY = 'gpsinfo:live:listening'
+# Seconds a process's presence outlives its last refresh, and that
+# publishers rely on their last look at it
+PRESENCE_S = 10.0
+CHECK_S = 1.0
+# PostgreSQL rejects payloads of 8000 bytes or more
+MAX_PAYLOAD = 7999
+
+
+def encode_notifications(events, limit=MAX_PAYLOAD):
+    """
+    Pack events into JSON payloads of at most ``limit`` bytes, each a list of
+    [kind, username, scopes, data] with the already serialized data spliced
+    in as is.
+    """
+    payloads, items, size = [], [], 2
+    for event in events:
+        item = f'[{json.dumps(event.kind)},{json.dumps(event.username)},' \
+               f'{json.dumps(list(event.scopes), separators=(",", ":"))},{event.data}]'
+        length = len(item.encode()) + 1
+        if items and size + length > limit:
+            payloads.append(f"[{','.join(items)}]")
+            items, size = [], 2
+        items.append(item)
+        size += length
+    if items:
+        payloads.append(f"[{','.join(items)}]")
+    return payloads
+
+
+def decode_notification(payload):
+    return [
+        LatestEvent(kind, username, tuple(scopes), json.dumps(data, separators=(',', ':')))
+        for kind, username, scopes, data in json.loads(payload)
+    ]
+
+
+class LocalNotifyChannel:
+    """
+    In-process stand-in for a NOTIFY channel: every started listener gets
+    every payload, from a thread of its own, batched per tick.
+    """
+
+    def __init__(self, tick_s=0.05):
+        self.tick_s = tick_s
+        self._queues = []
+        self._lock = threading.Lock()
+
+    def notify(self, payloads):
+        with self._lock:
+            queues = list(self._queues)
+        for listener in queues:
+            for payload in payloads:
+                listener.put(payload)
+
+    def listen(self, deliver, reconnected):
+        """
+        Start a listener calling ``deliver(payloads)`` once per tick with
+        notifications. ``reconnected`` is never called: nothing is lost here.
+        """
+        listener = queue.SimpleQueue()
+        with self._lock:
+            self._queues.append(listener)
+
+        def run():
+            while True:
+                payloads = [listener.get()]
+                time.sleep(self.tick_s)
+                while not listener.empty():
+                    payloads.append(listener.get())
+                deliver(payloads)
+
+        threading.Thread(target=run, name='gpsinfo-notify-local', daemon=True).start()
+
+
+class PgNotifyChannel:
+    """
+    pg_notify on publish, and a LISTEN connection of its own per listener.
+    """
+
+    def __init__(self, tick_s=0.05, retry_s=1.0):
+        self.tick_s = tick_s
+        self.retry_s = retry_s
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def notify(self, payloads):
+        # The caller's connection, in autocommit: the events are committed already
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload',
+                           [CHANNEL, payloads])
+
+    def listen(self, deliver, reconnected):
+        """
+        Start a listener thread calling ``deliver(payloads)`` once per tick
+        with notifications, and ``reconnected()`` whenever it had to
+        reconnect.
+        """
+        params = connection.get_connection_params()
+        thread = threading.Thread(target=self._run, args=(connection, params, deliver, reconnected),
+                                  name='gpsinfo-notify-listen', daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def stop(self):
+        """
+        Stop the listeners and close their connections.
+        """
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _wait(self, conn):
+        # The payloads of a tick's worth of notifications, taken together
+        if callable(getattr(conn, 'notifies', None)):
+            # psycopg 3
+            payloads = [notification.payload for notification in conn.notifies(timeout=1, stop_after=1)]
+            time.sleep(self.tick_s)
+            payloads += [notification.payload for notification in conn.notifies(timeout=0)]
+            return payloads
+        if not select.select([conn], [], [], 1)[0]:
+            return []
+        time.sleep(self.tick_s)
+        conn.poll()
+        # poll() reads what one recv returns; drain the socket before delivering
+        while select.select([conn], [], [], 0)[0]:
+            conn.poll()
+        payloads = [notification.payload for notification in conn.notifies]
+        conn.notifies.clear()
+        return payloads
+
+    def _run(self, wrapper, params, deliver, reconnected):
+        first = True
+        while not self._stopped.is_set():
+            try:
+                conn = wrapper.get_new_connection(params)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+                if not first:
+                    reconnected()
+                first = False
+                try:
+                    while not self._stopped.is_set():
+                        payloads = self._wait(conn)
+                        if payloads:
+                            deliver(payloads)
+                finally:
+                    conn.close()
+            except Exception:
+                logger.exception(f"LISTEN {CHANNEL} failed; reconnecting in {self.retry_s} s")
+                first = False
+                self._stopped.wait(self.retry_s)
+
+
+class PgNotifyBroker(InMemoryBroker):
+    """
+    InMemoryBroker whose publish() goes through a notification channel, so
+    subscribers in every process receive it. The listener and the presence
+    refresh start with the process's first subscription.
+    """
+
+    def __init__(self, max_pending=None, flush_s=None, heartbeat_s=None, channel=None, check_s=CHECK_S):
+        super().__init__(max_pending, flush_s, heartbeat_s)
+        self.channel = channel
+        self.check_s = check_s
+        self._listening = False
+        self._listen_lock = threading.Lock()
+        self._others = False
+        self._checked_at = None
+
+    def get_channel(self):
+        if self.channel is None:
+            if connection.vendor == 'postgresql':
+                self.channel = PgNotifyChannel(self.flush_s / 2)
+            else:
+                self.channel = LocalNotifyChannel(self.flush_s / 2)
+        return self.channel
+
+    def listening(self):
+        if self._count > 0:
+            return True
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_s:
+            self._others = cache.get(PRESENCE_KEY) is not None
+            self._checked_at = now
+        return self._others
+
+    def publish(self, events):
+        if not events:
+            return
+        try:
+            self.get_channel().notify(encode_notifications(events))
+        except DatabaseError:
+            # The write has committed regardless; live viewers get it when they reconnect
+            logger.exception(f"Could not notify {CHANNEL} of {len(events)} events")
+
+    def subscribe(self, scopes):
+        if not self._listening:
+            with self._listen_lock:
+                if not self._listening:
+                    self.get_channel().listen(self._deliver, self.resync)
+                    threading.Thread(target=self._keep_present, name='gpsinfo-notify-presence', daemon=True).start()
+                    self._listening = True
+        first = self._count == 0
+        subscription = super().subscribe(scopes)
+        if first:
+            cache.set(PRESENCE_KEY, True, PRESENCE_S)
+        if first and self.check_s:
+            timer = threading.Timer(self.check_s, self.resync)
+            timer.daemon = True
+            timer.start()
+        return subscription
+
+    def _keep_present(self):
+        while True:
+            time.sleep(PRESENCE_S / 3)
+            if self._count > 0:
+                try:
+                    cache.set(PRESENCE_KEY, True, PRESENCE_S)
+                except Exception:
+                    logger.exception("Could not refresh the live presence entry")
+
+    def _deliver(self, payloads):
+        events = []
+        for payload in payloads:
+            try:
+                events += decode_notification(payload)
+            except (ValueError, TypeError):
+                logger.warning(f"Ignoring malformed {CHANNEL} notification: {payload[:200]!r}")
+        InMemoryBroker.publish(self, events)
@@ -0,0 +1,156 @@
+# gpsinfo/pagination.py
+"""
+Keyset (cursor) pagination of GPS history, newest first (or oldest first,
+for encoded tracks).
+
+Rows are ordered by (timestamp, tier, id) descending, and the cursor is an
+opaque token holding that key for the last row of the page. The next page is
+"rows strictly before the key", which the (user, timestamp) index answers with
+one short range scan however deep the client has paged; an OFFSET would read
+and discard every earlier row instead.
+"""
+import base64
+import heapq
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .conf import gps_setting
+
+
+def encode_cursor(timestamp, tier, pk):
+    raw = json.dumps([timestamp.isoformat(), tier, pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Return (timestamp, tier, pk) from a cursor token, or raise ValueError.
+    """
+    padded = token + '=' * (-len(token) % 4)
+    timestamp, tier, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    timestamp = parse_datetime(timestamp)
+    if timestamp is None or not isinstance(tier, int) or not isinstance(pk, int):
+        raise ValueError(token)
+    return timestamp, tier, pk
+
+
+def before_cursor(cursor, tier):
+    """
+    Filter for the rows of ``tier`` that sort after ``cursor`` in
+    (timestamp, tier, id) descending order.
+    """
+    timestamp, cursor_tier, pk = cursor
+    if tier < cursor_tier:
+        return Q(timestamp__lte=timestamp)
+    if tier > cursor_tier:
+        return Q(timestamp__lt=timestamp)
+    return Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk)
+
+
+def after_cursor(cursor, tier):
+    """
+    Filter for the rows of ``tier`` that sort after ``cursor`` in
+    (timestamp, tier, id) ascending order.
+    """
+    timestamp, cursor_tier, pk = cursor
+    if tier > cursor_tier:
+        return Q(timestamp__gte=timestamp)
+    if tier < cursor_tier:
+        return Q(timestamp__gt=timestamp)
+    return Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk)
+
+
+def time_bounds(request):
+    """
+    Filter for the ?since= (inclusive) and ?until= (exclusive) ISO 8601 bounds.
+    """
+    bounds = Q()
+    for param, lookup in (('since', 'timestamp__gte'), ('until', 'timestamp__lt')):
+        value = request.query_params.get(param)
+        if value:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                raise ValidationError({param: "Expected an ISO 8601 datetime"})
+            bounds &= Q(**{lookup: parsed})
+    return bounds
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages one queryset, or several history tiers merged into one sequence
+    (see paginate_tiers), with ?cursor= and ?page_size=.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = gps_setting('PAGE_SIZE')
+        value = request.query_params.get(self.page_size_query_param)
+        if value:
+            try:
+                page_size = int(value)
+            except ValueError:
+                raise ValidationError({self.page_size_query_param: "Expected an integer"})
+        return max(1, min(page_size, gps_setting('PAGE_MAX_SIZE')))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_tiers([queryset], request)
+
+    def paginate_tiers(self, querysets, request, page_size=None, newest_first=True):
+        """
+        Return one page of rows merged from ``querysets``, where each
+        queryset's position in the list is its tier. Reads at most
+        page_size + 1 rows per tier; ``page_size`` defaults to ?page_size=.
+        """
+        self.request = request
+        if page_size is None:
+            page_size = self.get_page_size(request)
+        token = request.query_params.get(self.cursor_query_param)
+        cursor = None
+        if token:
+            try:
+                cursor = decode_cursor(token)
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        following = before_cursor if newest_first else after_cursor
+        order = ('-timestamp', '-pk') if newest_first else ('timestamp', 'pk')
+        streams = []
+        for tier, queryset in enumerate(querysets):
+            if cursor is not None:
+                queryset = queryset.filter(following(cursor, tier))
+            rows = queryset.order_by(*order)[:page_size + 1]
+            streams.append([((row.timestamp, tier, row.pk), row) for row in rows])
+        merged = list(heapq.merge(*streams, key=lambda entry: entry[0], reverse=newest_first))
+
+        self.next_cursor = encode_cursor(*merged[page_size - 1][0]) if len(merged) > page_size else None
+        return [row for _, row in merged[:page_size]]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,25 @@
+# gpsinfo/parsers.py
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .wire import MEDIA_TYPE, WireFormatError, decode_points
+
+
+class PackedPoints(list):
+    """
+    Points decoded from a packed body. They are already validated, so views
+    pass them straight to the ingest pipeline without a serializer pass.
+    """
+
+
+class PackedGPSParser(BaseParser):
+    """
+    Parses the fixed-width binary format described in gpsinfo/wire.py.
+    """
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return PackedPoints(decode_points(stream.read()))
+        except WireFormatError as exc:
+            raise ParseError(f"Packed GPS parse error - {exc}")
@@ -0,0 +1,131 @@
+# gpsinfo/partitions.py
+"""
+Monthly range partitions of gpsinfo_gpslocation on ``timestamp`` (PostgreSQL only).
+
+Partitions are named gpsinfo_gpslocation_pYYYYMM and cover
+[first day of the month, first day of the next month) in UTC. A DEFAULT
+partition catches rows outside every range so inserts never fail, but
+``manage.py gps_partitions`` should keep future months pre-created so it
+stays empty. Unique indexes on a partitioned table must include the
+partition key, so the (user, device_seq) de-duplication index lives on
+each partition instead of on the parent. A retry received after a month
+boundary therefore does not conflict with the original row in the previous
+partition and is stored again. That window is accepted rather than paying a
+lookup on every insert, since devices retry within minutes of the original
+and only uploads straddling the start of a month are affected.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+PARENT = 'gpsinfo_gpslocation'
+DEFAULT_PARTITION = f'{PARENT}_default'
+NAME_RE = re.compile(rf'^{PARENT}_p(\d{{4}})(\d{{2}})$')
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'{PARENT}_p{month.year:04d}{month.month:02d}'
+
+
+def partition_month(name):
+    """
+    The month a partition covers, or None if the name is not a monthly partition.
+    """
+    match = NAME_RE.match(name)
+    if not match:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=dt_timezone.utc)
+
+
+def list_partitions(cursor):
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = %s ORDER BY c.relname",
+        [PARENT],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT c.relkind = 'p' FROM pg_class c WHERE c.relname = %s "
+        "AND pg_table_is_visible(c.oid)",
+        [PARENT],
+    )
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def create_partition(cursor, month):
+    """
+    Create the partition for ``month`` (and its de-duplication index) if missing.
+    Returns True if it was created.
+    """
+    name = partition_name(month)
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return False
+    # Bounds are generated here, not user input; DDL cannot take bind parameters
+    cursor.execute(
+        f'CREATE TABLE "{name}" PARTITION OF "{PARENT}" '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+    cursor.execute(f'CREATE UNIQUE INDEX "{name}_user_seq_uniq" ON "{name}" (user_id, device_seq)')
+    return True
+
+
+def create_default_partition(cursor):
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS "{DEFAULT_PARTITION}" PARTITION OF "{PARENT}" DEFAULT')
+    cursor.execute(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS "{DEFAULT_PARTITION}_user_seq_uniq" '
+        f'ON "{DEFAULT_PARTITION}" (user_id, device_seq)'
+    )
+
+
+def ensure_partitions(cursor, first_month, last_month):
+    """
+    Create every monthly partition from first_month to last_month inclusive.
+    Returns the names that were created.
+    """
+    created = []
+    month = month_start(first_month)
+    last_month = month_start(last_month)
+    while month <= last_month:
+        if create_partition(cursor, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def expired_partitions(cursor, cutoff):
+    """
+    Monthly partitions whose whole range ends on or before ``cutoff``.
+    """
+    expired = []
+    for name in list_partitions(cursor):
+        month = partition_month(name)
+        if month is not None and add_months(month, 1) <= cutoff:
+            expired.append(name)
+    return expired
+
+
+def detach_partition(cursor, name, drop=True):
+    """
+    Remove a month of data in O(1): detach the partition from the parent and
+    drop it, instead of DELETEing its rows.
+    """
+    # Fire deferred FK checks now; DROP refuses tables with pending trigger events
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    cursor.execute(f'ALTER TABLE "{PARENT}" DETACH PARTITION "{name}"')
+    if drop:
+        cursor.execute(f'DROP TABLE "{name}"')
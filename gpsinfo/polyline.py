@@ -0,0 +1,124 @@
+# gpsinfo/polyline.py
+"""
+Encoded polylines for whole tracks: the Google polyline algorithm, extended
+from (lat, lon) to four interleaved channels per point:
+
+    lat   degrees * 1e5
+    lon   degrees * 1e5
+    t     seconds since the Unix epoch
+    acc   accuracy in decimetres, -1 when unknown
+
+Every channel is delta-encoded against the previous point, so a track that
+moves slowly at 1 Hz costs a handful of characters per point.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+DIMENSIONS = ['lat', 'lon', 't', 'acc']
+FACTORS = [1e5, 1e5, 1, 10]
+UNKNOWN_ACCURACY = -1
+
+# Deltas in this range are encoded by table lookup instead of the bit loop
+_TABLE_LIMIT = 1 << 14
+
+# Bounds of t that datetime can represent (years 1970 to 9999), and of acc
+_MAX_TIME = 253402300799
+_MAX_ACCURACY = 10 ** 9
+
+
+class PolylineError(ValueError):
+    """Raised when an encoded track cannot be decoded."""
+
+
+def _encode_int(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chars = []
+    while value >= 0x20:
+        chars.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chars.append(chr(value + 63))
+    return ''.join(chars)
+
+
+_TABLE = {value: _encode_int(value) for value in range(-_TABLE_LIMIT, _TABLE_LIMIT)}
+
+
+def encode_columns(columns):
+    """
+    Encode parallel integer columns (one list per channel, already scaled)
+    into a single polyline string.
+    """
+    table = _TABLE
+    out = []
+    previous = [0] * len(columns)
+    for row in zip(*columns):
+        for channel, value in enumerate(row):
+            delta = value - previous[channel]
+            previous[channel] = value
+            encoded = table.get(delta)
+            out.append(encoded if encoded is not None else _encode_int(delta))
+    return ''.join(out)
+
+
+def decode_columns(encoded, channels):
+    """
+    Decode a polyline string into ``channels`` parallel integer columns.
+    """
+    columns = [[] for _ in range(channels)]
+    totals = [0] * channels
+    channel = 0
+    value = shift = 0
+    for code in encoded.encode('ascii'):
+        code -= 63
+        if code < 0 or code > 0x3f:
+            raise PolylineError("Invalid character in polyline")
+        value |= (code & 0x1f) << shift
+        if code & 0x20:
+            shift += 5
+            continue
+        delta = ~(value >> 1) if value & 1 else value >> 1
+        totals[channel] += delta
+        columns[channel].append(totals[channel])
+        value = shift = 0
+        channel = (channel + 1) % channels
+    if shift or channel:
+        raise PolylineError("Truncated polyline")
+    return columns
+
+
+def encode_track(rows):
+    """
+    Encode (latitude, longitude, time, accuracy) tuples, oldest first.
+    ``time`` is a datetime; ``accuracy`` may be None.
+    """
+    lat, lon, t, acc = [], [], [], []
+    for latitude, longitude, when, accuracy in rows:
+        lat.append(round(latitude * 1e5))
+        lon.append(round(longitude * 1e5))
+        t.append(int(when.timestamp()))
+        acc.append(UNKNOWN_ACCURACY if accuracy is None else round(accuracy * 10))
+    return encode_columns([lat, lon, t, acc])
+
+
+def decode_track(encoded):
+    """
+    Decode a track into point dicts with latitude, longitude, captured_at and
+    accuracy, range-checked and ready for ingest.
+    """
+    lat, lon, t, acc = decode_columns(encoded, len(DIMENSIONS))
+    if any(abs(value) > 90e5 for value in lat) or any(abs(value) > 180e5 for value in lon):
+        raise PolylineError("Latitude/longitude out of range")
+    if any(not 0 <= value <= _MAX_TIME for value in t):
+        raise PolylineError("Time out of range")
+    if any(value > _MAX_ACCURACY for value in acc):
+        raise PolylineError("Accuracy out of range")
+    fromtimestamp = datetime.fromtimestamp
+    utc = dt_timezone.utc
+    return [
+        {
+            'latitude': lat[i] / 1e5,
+            'longitude': lon[i] / 1e5,
+            'captured_at': fromtimestamp(t[i], tz=utc),
+            'accuracy': None if acc[i] < 0 else acc[i] / 10,
+        }
+        for i in range(len(lat))
+    ]
@@ -0,0 +1,208 @@
+# gpsinfo/retention.py
+"""
+Tiered retention of GPS history:
+
+    raw     GPSLocation, every point, kept RETENTION_RAW_DAYS days
+    minute  GPSTrackMinute, one point per RETENTION_BUCKET_SECONDS plus any
+            point RETENTION_MOVE_M metres away, kept RETENTION_MINUTE_DAYS days
+    day     GPSTrackDaily, one summary per user and UTC day, kept forever
+
+``manage.py gps_retention`` moves data down one tier in chunks of one user
+and one time window. Each chunk writes the lower tier and deletes the rows it
+replaced in one short transaction, so an interrupted run resumes where it
+stopped and no lock is held for longer than a single chunk.
+
+Every tier is keyed by the raw rows' ``timestamp`` (server receive time),
+the column raw points age out and are partitioned by, so a chunk's points
+fall into that chunk's buckets only. A bucket written twice all the same
+(say, by a late point of a window already moved) has its samples added up.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .decimation import point_time
+from .geo import haversine_m
+from .models import GPSLocation, GPSTrackDaily, GPSTrackMinute
+
+RESOLUTIONS = {GPSLocation: 'raw', GPSTrackMinute: 'minute', GPSTrackDaily: 'day'}
+
+
+def day_start(value):
+    return datetime.combine(value.astimezone(dt_timezone.utc).date(), time.min, tzinfo=dt_timezone.utc)
+
+
+def tier_cutoff(days, now=None):
+    """
+    Start of the UTC day ``days`` days ago; rows older than this move down a
+    tier. None when the tier is kept forever.
+    """
+    if days is None:
+        return None
+    return day_start((now or timezone.now()) - timedelta(days=days))
+
+
+def downsample(locations, bucket_seconds=60, move_m=None):
+    """
+    Reduce one user's points (in ``timestamp`` order) to the first point of each
+    ``bucket_seconds`` bucket, plus any point at least ``move_m`` metres from
+    the last kept one. Returns [location, samples] pairs, where samples counts
+    the raw points each kept point stands for.
+    """
+    kept = []
+    last_bucket = None
+    for location in locations:
+        bucket = int(location.timestamp.timestamp()) // bucket_seconds
+        if kept and bucket == last_bucket:
+            previous = kept[-1][0]
+            moved = move_m is not None and haversine_m(
+                previous.latitude, previous.longitude, location.latitude, location.longitude
+            ) >= move_m
+            if not moved:
+                kept[-1][1] += 1
+                continue
+        kept.append([location, 1])
+        last_bucket = bucket
+    return kept
+
+
+def merge_minutes(user_id, minutes):
+    """
+    Store GPSTrackMinute rows of one user, adding the samples of a row whose
+    (user, timestamp) is already stored, or repeated in ``minutes``, to the
+    first one instead of dropping it. Call inside a transaction.
+    """
+    merged = {}
+    for minute in minutes:
+        if minute.timestamp in merged:
+            merged[minute.timestamp].samples += minute.samples
+        else:
+            merged[minute.timestamp] = minute
+    stored = GPSTrackMinute.objects.select_for_update().filter(user_id=user_id, timestamp__in=list(merged))
+    for row in stored:
+        GPSTrackMinute.objects.filter(pk=row.pk).update(samples=F('samples') + merged.pop(row.timestamp).samples)
+    GPSTrackMinute.objects.bulk_create(merged.values())
+
+
+def downsample_raw_chunk(user_id, cutoff, window=timedelta(hours=1), bucket_seconds=60, move_m=None):
+    """
+    Move one user's oldest ``window`` of raw points older than ``cutoff`` into
+    GPSTrackMinute. Returns (raw points read, minute points written), or None
+    when nothing older than the cutoff is left.
+    """
+    raw = GPSLocation.objects.filter(user_id=user_id, timestamp__lt=cutoff)
+    first = raw.order_by('timestamp').values_list('timestamp', flat=True).first()
+    if first is None:
+        return None
+    epoch = int(first.timestamp())
+    step = int(window.total_seconds())
+    end = min(datetime.fromtimestamp(epoch - epoch % step + step, tz=dt_timezone.utc), cutoff)
+    chunk = raw.filter(timestamp__gte=first, timestamp__lt=end)
+
+    with transaction.atomic():
+        locations = list(chunk.order_by('timestamp', 'pk'))
+        kept = downsample(locations, bucket_seconds, move_m)
+        merge_minutes(user_id, [
+            GPSTrackMinute(
+                user_id=user_id,
+                timestamp=location.timestamp,
+                latitude=location.latitude,
+                longitude=location.longitude,
+                altitude=location.altitude,
+                accuracy=location.accuracy,
+                samples=samples,
+            )
+            for location, samples in kept
+        ])
+        # Delete exactly what was read; the time range keeps the DELETE on one partition
+        chunk.filter(pk__in=[location.pk for location in locations]).delete()
+    return len(locations), len(kept)
+
+
+def summarize_day_chunk(user_id, cutoff):
+    """
+    Fold one user's oldest UTC day of GPSTrackMinute rows older than
+    ``cutoff`` into its GPSTrackDaily row. Returns (minute points read, 1),
+    or None when nothing older than the cutoff is left.
+    """
+    minutes = GPSTrackMinute.objects.filter(user_id=user_id, timestamp__lt=cutoff)
+    first = minutes.order_by('timestamp').values_list('timestamp', flat=True).first()
+    if first is None:
+        return None
+    start = day_start(first)
+
+    with transaction.atomic():
+        points = list(minutes.filter(timestamp__gte=start, timestamp__lt=start + timedelta(days=1)).order_by('timestamp'))
+        summary = GPSTrackDaily.objects.select_for_update().filter(user_id=user_id, day=start.date()).first()
+        previous = None
+        if summary is None:
+            head = points[0]
+            summary = GPSTrackDaily(
+                user_id=user_id, day=start.date(), timestamp=head.timestamp, first_at=head.timestamp,
+                latitude=head.latitude, longitude=head.longitude,
+                min_latitude=head.latitude, max_latitude=head.latitude,
+                min_longitude=head.longitude, max_longitude=head.longitude,
+            )
+        elif summary.timestamp <= first:
+            # Continue the distance from where the earlier part of the day ended
+            previous = (summary.latitude, summary.longitude)
+
+        for point in points:
+            if previous is not None:
+                summary.distance_m += haversine_m(previous[0], previous[1], point.latitude, point.longitude)
+            previous = (point.latitude, point.longitude)
+            summary.samples += point.samples
+            summary.min_latitude = min(summary.min_latitude, point.latitude)
+            summary.max_latitude = max(summary.max_latitude, point.latitude)
+            summary.min_longitude = min(summary.min_longitude, point.longitude)
+            summary.max_longitude = max(summary.max_longitude, point.longitude)
+            summary.first_at = min(summary.first_at, point.timestamp)
+            if point.timestamp >= summary.timestamp:
+                summary.timestamp = point.timestamp
+                summary.latitude = point.latitude
+                summary.longitude = point.longitude
+        summary.save()
+        GPSTrackMinute.objects.filter(pk__in=[point.pk for point in points]).delete()
+    return len(points), 1
+
+
+def history_tiers(user):
+    """
+    The user's raw, minute and daily querysets, in tier order.
+    """
+    return [
+        GPSLocation.objects.filter(user=user),
+        GPSTrackMinute.objects.filter(user=user),
+        GPSTrackDaily.objects.filter(user=user),
+    ]
+
+
+def serialize_history(items, serializers, fields=None):
+    """
+    Serialize a sequence of tier rows with one serializer pass per tier,
+    tagging each row with its ``resolution``. ``serializers`` maps model to
+    serializer class; ``fields`` is an optional projection.
+    """
+    items = list(items)
+    rows = [None] * len(items)
+    for model, serializer_class in serializers.items():
+        indexes = [i for i, item in enumerate(items) if type(item) is model]
+        if not indexes:
+            continue
+        data = serializer_class([items[i] for i in indexes], many=True, fields=fields).data
+        for i, row in zip(indexes, data):
+            if fields is None or 'resolution' in fields:
+                row['resolution'] = RESOLUTIONS[model]
+            rows[i] = row
+    return rows
+
+
+def track_point(item):
+    """
+    (latitude, longitude, time, accuracy) of any tier's row, for encode_track().
+    """
+    if isinstance(item, GPSLocation):
+        return item.latitude, item.longitude, point_time(item), item.accuracy
+    return item.latitude, item.longitude, item.timestamp, getattr(item, 'accuracy', None)
@@ -1,14 +1,29 @@
 # gpsinfo/serializers.py
 from rest_framework import serializers
-from .models import GPSLocation, GPSLatest
+from .models import GPSLocation, GPSLatest, GPSTrackDaily, GPSTrackMinute
 
-class GPSLocationSerializer(serializers.ModelSerializer):
+class ProjectedFieldsMixin:
+    """
+    Accepts ``fields=[...]`` to serialize only those fields (the ?fields=
+    projection); names the serializer does not have are ignored.
+    """
+    def __init__(self, *args, **kwargs):
+        projection = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if projection is not None:
+            for name in set(self.fields) - set(projection):
+                self.fields.pop(name)
+
+class GPSLocationSerializer(ProjectedFieldsMixin, serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     
     class Meta:
         model = GPSLocation
-        fields = ['id', 'latitude', 'longitude', 'timestamp', 'altitude', 'accuracy', 'username']
+        fields = ['id', 'latitude', 'longitude', 'timestamp', 'captured_at', 'device_seq', 'altitude', 'accuracy', 'username']
         read_only_fields = ['timestamp', 'username']
+        # The (user, device_seq) uniqueness is enforced by the database with
+        # ON CONFLICT DO NOTHING, not by a validator query per point
+        validators = []
 
 class GPSLatestSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
@@ -16,4 +31,17 @@ class GPSLatestSerializer(serializers.ModelSerializer):
     class Meta:
         model = GPSLatest
         fields = ['username', 'latitude', 'longitude', 'timestamp', 'altitude', 'accuracy']
-        read_only_fields = ['username', 'timestamp']
\ No newline at end of file
+        read_only_fields = ['username', 'timestamp']
+
+class GPSTrackMinuteSerializer(ProjectedFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = GPSTrackMinute
+        fields = ['latitude', 'longitude', 'timestamp', 'altitude', 'accuracy', 'samples']
+        read_only_fields = fields
+
+class GPSTrackDailySerializer(ProjectedFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = GPSTrackDaily
+        fields = ['latitude', 'longitude', 'timestamp', 'first_at', 'day', 'samples', 'distance_m',
+                  'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude']
+        read_only_fields = fields
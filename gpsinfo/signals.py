@@ -0,0 +1,119 @@
+# gpsinfo/signals.py
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from .changes import NextSeq
+from .broker import get_broker, position_events, remove_event
+from .models import GPSLatest, GPSLatestTombstone
+from .nearby import get_latest_index
+from .snapshots import get_snapshot_cache
+from .versions import SCOPE_ALL, bump, group_scope, user_scope
+
+# Sent after a GPSLatest upsert commits, with rows=[{'user_id', 'latitude',
+# 'longitude', 'altitude', 'accuracy', 'timestamp', 'zkey'}, ...] holding the
+# rows that advanced the stored position. Backends that cannot report which
+# rows were written send them all; receivers must keep only newer timestamps.
+latest_changed = Signal()
+
+
+@receiver(latest_changed)
+def update_nearby_index(sender, rows, **kwargs):
+    get_latest_index().apply(rows)
+
+
+@receiver(post_delete, sender=GPSLatest)
+def remove_from_nearby_index(sender, instance, **kwargs):
+    get_latest_index().discard(instance.user_id)
+
+
+@receiver(latest_changed)
+def publish_latest_changes(sender, rows, **kwargs):
+    """
+    Bump the version counters of the scopes the rows belong to, write them
+    through to this process's snapshots and push them to live streams, with
+    one query for the users' names and groups.
+    """
+    members = latest_members({row['user_id'] for row in rows})
+    versions = bump(member_scopes(members))
+    broker = get_broker()
+    snapshots = get_snapshot_cache()
+    if broker.listening() or snapshots.holds(versions):
+        events = position_events(rows, members)
+        snapshots.apply(events, versions)
+        if broker.listening():
+            broker.publish(events)
+
+
+@receiver(post_delete, sender=GPSLatest)
+def record_latest_removal(sender, instance, **kwargs):
+    # Runs before a cascading delete removes the user itself
+    members = latest_members([instance.user_id])
+    member = members.get(instance.user_id)
+    if member is not None:
+        GPSLatestTombstone.objects.create(user_id=instance.user_id, username=member[0], user_group=member[1], deleted=True)
+        event = remove_event(member[0], member_scopes(members))
+        transaction.on_commit(lambda: get_broker().publish([event]))
+    scopes = member_scopes(members)
+    # After the commit, or a reader could label the old rows with the new version
+    transaction.on_commit(lambda: bump(scopes))
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def record_group_move(sender, instance, update_fields=None, **kwargs):
+    """
+    A user moving between groups changes both groups' latest positions: the
+    old group gets a tombstone, and the user's GPSLatest row a new seq so the
+    new group's change feed picks it up.
+    """
+    if instance.pk is None or (update_fields is not None and 'user_group' not in update_fields):
+        return
+    old = sender.objects.filter(pk=instance.pk).values_list('user_group', flat=True).first()
+    if old is not None and old != instance.user_group:
+        if GPSLatest.objects.filter(user_id=instance.pk).update(seq=NextSeq()) and old:
+            GPSLatestTombstone.objects.create(user_id=instance.pk, username=instance.username, user_group=old)
+        scopes = [group_scope(group) for group in (old, instance.user_group) if group]
+        transaction.on_commit(lambda: bump(scopes))
+        move = (instance.pk, instance.username, old, instance.user_group)
+        transaction.on_commit(lambda: publish_group_move(*move))
+
+
+def publish_group_move(user_id, username, old, new):
+    """
+    Take the user off the old group's live streams and onto the new one's.
+    """
+    broker = get_broker()
+    if not broker.listening():
+        return
+    events = [remove_event(username, [group_scope(old)])] if old else []
+    row = GPSLatest.objects.filter(user_id=user_id).values(
+        'user_id', 'latitude', 'longitude', 'altitude', 'accuracy', 'timestamp').first() if new else None
+    if row is not None:
+        event, = position_events([row], {user_id: (username, new)})
+        events.append(event._replace(scopes=(group_scope(new),)))
+    broker.publish(events)
+
+
+def latest_members(user_ids):
+    """
+    {user_id: (username, user_group)} for the users that still exist.
+    """
+    return {
+        pk: (username, group)
+        for pk, username, group in get_user_model().objects.filter(pk__in=user_ids).values_list(
+            'pk', 'username', 'user_group')
+    }
+
+
+def member_scopes(members):
+    """
+    The version scopes a change to these members' latest positions affects.
+    """
+    scopes = {SCOPE_ALL}
+    for username, group in members.values():
+        scopes.add(user_scope(username))
+        if group:
+            scopes.add(group_scope(group))
+    return sorted(scopes)
@@ -0,0 +1,208 @@
+# gpsinfo/snapshots.py
+"""
+Latest positions of a whole scope (the fleet, or one user group) kept in each
+worker process, already serialized: serving latest/ and group/<g>/ is then a
+dictionary lookup and a write of JSON bytes, with no query and no serializer.
+
+A snapshot is valid for one version of its scope's counter, which every
+worker shares through the cache tier (see versions.py) and readers check on
+every request anyway. Writes committed in this process update the snapshots
+they touch in place (write-through from signals.py), but only when the
+write's bump moved the scope on by exactly one from the snapshot's version.
+When another process bumped the scope in between, or a user left or moved,
+the versions no longer line up and the snapshot is rebuilt on its next read.
+
+Snapshots are evicted least recently read first once there are more than
+LATEST_SNAPSHOT_MAX_SCOPES of them or they hold more than
+LATEST_SNAPSHOT_MAX_BYTES, so rarely viewed groups do not take up memory.
+
+A snapshot a process has to build is first looked up in the shared cache tier
+(rbackend/cache.py), where each scope has one entry holding the version it
+was built at and its rows, so after a write only one worker queries the
+database for it. Whoever builds a newer version overwrites the entry, and it
+expires after LATEST_SNAPSHOT_TTL seconds. With a locmem cache tier there are
+no other workers to share with and the entry is not kept at all.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from rbackend.cache import is_shared, stats
+
+from .conf import gps_setting
+from .models import GPSLatest
+from .serializers import GPSLatestSerializer
+from .versions import SCOPE_ALL, group_scope
+
+stats.track('latest_snapshot')
+
+
+def group_latest(group):
+    """
+    GPSLatest rows of the group's members, joined to the user in one query.
+    """
+    return GPSLatest.objects.select_related('user').filter(user__user_group=group).order_by('user__username')
+
+
+def scope_latest(group=None):
+    """
+    GPSLatest rows of a group, or of everyone, in username order.
+    """
+    if group:
+        return group_latest(group)
+    return GPSLatest.objects.select_related('user').order_by('user__username')
+
+
+def serialize_rows(rows):
+    """
+    {username: row JSON} of GPSLatest rows.
+    """
+    return {
+        row['username']: json.dumps(row, separators=(',', ':'))
+        for row in GPSLatestSerializer(rows, many=True).data
+    }
+
+
+def shared_rows(scope, version, rows):
+    """
+    serialize_rows() of ``rows``, taken from the shared cache tier's entry of
+    ``scope`` when another worker built it at ``version``.
+    """
+    if not is_shared():
+        return serialize_rows(rows)
+    key = f'gpsinfo:latest:snapshot:{scope}'
+    entry = cache.get(key)
+    hit = entry is not None and entry[0] == version
+    stats.record('latest_snapshot', hit)
+    if hit:
+        return dict(entry[1])
+    serialized = serialize_rows(rows)
+    cache.set(key, (version, serialized), gps_setting('LATEST_SNAPSHOT_TTL'))
+    return serialized
+
+
+class ScopeSnapshot:
+    """
+    The serialized rows of one scope, by username, and their JSON array.
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = rows
+        self.size = sum(len(text) for text in rows.values())
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = f"[{','.join(self.rows[name] for name in sorted(self.rows))}]".encode()
+        return self._body
+
+    def put(self, username, text):
+        self.size += len(text) - len(self.rows.get(username, ''))
+        self.rows[username] = text
+        self._body = None
+
+
+class LatestSnapshotCache:
+    """
+    ScopeSnapshots of this process, least recently read first.
+    """
+
+    def __init__(self, max_bytes, max_scopes):
+        self.max_bytes = max_bytes
+        self.max_scopes = max_scopes
+        self._snapshots = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, scope, version, rows):
+        """
+        The JSON body of ``scope`` at ``version``, from the snapshot when it
+        is at that version, else built from the ``rows`` queryset. A scope
+        without a version is built and not kept.
+        """
+        if version is None:
+            return ScopeSnapshot(None, serialize_rows(rows)).body
+        with self._lock:
+            snapshot = self._snapshots.get(scope)
+            if snapshot is not None and snapshot.version == version:
+                self._snapshots.move_to_end(scope)
+                return snapshot.body
+        # Built after reading the version: a write committing meanwhile bumps
+        # the version, so this snapshot is never served in place of its result
+        snapshot = ScopeSnapshot(version, shared_rows(scope, version, rows))
+        body = snapshot.body
+        with self._lock:
+            self._discard(scope)
+            self._snapshots[scope] = snapshot
+            self._size += snapshot.size
+            self._evict()
+        return body
+
+    def holds(self, scopes):
+        return any(scope in self._snapshots for scope in scopes)
+
+    def apply(self, events, versions):
+        """
+        Write committed position events through to the snapshots of the
+        scopes in ``versions``, {scope: version after the write's bump}.
+        """
+        with self._lock:
+            for scope, version in versions.items():
+                snapshot = self._snapshots.get(scope)
+                if snapshot is None:
+                    continue
+                if snapshot.version != version - 1:
+                    # Someone else's change came in between
+                    self._discard(scope)
+                    continue
+                self._size -= snapshot.size
+                for event in events:
+                    if event.kind == 'position' and scope in event.scopes:
+                        snapshot.put(event.username, event.data)
+                snapshot.version = version
+                self._size += snapshot.size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._size = 0
+
+    def _discard(self, scope):
+        snapshot = self._snapshots.pop(scope, None)
+        if snapshot is not None:
+            self._size -= snapshot.size
+
+    def _evict(self):
+        # The body roughly doubles a snapshot's rows; keep the newest regardless
+        while len(self._snapshots) > 1 and (
+                len(self._snapshots) > self.max_scopes or 2 * self._size > self.max_bytes):
+            scope, snapshot = self._snapshots.popitem(last=False)
+            self._size -= snapshot.size
+
+
+_snapshots = None
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot_cache():
+    global _snapshots
+    if _snapshots is None:
+        with _snapshots_lock:
+            if _snapshots is None:
+                _snapshots = LatestSnapshotCache(gps_setting('LATEST_SNAPSHOT_MAX_BYTES'),
+                                                 gps_setting('LATEST_SNAPSHOT_MAX_SCOPES'))
+    return _snapshots
+
+
+def latest_snapshot(group, version):
+    """
+    The latest positions of a group, or of everyone, as JSON bytes, at the
+    scope's ``version`` as read by the caller (None for no version).
+    """
+    scope = group_scope(group) if group else SCOPE_ALL
+    return get_snapshot_cache().get(scope, version, scope_latest(group))
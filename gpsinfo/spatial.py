@@ -0,0 +1,139 @@
+# gpsinfo/spatial.py
+"""
+Bounding-box and radius queries over the indexed ``zkey`` column of
+GPSLocation and GPSLatest, on any database (no PostGIS).
+
+A box is covered by a handful of grid cells at the finest level where it
+still spans at most ``max_cells`` cells. Each cell is one contiguous zkey
+range, adjacent ranges are merged, and the resulting range scans are refined
+exactly on latitude/longitude (and, for a radius, by great-circle distance).
+"""
+import math
+from operator import attrgetter
+
+from django.db import models
+from django.db.models import Q
+
+from .conf import gps_setting
+from .geo import EARTH_RADIUS_M, grid_cell, haversine_m, interleave, zkey
+
+# Cells (and so at most this many index range scans) per covered box
+MAX_COVER_CELLS = 16
+
+
+def point_zkey(lat, lon):
+    """
+    The zkey stored for a point, at GPSINFO['ZKEY_BITS'] bits per axis.
+    """
+    return zkey(lat, lon, gps_setting('ZKEY_BITS'))
+
+
+def cover_ranges(min_lat, min_lon, max_lat, max_lon, bits, max_cells=MAX_COVER_CELLS):
+    """
+    Half-open [low, high) zkey ranges that together cover the box. The box
+    must not cross the antimeridian (see split_bbox).
+    """
+    x0, y0 = grid_cell(min_lat, min_lon, bits)
+    x1, y1 = grid_cell(max_lat, max_lon, bits)
+    level = bits
+    while level > 0 and ((x1 >> (bits - level)) - (x0 >> (bits - level)) + 1) * \
+            ((y1 >> (bits - level)) - (y0 >> (bits - level)) + 1) > max_cells:
+        level -= 1
+    drop = bits - level
+    shift = 2 * drop
+    cells = sorted(
+        interleave(x, y)
+        for x in range(x0 >> drop, (x1 >> drop) + 1)
+        for y in range(y0 >> drop, (y1 >> drop) + 1)
+    )
+    ranges = []
+    for cell in cells:
+        low, high = cell << shift, (cell + 1) << shift
+        if ranges and ranges[-1][1] == low:
+            ranges[-1][1] = high
+        else:
+            ranges.append([low, high])
+    return [tuple(r) for r in ranges]
+
+
+def split_bbox(min_lat, min_lon, max_lat, max_lon):
+    """
+    Boxes with min_lon > max_lon cross the antimeridian; split them in two.
+    """
+    if min_lon <= max_lon:
+        return [(min_lat, min_lon, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+
+
+def parse_bbox(value):
+    """
+    Parse a ``minLon,minLat,maxLon,maxLat`` query value (the GeoJSON / map
+    client order) into (min_lat, min_lon, max_lat, max_lon), or raise
+    ValueError. min_lon > max_lon means the box crosses the antimeridian.
+    """
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError(value)
+    min_lon, min_lat, max_lon, max_lat = (float(part) for part in parts)
+    if not (-90.0 <= min_lat <= max_lat <= 90.0 and -180.0 <= min_lon <= 180.0 and -180.0 <= max_lon <= 180.0):
+        raise ValueError(value)
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def bbox_q(min_lat, min_lon, max_lat, max_lon, indexed=True):
+    """
+    Filter for rows inside the box. With ``indexed`` it is also restricted to
+    the zkey ranges covering the box, so the zkey index can answer it.
+    """
+    bits = gps_setting('ZKEY_BITS')
+    ranges = Q()
+    exact_lon = Q()
+    for box in split_bbox(min_lat, min_lon, max_lat, max_lon):
+        if indexed:
+            for low, high in cover_ranges(*box, bits):
+                ranges |= Q(zkey__gte=low, zkey__lt=high)
+        exact_lon |= Q(longitude__gte=box[1], longitude__lte=box[3])
+    return ranges & exact_lon & Q(latitude__gte=min_lat, latitude__lte=max_lat)
+
+
+def radius_bbox(lat, lon, radius_m):
+    """
+    The (min_lat, min_lon, max_lat, max_lon) box around a circle; min_lon >
+    max_lon when it crosses the antimeridian.
+    """
+    angle = radius_m / EARTH_RADIUS_M
+    dlat = math.degrees(angle)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90.0 or max_lat >= 90.0 or angle >= math.pi / 2:
+        # The circle contains a pole: every longitude is in range
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+    dlon = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat)))))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    return min_lat, min_lon, max_lat, max_lon
+
+
+class SpatialQuerySet(models.QuerySet):
+    """
+    QuerySet for models with latitude, longitude and an indexed zkey.
+    Rows whose zkey has not been backfilled yet are not matched.
+    """
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        return self.filter(bbox_q(min_lat, min_lon, max_lat, max_lon))
+
+    def within_radius(self, lat, lon, radius_m):
+        """
+        Rows within ``radius_m`` metres, nearest first, each with a
+        ``distance_m`` attribute. Evaluates the query.
+        """
+        rows = []
+        for row in self.in_bbox(*radius_bbox(lat, lon, radius_m)):
+            row.distance_m = haversine_m(lat, lon, row.latitude, row.longitude)
+            if row.distance_m <= radius_m:
+                rows.append(row)
+        rows.sort(key=attrgetter('distance_m'))
+        return rows
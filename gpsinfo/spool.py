@@ -0,0 +1,284 @@
+# gpsinfo/spool.py
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+
+from django.db import DataError, IntegrityError, transaction
+from django.utils.dateparse import parse_datetime
+
+from .conf import gps_setting
+from .models import GPSLocation, GPSSpoolCheckpoint
+
+logger = logging.getLogger(__name__)
+
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.log'
+DEAD_SUFFIX = '.dead'
+RECORD_FIELDS = ['user_id', 'latitude', 'longitude', 'altitude', 'accuracy', 'device_seq']
+
+
+def encode_record(location, latest_only=False):
+    """
+    Serialize an unsaved GPSLocation as one spool line: "<crc32 hex> <json>\\n".
+    The checksum lets the reader reject torn or corrupted lines after a crash.
+    """
+    record = {name: getattr(location, name) for name in RECORD_FIELDS}
+    if latest_only:
+        record['latest_only'] = True
+    record['timestamp'] = location.timestamp.isoformat()
+    record['captured_at'] = location.captured_at.isoformat() if location.captured_at else None
+    payload = json.dumps(record, separators=(',', ':')).encode()
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+
+def decode_record(line):
+    """
+    Parse a spool line back into (GPSLocation, latest_only), or return None if
+    the checksum does not match.
+    """
+    checksum, _, payload = line.rstrip(b'\n').partition(b' ')
+    try:
+        if int(checksum, 16) != zlib.crc32(payload):
+            return None
+        record = json.loads(payload)
+    except ValueError:
+        return None
+    latest_only = record.pop('latest_only', False)
+    record['timestamp'] = parse_datetime(record['timestamp'])
+    if record['captured_at']:
+        record['captured_at'] = parse_datetime(record['captured_at'])
+    return GPSLocation(**record), latest_only
+
+
+def read_segment(path, offset=0):
+    """
+    Yield (location, latest_only, end_offset) for each intact record after ``offset``.
+    Stops at a torn final line; skips (and logs) lines with a bad checksum.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            if not line.endswith(b'\n'):
+                logger.warning(f"Discarding torn record at the end of {path}")
+                return
+            decoded = decode_record(line)
+            if decoded is None:
+                logger.error(f"Skipping corrupted record in {path} ending at byte {offset}")
+                continue
+            yield decoded[0], decoded[1], offset
+
+
+class GPSSpool:
+    """
+    Append-only, segmented log of accepted GPS points. Writes go to the OS
+    immediately, so a process crash loses nothing; fsync is batched every
+    ``fsync_interval_ms`` so a power loss can lose at most that window.
+    Segments are sealed (renamed from .open to .log) once they reach
+    ``segment_bytes`` or ``segment_seconds``, and are then replayed into the
+    database by ``manage.py drain_gps_spool``.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, segment_seconds=60, fsync_interval_ms=50):
+        self.directory = str(directory)
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._opened_at = 0
+        self._size = 0
+        self._dirty = False
+        self._thread = None
+        self._stopping = threading.Event()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def append(self, locations, latest_only=()):
+        data = b''.join(encode_record(location) for location in locations)
+        data += b''.join(encode_record(location, latest_only=True) for location in latest_only)
+        with self._lock:
+            if self._file is None or self._size >= self.segment_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            self._dirty = True
+            if self.fsync_interval <= 0:
+                self._sync()
+
+    def start(self):
+        """
+        Start the background thread that batches fsyncs and seals idle segments.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='gpsinfo-spool', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._seal()
+
+    def _run(self):
+        while not self._stopping.wait(self.fsync_interval or 1.0):
+            with self._lock:
+                self._sync()
+                if self._file is not None and time.monotonic() - self._opened_at >= self.segment_seconds:
+                    self._seal()
+
+    def _sync(self):
+        if self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def _rotate(self):
+        self._seal()
+        name = f"{int(time.time() * 1000):013d}-{socket.gethostname()}-{os.getpid()}{OPEN_SUFFIX}"
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, 'ab')
+        self._opened_at = time.monotonic()
+        self._size = 0
+
+    def _seal(self):
+        if self._file is None:
+            return
+        self._sync()
+        self._file.close()
+        os.rename(self._path, self._path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        _fsync_directory(self.directory)
+        self._file = None
+        self._path = None
+
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _writer_is_dead(name):
+    """
+    True if an .open segment belongs to a process on this host that no longer runs.
+    """
+    stem = name[:-len(OPEN_SUFFIX)]
+    host_and_pid = stem.split('-', 1)[1] if '-' in stem else ''
+    host, _, pid = host_and_pid.rpartition('-')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def pending_segments(directory):
+    """
+    Sealed segments in write order. Segments left open by a crashed writer on
+    this host are sealed first so they are replayed too.
+    """
+    names = sorted(os.listdir(directory))
+    for name in names:
+        if name.endswith(OPEN_SUFFIX) and _writer_is_dead(name):
+            sealed = name[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX
+            os.rename(os.path.join(directory, name), os.path.join(directory, sealed))
+            logger.warning(f"Recovered spool segment {name} from a dead writer")
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.endswith(SEALED_SUFFIX)
+    ]
+
+
+def drain_segment(path, batch_size=1000):
+    """
+    Replay one sealed segment into GPSLocation/GPSLatest in bulk batches. The
+    byte offset is checkpointed in the same transaction as each batch, so a
+    crashed drain resumes exactly where the last committed batch ended.
+    A batch the database rejects is retried point by point, and the points
+    that can never be written (say, of a user deleted since) are appended to
+    a <segment>.dead file beside it, so they cannot hold up the spool.
+    Returns the number of points written.
+    """
+    from .ingest import write_locations
+
+    name = os.path.basename(path)
+    checkpoint, _ = GPSSpoolCheckpoint.objects.get_or_create(segment=name)
+    written = 0
+    batch, latest_only = [], []
+
+    def commit(end_offset):
+        try:
+            with transaction.atomic():
+                write_locations(batch, latest_only)
+                GPSSpoolCheckpoint.objects.filter(segment=name).update(offset=end_offset)
+            return len(batch)
+        except (IntegrityError, DataError):
+            logger.warning(f"A batch of {name} was rejected, retrying it point by point")
+        stored, dead = 0, []
+        for location, is_latest_only in [(point, False) for point in batch] + [(point, True) for point in latest_only]:
+            try:
+                with transaction.atomic():
+                    write_locations([] if is_latest_only else [location], [location] if is_latest_only else [])
+                stored += not is_latest_only
+            except (IntegrityError, DataError) as exc:
+                logger.error(f"Moving a point of user {location.user_id} in {name} to the dead letters: {exc}")
+                dead.append(encode_record(location, latest_only=is_latest_only))
+        if dead:
+            # Made durable before the checkpoint moves past them
+            with open(path[:-len(SEALED_SUFFIX)] + DEAD_SUFFIX, 'ab') as f:
+                f.write(b''.join(dead))
+                f.flush()
+                os.fsync(f.fileno())
+        GPSSpoolCheckpoint.objects.filter(segment=name).update(offset=end_offset)
+        return stored
+
+    end_offset = checkpoint.offset
+    for location, is_latest_only, end_offset in read_segment(path, checkpoint.offset):
+        (latest_only if is_latest_only else batch).append(location)
+        if len(batch) + len(latest_only) >= batch_size:
+            written += commit(end_offset)
+            batch, latest_only = [], []
+    if batch or latest_only:
+        written += commit(end_offset)
+
+    os.remove(path)
+    GPSSpoolCheckpoint.objects.filter(segment=name).delete()
+    return written
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """
+    Return the process-wide spool writer, opening it on first use.
+    """
+    global _spool
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                spool = GPSSpool(
+                    gps_setting('SPOOL_DIR'),
+                    segment_bytes=gps_setting('SPOOL_SEGMENT_BYTES'),
+                    segment_seconds=gps_setting('SPOOL_SEGMENT_SECONDS'),
+                    fsync_interval_ms=gps_setting('SPOOL_FSYNC_MS'),
+                )
+                spool.start()
+                atexit.register(spool.close)
+                _spool = spool
+    return _spool
@@ -0,0 +1,230 @@
+# gpsinfo/stream.py
+"""
+Server-Sent Events stream of latest positions, /api/gpslocations/stream/.
+
+The view is async and must be served through rbackend/asgi.py: an idle
+connection is a coroutine parked on its broker subscription (broker.py), so
+one worker process holds thousands of viewers. Under WSGI every connection
+would pin a worker thread.
+
+A connection starts with the viewer's scope as 'position' events (or, when
+resuming with Last-Event-ID or ?since=, only the change feed since that
+cursor, see changes.py), then receives 'position' and 'remove' events as
+writes commit, at most one batch per STREAM_FLUSH_MS. Every event id is a
+change cursor, so a reconnecting EventSource resumes where it stopped; a
+comment line is sent every STREAM_HEARTBEAT_S seconds to keep proxies from
+closing idle connections.
+
+EventSource cannot set an Authorization header, and an access token in the
+URL would end up in proxy and server logs, so browsers first POST to
+stream-ticket/ for a single-use ticket valid STREAM_TICKET_TTL_S seconds
+and open the stream with ?ticket=. The ticket is spent on connecting: after
+a dropped connection the client fetches a new one and resumes with ?since=
+set to the last event id.
+"""
+import json
+import logging
+import secrets
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from accounts.authentication import CachedJWTAuthentication
+from accounts.cache import cached_user
+
+from .changes import current_cursor, latest_changes, parse_cursor, scope_querysets
+from .conf import gps_setting
+from .broker import get_broker
+from .serializers import GPSLatestSerializer
+from .versions import SCOPE_ALL, group_scope, user_scope
+
+logger = logging.getLogger(__name__)
+
+
+class StableCursor:
+    """
+    A change cursor old enough to stamp pushed events with: read at least
+    ``grace`` seconds ago, by when every write that committed before the read
+    has been published to the broker. Shared by all connections of the process.
+    """
+
+    def __init__(self, grace):
+        self.grace = grace
+        self.value = None
+        self._fresh = None
+        self._reading = False
+
+    async def get(self):
+        now = time.monotonic()
+        if self._fresh is not None and now - self._fresh[1] >= self.grace:
+            self.value, self._fresh = self._fresh[0], None
+        if self._fresh is None and not self._reading:
+            self._reading = True
+            try:
+                self._fresh = (await sync_to_async(current_cursor)(), now)
+            finally:
+                self._reading = False
+        return self.value
+
+
+_stable_cursor = None
+
+
+def get_stable_cursor():
+    global _stable_cursor
+    if _stable_cursor is None:
+        _stable_cursor = StableCursor(gps_setting('STREAM_CURSOR_GRACE_S'))
+    return _stable_cursor
+
+
+def token_user(raw_token):
+    """
+    The active user a JWT access token belongs to, or None.
+    """
+    if not raw_token:
+        return None
+    auth = CachedJWTAuthentication()
+    try:
+        return auth.get_user(auth.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def ticket_key(ticket):
+    return f'gpsinfo:stream-ticket:{ticket}'
+
+
+def issue_ticket(user):
+    """
+    A single-use ticket opening one stream or live tracking socket as
+    ``user`` within STREAM_TICKET_TTL_S seconds, kept in the shared cache.
+    """
+    ticket = secrets.token_urlsafe(32)
+    cache.set(ticket_key(ticket), user.pk, gps_setting('STREAM_TICKET_TTL_S'))
+    return ticket
+
+
+def ticket_user(ticket):
+    """
+    The active user a ticket was issued to, spending it; or None.
+    """
+    if not ticket or len(ticket) > 64:
+        return None
+    user_id = cache.get(ticket_key(ticket))
+    # Only one caller's delete() removes the entry, so one connection opens
+    if user_id is None or not cache.delete(ticket_key(ticket)):
+        return None
+    user = cached_user(user_id)
+    return user if user is not None and user.is_active else None
+
+
+def authenticate(request):
+    """
+    The user of the request's JWT in the Authorization header or, since
+    EventSource cannot set headers, of a ?ticket= from stream-ticket/; or None.
+    """
+    header = CachedJWTAuthentication().get_header(request)
+    if header is not None:
+        return token_user(CachedJWTAuthentication().get_raw_token(header))
+    return ticket_user(request.GET.get('ticket'))
+
+
+def subscription_scopes(group, usernames):
+    """
+    The broker scopes of a viewer following a group, some users or everyone.
+    """
+    if usernames:
+        return [user_scope(name) for name in usernames]
+    return [group_scope(group) if group else SCOPE_ALL]
+
+
+def sse(kind, data, event_id=None):
+    lines = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{lines}event: {kind}\ndata: {data}\n\n'
+
+
+def scope_state(group, usernames, cursor, box=None):
+    """
+    (next cursor, position JSON texts, removed usernames) bringing a viewer
+    of the scope, optionally within a viewport ``box``, up to date: the
+    changes since ``cursor``, or every position when it is None.
+    """
+    latest, tombstones = scope_querysets(group, usernames)
+    if cursor is None:
+        tombstones = tombstones.none()
+    changes, removed, next_cursor = latest_changes(latest, tombstones, cursor or 0, box)
+    positions = [json.dumps(row, separators=(',', ':')) for row in GPSLatestSerializer(changes, many=True).data]
+    return next_cursor, positions, removed
+
+
+def initial_events(group, usernames, cursor):
+    """
+    (next cursor, SSE text) of scope_state().
+    """
+    next_cursor, positions, removed = scope_state(group, usernames, cursor)
+    parts = [sse('position', data, next_cursor) for data in positions]
+    parts += [sse('remove', json.dumps({'username': name}, separators=(',', ':')), next_cursor) for name in removed]
+    if not parts:
+        # An empty update still moves the client's Last-Event-ID forward
+        parts.append(f'id: {next_cursor}\n\n')
+    return next_cursor, ''.join(parts)
+
+
+async def stream_latest(request):
+    """
+    Stream latest positions of the fleet, ?group=<group> or ?users=a,b.
+    """
+    if request.method != 'GET':
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    if not isinstance(request, ASGIRequest):
+        # A WSGI server would try to buffer the endless stream
+        return JsonResponse({"error": "Streaming requires the ASGI server (rbackend/asgi.py)"}, status=501)
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse({"error": "User not authenticated"}, status=401)
+    group = request.GET.get('group')
+    usernames = [name for name in request.GET.get('users', '').split(',') if name]
+    if group and usernames:
+        return JsonResponse({"error": "Use either group or users, not both"}, status=400)
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    cursor = parse_cursor(since)
+    if since and cursor is None:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+
+    response = StreamingHttpResponse(event_stream(subscription_scopes(group, usernames), group, usernames, cursor),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def event_stream(scopes, group, usernames, cursor):
+    # Subscribe before reading the initial state, so no write falls between
+    subscription = get_broker().subscribe(scopes)
+    try:
+        yield f"retry: {gps_setting('STREAM_RETRY_MS')}\n\n"
+        last_id, text = await sync_to_async(initial_events)(group, usernames, cursor)
+        yield text
+        while True:
+            events = await subscription.get()
+            if subscription.overflowed:
+                # Too far behind: catch up from the database instead
+                logger.info(f"SSE subscriber {scopes} overflowed, resyncing from cursor {last_id}")
+                subscription.resynced()
+                last_id, text = await sync_to_async(initial_events)(group, usernames, last_id)
+                yield text
+            elif events:
+                stable = await get_stable_cursor().get()
+                if stable is not None and stable > last_id:
+                    last_id = stable
+                yield ''.join(sse(event.kind, event.data, last_id) for event in events)
+            else:
+                yield ': heartbeat\n\n'
+    finally:
+        subscription.close()
@@ -1,5 +1,46 @@
-from rest_framework.test import APITestCase
-from .models import GPSLocation
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+from asgiref.sync import sync_to_async
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.db import connection
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.apps import apps
+from django.test import AsyncClient, SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from . import dbcopy, nearby, partitions
+from .buffer import BufferFull, FlushFailed, WriteBehindBuffer
+from .decimation import Decimator
+from .geo import haversine_m
+from .longpoll import latest_long_poll
+from .broker import InMemoryBroker, LatestEvent, get_broker, position_events
+from .ingest import update_latest, write_locations
+from .models import GPSLocation, GPSLatest, GPSSpoolCheckpoint, GPSTrackDaily, GPSTrackMinute
+from .notify import LocalNotifyChannel, PgNotifyBroker, PgNotifyChannel, decode_notification, encode_notifications
+from .polyline import PolylineError, decode_track, encode_columns, encode_track
+from .retention import downsample
+from .signals import latest_members, member_scopes
+from .snapshots import LatestSnapshotCache, get_snapshot_cache, group_latest
+from .spatial import cover_ranges, point_zkey, radius_bbox
+from .spool import GPSSpool, decode_record, drain_segment, pending_segments
+from .stream import issue_ticket
+from .versions import SCOPE_ALL, bump, group_scope, stamp
+from .views import GPSLocationViewSet
+from .websocket import with_live_tracking
+from .wire import MEDIA_TYPE, WireFormatError, decode_points, encode_points
 
 class GPSLocationTests(APITestCase):
     def test_create_gps_location(self):
@@ -8,4 +49,1274 @@ class GPSLocationTests(APITestCase):
             'longitude': -74.0060,
             'timestamp': '2025-08-12T12:00:00Z'
         })
-        self.assertEqual(response.status_code, 201)
\ No newline at end of file
+        self.assertEqual(response.status_code, 201)
+
+class GPSBatchTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='walker', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+
+    def test_batch_create(self):
+        points = [
+            {'latitude': 22.30 + i * 0.001, 'longitude': 114.17, 'accuracy': 5.0}
+            for i in range(50)
+        ]
+        response = self.client.post('/api/gpslocations/batch/', points, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 50)
+        self.assertEqual(GPSLocation.objects.filter(user=self.user).count(), 50)
+        latest = GPSLatest.objects.get(user=self.user)
+        self.assertAlmostEqual(latest.latitude, 22.30 + 49 * 0.001)
+
+    def test_batch_reports_item_errors(self):
+        points = [
+            {'latitude': 22.3, 'longitude': 114.1},
+            {'latitude': 'north', 'longitude': 114.1},
+            {'longitude': 114.1},
+        ]
+        response = self.client.post('/api/gpslocations/batch/', {'points': points}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['index'] for item in response.data['errors']], [1, 2])
+        self.assertFalse(GPSLocation.objects.exists())
+
+
+class GPSLatestUpsertTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='racer', password='pass1234')
+
+    def make_location(self, latitude, timestamp):
+        return GPSLocation(user=self.user, latitude=latitude, longitude=114.0, timestamp=timestamp)
+
+    def test_upsert_only_advances(self):
+        now = timezone.now()
+        update_latest(self.user, self.make_location(22.0, now))
+        update_latest(self.user, self.make_location(23.0, now + timedelta(seconds=5)))
+        # A delayed, older point must not overwrite the newer position
+        update_latest(self.user, self.make_location(21.0, now - timedelta(seconds=5)))
+        latest = GPSLatest.objects.get(user=self.user)
+        self.assertEqual(latest.latitude, 23.0)
+        self.assertEqual(latest.timestamp, now + timedelta(seconds=5))
+
+    def test_orm_fallback_only_advances(self):
+        now = timezone.now()
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            update_latest(self.user, self.make_location(22.0, now))
+            update_latest(self.user, self.make_location(21.0, now - timedelta(seconds=5)))
+        self.assertEqual(GPSLatest.objects.get(user=self.user).latitude, 22.0)
+
+
+class GPSIdempotencyTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='retrier', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+
+    def test_replayed_device_seq_is_ignored(self):
+        point = {
+            'latitude': 22.3, 'longitude': 114.1,
+            'captured_at': '2025-08-12T12:00:00Z', 'device_seq': 1755000000000,
+        }
+        response = self.client.post('/api/gpslocations/', point, format='json')
+        self.assertEqual(response.status_code, 201)
+        stored_id = response.data['id']
+        self.assertIsNotNone(stored_id)
+        for _ in range(2):
+            response = self.client.post('/api/gpslocations/', point, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response.data['id'], response.data['duplicate']), (stored_id, True))
+        response = self.client.post('/api/gpslocations/batch/', [point, dict(point, device_seq=1755000001000)], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['duplicates']), (1, 1))
+
+        locations = GPSLocation.objects.filter(user=self.user)
+        self.assertEqual(locations.count(), 2)
+        location = locations.get(device_seq=1755000000000)
+        self.assertEqual(location.captured_at.isoformat(), '2025-08-12T12:00:00+00:00')
+        self.assertNotEqual(location.timestamp, location.captured_at)
+        self.assertEqual(GPSLatest.objects.get(user=self.user).timestamp, location.captured_at)
+
+
+    def test_replays_do_not_move_the_latest_position(self):
+        self.client.post('/api/gpslocations/', {'latitude': 22.3, 'longitude': 114.1, 'device_seq': 5}, format='json')
+        self.client.post('/api/gpslocations/', {'latitude': 22.5, 'longitude': 114.1, 'device_seq': 6}, format='json')
+        # Received last, but only a retry of the first point
+        response = self.client.post('/api/gpslocations/', {'latitude': 22.3, 'longitude': 114.1, 'device_seq': 5},
+                                    format='json')
+        self.assertTrue(response.data['duplicate'])
+        self.assertEqual(GPSLatest.objects.get(user=self.user).latitude, 22.5)
+
+
+class WriteBehindBufferTests(SimpleTestCase):
+    def test_flushes_in_batches_and_acks(self):
+        written = []
+        buffer = WriteBehindBuffer(lambda locations, latest_only: written.append(locations), max_pending=100, flush_rows=3, flush_interval_ms=50)
+        buffer.start()
+        try:
+            tickets = [buffer.submit([n]) for n in range(3)]
+            for ticket in tickets:
+                self.assertTrue(ticket.wait(2))
+        finally:
+            buffer.stop()
+        self.assertEqual([n for batch in written for n in batch], [0, 1, 2])
+
+    def test_backpressure_when_full(self):
+        buffer = WriteBehindBuffer(lambda locations, latest_only: None, max_pending=2)
+        buffer.submit([1, 2])
+        with self.assertRaises(BufferFull):
+            buffer.submit([3])
+        # Stopping without a thread flushes inline and frees the buffer
+        buffer.stop()
+        self.assertEqual(buffer.pending, 0)
+
+    def test_failed_flush_is_reported_to_waiters(self):
+        def broken_writer(locations, latest_only):
+            raise RuntimeError('database unavailable')
+        buffer = WriteBehindBuffer(broken_writer)
+        ticket = buffer.submit([1])
+        buffer.flush()
+        with self.assertRaises(FlushFailed):
+            ticket.wait(0)
+
+
+@override_settings(GPSINFO={'INGEST_MODE': 'write_behind'})
+class WriteBehindViewTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='burst', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+
+    def test_full_buffer_returns_429(self):
+        full = WriteBehindBuffer(lambda locations, latest_only: None, max_pending=0)
+        with mock.patch('gpsinfo.ingest.get_buffer', return_value=full):
+            response = self.client.post('/api/gpslocations/', {'latitude': 22.3, 'longitude': 114.1}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_enqueue_ack_returns_before_flush(self):
+        idle = WriteBehindBuffer(lambda locations, latest_only: None)
+        with mock.patch('gpsinfo.ingest.get_buffer', return_value=idle), \
+                self.settings(GPSINFO={'INGEST_MODE': 'write_behind', 'WRITE_BEHIND_ACK': 'enqueue'}):
+            response = self.client.post('/api/gpslocations/batch/', [{'latitude': 22.3, 'longitude': 114.1}], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(idle.pending, 1)
+        self.assertFalse(GPSLocation.objects.exists())
+
+
+class GPSSpoolTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='spooler', password='pass1234')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def spool_points(self, count):
+        spool = GPSSpool(self.directory, fsync_interval_ms=0)
+        spool.append([
+            GPSLocation(user=self.user, latitude=22.0 + i, longitude=114.0, device_seq=i)
+            for i in range(count)
+        ])
+        spool.close()
+        return pending_segments(self.directory)
+
+    def test_drain_replays_segment(self):
+        segments = self.spool_points(5)
+        self.assertEqual(len(segments), 1)
+        # Simulate a crash mid-write: the torn final line must be ignored
+        with open(segments[0], 'ab') as f:
+            f.write(b'0000 {"user_id"')
+
+        self.assertEqual(drain_segment(segments[0], batch_size=2), 5)
+        self.assertEqual(GPSLocation.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(GPSLatest.objects.get(user=self.user).latitude, 26.0)
+        self.assertEqual(pending_segments(self.directory), [])
+        self.assertFalse(GPSSpoolCheckpoint.objects.exists())
+
+    def test_drain_resumes_from_checkpoint(self):
+        segment = self.spool_points(3)[0]
+        first_line = len(open(segment, 'rb').readline())
+        GPSSpoolCheckpoint.objects.create(segment=os.path.basename(segment), offset=first_line)
+        self.assertEqual(drain_segment(segment), 2)
+        self.assertEqual(
+            sorted(GPSLocation.objects.values_list('device_seq', flat=True)), [1, 2]
+        )
+
+
+class GPSSpoolPoisonTests(TransactionTestCase):
+    # Foreign keys are checked at commit, which a TestCase never reaches
+
+    def test_unwritable_points_go_to_dead_letters(self):
+        user = get_user_model().objects.create_user(username='spooler', password='pass1234')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        spool = GPSSpool(directory, fsync_interval_ms=0)
+        spool.append([
+            GPSLocation(user_id=user.pk if i != 2 else user.pk + 1000, latitude=22.0 + i, longitude=114.0, device_seq=i)
+            for i in range(5)
+        ])
+        spool.close()
+        segment, = pending_segments(directory)
+
+        self.assertEqual(drain_segment(segment, batch_size=3), 4)
+        self.assertEqual(sorted(GPSLocation.objects.values_list('device_seq', flat=True)), [0, 1, 3, 4])
+        self.assertEqual(pending_segments(directory), [])
+        self.assertFalse(GPSSpoolCheckpoint.objects.exists())
+        dead = open(segment[:-len('.log')] + '.dead', 'rb').readlines()
+        self.assertEqual([decode_record(line)[0].device_seq for line in dead], [2])
+
+
+class DecimationTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='stillstand', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+
+    def test_decimator_drops_near_duplicates(self):
+        decimator = Decimator(min_distance_m=10, min_interval_s=30)
+        start = timezone.now()
+        points = [
+            GPSLocation(latitude=22.3, longitude=114.1, captured_at=start),
+            # ~1 m away and 5 s later: redundant
+            GPSLocation(latitude=22.30001, longitude=114.1, captured_at=start + timedelta(seconds=5)),
+            # ~1 km away: stored
+            GPSLocation(latitude=22.31, longitude=114.1, captured_at=start + timedelta(seconds=10)),
+            # same place but 60 s later: stored
+            GPSLocation(latitude=22.31, longitude=114.1, captured_at=start + timedelta(seconds=70)),
+        ]
+        kept, dropped = decimator.filter(1, points)
+        self.assertEqual(kept, [points[0], points[2], points[3]])
+        self.assertEqual(dropped, [points[1]])
+        self.assertEqual(decimator.stats(1), {'stored': 3, 'dropped': 1})
+
+    def test_dropped_points_still_refresh_latest(self):
+        decimator = Decimator(min_distance_m=50, min_interval_s=300)
+        points = [
+            {'latitude': 22.3, 'longitude': 114.1, 'captured_at': '2025-08-12T12:00:00Z'},
+            {'latitude': 22.3001, 'longitude': 114.1, 'captured_at': '2025-08-12T12:00:10Z'},
+        ]
+        with mock.patch('gpsinfo.ingest.get_decimator', return_value=decimator), \
+                self.settings(GPSINFO={'DECIMATION_ENABLED': True}):
+            response = self.client.post('/api/gpslocations/batch/', points, format='json')
+        self.assertEqual(response.data, {'created': 1, 'dropped': 1, 'duplicates': 0})
+        self.assertEqual(GPSLocation.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(GPSLatest.objects.get(user=self.user).latitude, 22.3001)
+
+
+class PackedWireTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='packer', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+
+    def test_round_trip(self):
+        captured = timezone.now().replace(microsecond=0)
+        body = encode_points([
+            {'latitude': 22.3, 'longitude': 114.1, 'altitude': 12.5, 'accuracy': 4.0,
+             'captured_at': captured, 'device_seq': 7},
+            {'latitude': -33.9, 'longitude': 151.2},
+        ])
+        self.assertEqual(len(body), 4 + 2 * 40)
+        first, second = decode_points(body)
+        self.assertEqual(first['captured_at'], captured)
+        self.assertEqual(first['device_seq'], 7)
+        self.assertEqual(first['altitude'], 12.5)
+        self.assertIsNone(second['accuracy'])
+        self.assertIsNone(second['captured_at'])
+
+    def test_packed_batch_and_single(self):
+        body = encode_points([{'latitude': 22.3 + i / 100, 'longitude': 114.1, 'device_seq': i} for i in range(20)])
+        response = self.client.post('/api/gpslocations/batch/', body, content_type=MEDIA_TYPE)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 20)
+
+        body = encode_points([{'latitude': 22.5, 'longitude': 114.2}])
+        response = self.client.post('/api/gpslocations/', body, content_type=MEDIA_TYPE)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(GPSLocation.objects.filter(user=self.user).count(), 21)
+
+    def test_rejects_out_of_range(self):
+        body = encode_points([{'latitude': 95.0, 'longitude': 114.1}])
+        response = self.client.post('/api/gpslocations/batch/', body, content_type=MEDIA_TYPE)
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_capture_time_out_of_range(self):
+        body = encode_points([{'latitude': 22.3, 'longitude': 114.1, 'captured_at': 2 ** 62}])
+        with self.assertRaises(WireFormatError):
+            decode_points(body)
+        response = self.client.post('/api/gpslocations/batch/', body, content_type=MEDIA_TYPE)
+        self.assertEqual(response.status_code, 400)
+
+
+class PolylineTrackTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='tracker', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+
+    def test_round_trip(self):
+        start = timezone.now().replace(microsecond=0)
+        rows = [(22.3 + i * 1e-4, 114.1 - i * 1e-4, start + timedelta(seconds=i), 5.0 if i % 2 else None)
+                for i in range(1000)]
+        decoded = decode_track(encode_track(rows))
+        self.assertEqual(len(decoded), 1000)
+        self.assertAlmostEqual(decoded[999]['latitude'], rows[999][0], places=5)
+        self.assertEqual(decoded[999]['captured_at'], rows[999][2])
+        self.assertIsNone(decoded[0]['accuracy'])
+        self.assertEqual(decoded[1]['accuracy'], 5.0)
+        # The classic example from the polyline algorithm documentation
+        self.assertEqual(encode_columns([[3850000, 4070000, 4325200], [-12020000, -12095000, -12645300]]),
+                         '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+
+    def test_upload_and_download(self):
+        start = timezone.now().replace(microsecond=0)
+        rows = [(22.3 + i * 1e-3, 114.1, start + timedelta(seconds=i), 3.0) for i in range(30)]
+        payload = {'polyline': encode_track(rows), 'device_seq_start': 100}
+        for _ in range(2):
+            response = self.client.post('/api/gpslocations/batch/', payload, format='json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(GPSLocation.objects.filter(user=self.user).count(), 30)
+
+        response = self.client.get('/api/gpslocations/my-locations/', {'encoding': 'polyline'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 30)
+        self.assertEqual([p['latitude'] for p in decode_track(response.data['polyline'])],
+                         [round(r[0], 5) for r in rows])
+
+    def test_download_is_paged_with_a_limit(self):
+        start = timezone.now().replace(microsecond=0)
+        rows = [(22.3 + i * 1e-3, 114.1, start + timedelta(seconds=i), 3.0) for i in range(30)]
+        self.client.post('/api/gpslocations/batch/', {'polyline': encode_track(rows)}, format='json')
+
+        track, url, params = [], '/api/gpslocations/my-locations/', {'encoding': 'polyline', 'limit': 12}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(response.data['count'], 12)
+            track += decode_track(response.data['polyline'])
+            url, params = response.data['next'], None
+        # One batch shares a receive timestamp, so pages split within a tie
+        self.assertEqual([p['latitude'] for p in track], [round(r[0], 5) for r in rows])
+        for limit in ('0', 'ten', '\u00b2'):
+            response = self.client.get('/api/gpslocations/my-locations/', {'encoding': 'polyline', 'limit': limit})
+            self.assertEqual(response.status_code, 400)
+
+    def test_rejects_time_out_of_range(self):
+        polyline = encode_columns([[2230000], [11410000], [10 ** 20], [30]])
+        with self.assertRaises(PolylineError):
+            decode_track(polyline)
+        response = self.client.post('/api/gpslocations/batch/', {'polyline': polyline}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class PartitionHelperTests(SimpleTestCase):
+    def test_month_arithmetic_and_names(self):
+        december = partitions.month_start(datetime(2025, 12, 17, 8, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.add_months(december, 1), datetime(2026, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.add_months(december, -12), datetime(2024, 12, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.partition_name(december), 'gpsinfo_gpslocation_p202512')
+        self.assertEqual(partitions.partition_month('gpsinfo_gpslocation_p202512'), december)
+        self.assertIsNone(partitions.partition_month('gpsinfo_gpslocation_default'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'partitioning is PostgreSQL only')
+class PartitionedStorageTests(APITestCase):
+    def test_partitions_are_managed_and_orm_still_works(self):
+        user = get_user_model().objects.create_user(username='archivist', password='pass1234')
+        old = datetime(2020, 1, 15, tzinfo=dt_timezone.utc)
+        with connection.cursor() as cursor:
+            self.assertTrue(partitions.is_partitioned(cursor))
+            partitions.create_partition(cursor, partitions.month_start(old))
+        GPSLocation.objects.create(user=user, latitude=1, longitude=2, timestamp=old)
+        GPSLocation.objects.create(user=user, latitude=3, longitude=4)
+        self.assertEqual(GPSLocation.objects.filter(user=user).count(), 2)
+
+        call_command('gps_partitions', ahead=2, retain_months=12, stdout=io.StringIO())
+        with connection.cursor() as cursor:
+            names = partitions.list_partitions(cursor)
+        self.assertNotIn('gpsinfo_gpslocation_p202001', names)
+        self.assertIn(partitions.partition_name(partitions.add_months(partitions.month_start(timezone.now()), 2)), names)
+        self.assertEqual(list(GPSLocation.objects.filter(user=user).values_list('latitude', flat=True)), [3])
+
+    def test_keyed_points_are_inserted_without_a_lookup(self):
+        user = get_user_model().objects.create_user(username='latecomer', password='pass1234')
+        points = [GPSLocation(user=user, latitude=1, longitude=2, device_seq=seq) for seq in (7, 8)]
+        # Savepoint, INSERT into the partitions, GPSLatest upsert, release
+        with self.assertNumQueries(4):
+            write_locations(points)
+        # A replay writes nothing, so GPSLatest is left alone
+        with self.assertNumQueries(3):
+            write_locations([GPSLocation(user=user, latitude=1, longitude=2, device_seq=7)])
+        self.assertEqual(sorted(GPSLocation.objects.filter(user=user).values_list('device_seq', flat=True)), [7, 8])
+
+
+class RetentionTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='historian', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+
+    def test_downsample_keeps_one_per_bucket_and_movement(self):
+        start = datetime(2025, 3, 1, tzinfo=dt_timezone.utc)
+        points = [GPSLocation(latitude=22.3, longitude=114.1, timestamp=start + timedelta(seconds=i))
+                  for i in range(120)]
+        points[30].latitude = 22.31  # ~1.1 km jump inside the first minute
+        kept = downsample(points, bucket_seconds=60, move_m=100)
+        self.assertEqual([(location.timestamp.second, samples) for location, samples in kept],
+                         [(0, 30), (30, 1), (31, 29), (0, 60)])
+
+    def test_retention_command_builds_tiers_and_reads_merge(self):
+        now = timezone.now()
+        old_day = (now - timedelta(days=40)).replace(hour=8, minute=0, second=0, microsecond=0)
+        recent = (now - timedelta(days=10)).replace(hour=8, minute=0, second=0, microsecond=0)
+        GPSLocation.objects.bulk_create(
+            [GPSLocation(user=self.user, latitude=22.3 + i * 1e-5, longitude=114.1, timestamp=old_day + timedelta(seconds=i))
+             for i in range(600)]
+            + [GPSLocation(user=self.user, latitude=22.4, longitude=114.2, timestamp=recent + timedelta(seconds=i))
+               for i in range(7200)]
+            + [GPSLocation(user=self.user, latitude=22.5, longitude=114.3)]
+        )
+
+        call_command('gps_retention', raw_days=7, minute_days=30, max_chunks=1, stdout=io.StringIO())
+        self.assertEqual(GPSLocation.objects.filter(user=self.user).count(), 7201)
+
+        call_command('gps_retention', raw_days=7, minute_days=30, stdout=io.StringIO())
+        self.assertEqual(GPSLocation.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(GPSTrackMinute.objects.filter(user=self.user).count(), 120)
+        daily = GPSTrackDaily.objects.get(user=self.user)
+        self.assertEqual((daily.day, daily.samples), (old_day.date(), 600))
+        # Measured along the kept minute points, 0s..540s
+        self.assertAlmostEqual(daily.distance_m, 540 * 1e-5 * 111195, delta=5)
+
+        response = self.client.get('/api/gpslocations/my-locations/', {'page_size': 1000})
+        self.assertEqual(response.status_code, 200)
+        rows = response.data['results']
+        self.assertEqual([row['resolution'] for row in rows], ['raw'] + ['minute'] * 120 + ['day'])
+        self.assertEqual(sum(row.get('samples', 1) for row in rows), 7801)
+
+    def test_minute_tier_merges_buckets_written_twice(self):
+        start = (timezone.now() - timedelta(days=20)).replace(minute=0, second=0, microsecond=0)
+        GPSTrackMinute.objects.create(user=self.user, latitude=22.3, longitude=114.1, timestamp=start, samples=5)
+        # Captured long before they were received: buckets follow the receive time
+        GPSLocation.objects.bulk_create([
+            GPSLocation(user=self.user, latitude=22.3, longitude=114.1, timestamp=start + timedelta(seconds=i),
+                        captured_at=start - timedelta(days=3, seconds=i))
+            for i in range(90)
+        ])
+
+        call_command('gps_retention', raw_days=7, minute_days=30, stdout=io.StringIO())
+        self.assertFalse(GPSLocation.objects.filter(user=self.user).exists())
+        self.assertEqual(list(GPSTrackMinute.objects.filter(user=self.user).order_by('timestamp').values_list(
+            'timestamp', 'samples')), [(start, 65), (start + timedelta(minutes=1), 30)])
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='pager', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+        start = datetime(2025, 5, 1, tzinfo=dt_timezone.utc)
+        # Pairs of points share a timestamp so ties must be broken by id
+        GPSLocation.objects.bulk_create([
+            GPSLocation(user=self.user, latitude=i, longitude=0, timestamp=start + timedelta(seconds=i // 2))
+            for i in range(25)
+        ])
+        GPSTrackMinute.objects.create(user=self.user, latitude=-1, longitude=0,
+                                      timestamp=start - timedelta(days=1), samples=60)
+
+    def walk(self, path, params):
+        rows, url = [], path
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            rows.extend(response.data['results'])
+            url, params = response.data['next'], None
+        return rows
+
+    def test_list_pages_cover_every_row_once(self):
+        rows = self.walk('/api/gpslocations/', {'page_size': 4})
+        self.assertEqual([row['latitude'] for row in rows], [float(i) for i in range(24, -1, -1)])
+
+    def test_my_locations_merges_tiers_with_bounds_and_projection(self):
+        rows = self.walk('/api/gpslocations/my-locations/', {'page_size': 7, 'fields': 'latitude,resolution'})
+        self.assertEqual(len(rows), 26)
+        self.assertEqual(rows[-1], {'latitude': -1.0, 'resolution': 'minute'})
+
+        response = self.client.get('/api/gpslocations/my-locations/', {
+            'since': '2025-05-01T00:00:05Z', 'until': '2025-05-01T00:00:07Z', 'fields': 'latitude',
+        })
+        self.assertEqual(response.data['results'], [{'latitude': v} for v in (13.0, 12.0, 11.0, 10.0)])
+        self.assertIsNone(response.data['next'])
+
+    def test_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/gpslocations/', {'cursor': 'nonsense'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/gpslocations/', {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/gpslocations/my-locations/', {'since': 'yesterday'}).status_code, 400)
+
+
+class BenchmarkCommandTests(APITestCase):
+    def test_every_scenario_runs_and_rolls_back(self):
+        for scenario in ('ingest', 'wire', 'viewport'):
+            out = io.StringIO()
+            call_command('gps_benchmark', scenario, points=6, batch_size=4, rows=30, stdout=out)
+            self.assertIn('/sec' if scenario != 'viewport' else 'whole fleet', out.getvalue())
+        self.assertIn('       30 rows', out.getvalue())
+        self.assertFalse(GPSLocation.objects.exists())
+        self.assertFalse(GPSLatest.objects.exists())
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='exporter', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+        start = datetime(2025, 6, 1, tzinfo=dt_timezone.utc)
+        GPSLocation.objects.bulk_create([
+            GPSLocation(user=self.user, latitude=22.3 + i * 1e-4, longitude=114.1,
+                        altitude=10.0 if i % 2 else None, timestamp=start + timedelta(seconds=i))
+            for i in range(3000)
+        ])
+
+    def download(self, params):
+        response = self.client.get('/api/gpslocations/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_geojson_and_csv(self):
+        response, body = self.download({'type': 'geojson'})
+        self.assertEqual(response['Content-Type'], 'application/geo+json')
+        features = json.loads(body)['features']
+        self.assertEqual(len(features), 3000)
+        self.assertEqual(features[1]['geometry']['coordinates'], [114.1, 22.3001, 10.0])
+
+        _, body = self.download({'type': 'csv', 'since': '2025-06-01T00:49:00Z'})
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(rows[0][:3], ['username', 'latitude', 'longitude'])
+        self.assertEqual(len(rows), 1 + 3000 - 49 * 60)
+
+    def test_non_finite_numbers_are_exported_as_null(self):
+        GPSLocation.objects.all().delete()
+        GPSLocation.objects.create(user=self.user, latitude=22.3, longitude=114.1,
+                                   altitude=float('inf'), accuracy=float('-inf'))
+
+        def reject(constant):
+            raise ValueError(f"{constant} is not JSON")
+
+        _, body = self.download({'type': 'geojson'})
+        feature, = json.loads(body, parse_constant=reject)['features']
+        self.assertEqual(feature['geometry']['coordinates'], [114.1, 22.3])
+        self.assertIsNone(feature['properties']['accuracy'])
+        _, body = self.download({'type': 'gpx'})
+        self.assertNotIn(b'<ele>', body)
+
+    def test_gzipped_gpx(self):
+        response, body = self.download({'type': 'gpx', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        gpx = gzip.decompress(body).decode()
+        self.assertTrue(gpx.endswith('</trkseg></trk>\n</gpx>\n'))
+        self.assertEqual(gpx.count('<trkpt '), 3000)
+
+    def test_command_writes_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'all.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('export_gps', format='csv', output=path, user=['exporter'], stdout=io.StringIO())
+        with open(path) as f:
+            self.assertEqual(sum(1 for _ in f), 3001)
+
+
+class DBCopyPlanTests(SimpleTestCase):
+    def test_parents_come_before_children(self):
+        models = {m._meta.db_table: m for m in apps.get_models(include_auto_created=True)}
+        level_of = {table: n for n, level in enumerate(dbcopy.table_levels(models)) for table in level}
+        self.assertLess(level_of['accounts_customuser'], level_of['gpsinfo_gpslocation'])
+        self.assertLess(level_of['accounts_customuser'], level_of['gpsinfo_gpslatest'])
+        self.assertLess(level_of['auth_permission'], level_of['auth_group_permissions'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'COPY is PostgreSQL only')
+class DBCopyRoundTripTests(TransactionTestCase):
+    def test_export_then_resumable_import(self):
+        user = get_user_model().objects.create_user(username='mover', password='pass1234')
+        GPSLocation.objects.bulk_create([GPSLocation(user=user, latitude=i, longitude=i) for i in range(500)])
+        update_latest(user, GPSLocation.objects.filter(user=user).first())
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        out = io.StringIO()
+        call_command('dbcopy', 'export', directory, compress=True, jobs=3, stdout=out)
+        self.assertIn('exported gpsinfo_gpslocation: 500 rows', out.getvalue())
+
+        GPSLocation.objects.all().delete()
+        call_command('dbcopy', 'import', directory, jobs=3, stdout=io.StringIO())
+        self.assertEqual(GPSLocation.objects.filter(user__username='mover').count(), 500)
+        self.assertTrue(GPSLatest.objects.filter(user__username='mover').exists())
+        # Sequences were moved past the imported ids
+        self.assertGreater(GPSLocation.objects.create(latitude=0, longitude=0).pk,
+                           max(GPSLocation.objects.exclude(user=None).values_list('pk', flat=True)))
+
+        out = io.StringIO()
+        call_command('dbcopy', 'import', directory, stdout=out)
+        self.assertNotIn('imported', out.getvalue())
+
+
+class SpatialKeyTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='mapper', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+
+    def test_cover_contains_every_point_in_the_box(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            lat, lon = rng.uniform(-80, 80), rng.uniform(-170, 170)
+            box = (lat, lon, lat + rng.uniform(0, 2), lon + rng.uniform(0, 2))
+            ranges = cover_ranges(*box, 31)
+            self.assertLessEqual(len(ranges), 16)
+            for _ in range(20):
+                key = point_zkey(rng.uniform(box[0], box[2]), rng.uniform(box[1], box[3]))
+                self.assertTrue(any(low <= key < high for low, high in ranges))
+        # Circles that cross the antimeridian give a wrapped box
+        self.assertGreater(radius_bbox(0, 179.99, 5000)[1], radius_bbox(0, 179.99, 5000)[3])
+
+    def test_keys_are_written_and_queried(self):
+        points = [{'latitude': 22.30 + i * 0.001, 'longitude': 114.17} for i in range(20)]
+        self.client.post('/api/gpslocations/batch/', points, format='json')
+        location = GPSLocation.objects.create(user=self.user, latitude=-33.86, longitude=151.21)
+        self.assertEqual(location.zkey, point_zkey(-33.86, 151.21))
+        self.assertFalse(GPSLocation.objects.filter(zkey__isnull=True).exists())
+        self.assertEqual(GPSLatest.objects.get(user=self.user).zkey, point_zkey(22.319, 114.17))
+
+        self.assertEqual(GPSLocation.objects.in_bbox(22.3045, 114.0, 22.3105, 114.2).count(), 6)
+        nearby = GPSLocation.objects.within_radius(22.305, 114.17, 250)
+        self.assertEqual([round(row.latitude, 3) for row in nearby], [22.305, 22.304, 22.306, 22.303, 22.307])
+
+    def test_backfill_command(self):
+        GPSLocation.objects.bulk_create([GPSLocation(user=self.user, latitude=i, longitude=i) for i in range(30)])
+        call_command('gps_backfill_zkey', batch_size=7, stdout=io.StringIO())
+        self.assertEqual(GPSLocation.objects.get(latitude=12).zkey, point_zkey(12, 12))
+        self.assertFalse(GPSLocation.objects.filter(zkey__isnull=True).exists())
+
+    def test_viewport_filters_latest_and_history(self):
+        User = get_user_model()
+        now = timezone.now()
+        for name, lat, lon, age in (('hk', 22.3, 114.17, 5), ('hk-old', 22.31, 114.18, 120),
+                                    ('fiji', -17.0, 179.9, 5), ('london', 51.5, -0.12, 5)):
+            other = User.objects.create_user(username=name, password='pass1234')
+            GPSLatest.objects.create(user=other, latitude=lat, longitude=lon, timestamp=now - timedelta(minutes=age))
+
+        def usernames(params):
+            response = self.client.get('/api/gpslocations/latest/', params)
+            self.assertEqual(response.status_code, 200)
+            return sorted(row['username'] for row in response.data)
+
+        self.assertEqual(usernames({'bbox': '114.0,22.0,114.5,22.5'}), ['hk', 'hk-old'])
+        self.assertEqual(usernames({'bbox': '114.0,22.0,114.5,22.5', 'since': (now - timedelta(hours=1)).isoformat()}), ['hk'])
+        # minLon > maxLon wraps across the antimeridian
+        self.assertEqual(usernames({'bbox': '179.0,-20.0,-179.0,-10.0'}), ['fiji'])
+        self.assertEqual(usernames({'bbox': '10.0,10.0,10.1,10.1'}), [])
+        self.assertEqual(self.client.get('/api/gpslocations/latest/', {'bbox': '114,22,114.5'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/gpslocations/latest/', {'bbox': '114,23,114.5,22'}).status_code, 400)
+
+        points = [{'latitude': 22.30 + i * 0.01, 'longitude': 114.17} for i in range(10)]
+        self.client.post('/api/gpslocations/batch/', points, format='json')
+        response = self.client.get('/api/gpslocations/my-locations/', {'bbox': '114.0,22.325,114.5,22.355'})
+        self.assertEqual([round(row['latitude'], 2) for row in response.data['results']], [22.35, 22.34, 22.33])
+
+
+class NearbyTests(APITestCase):
+    def setUp(self):
+        nearby._index = None
+        self.addCleanup(setattr, nearby, '_index', None)
+        self.addCleanup(lambda: nearby._index is not None and nearby._index.stop())
+        self.user = get_user_model().objects.create_user(username='seeker', password='pass1234')
+        self.client.force_authenticate(user=self.user)
+
+    def test_grid_matches_brute_force(self):
+        rng = random.Random(3)
+        grid = nearby.LatestGrid(cell_deg=0.01)
+        points = {uid: (22.3 + rng.uniform(-0.2, 0.2), 114.1 + rng.uniform(-0.2, 0.2)) for uid in range(3000)}
+        for uid, (lat, lon) in points.items():
+            grid.update(uid, lat, lon, timezone.now())
+        expected = sorted((haversine_m(22.3, 114.1, lat, lon), uid) for uid, (lat, lon) in points.items())
+        expected = [(d, uid) for d, uid in expected if d <= 5000][:10]
+        self.assertEqual(grid.nearest(22.3, 114.1, 5000, 10), expected)
+        # An older position never replaces a newer one
+        grid.update(0, 0.0, 0.0, timezone.now() - timedelta(days=1))
+        self.assertNotEqual(grid._points[0][:2], (0.0, 0.0))
+
+    def test_endpoint_reads_index_kept_current_by_writes(self):
+        User = get_user_model()
+        for i in range(5):
+            other = User.objects.create_user(username=f'device{i}', password='pass1234')
+            update_latest(other, GPSLocation.objects.create(user=other, latitude=22.3 + i * 0.001, longitude=114.1))
+        response = self.client.get('/api/gpslocations/nearby/', {'lat': 22.3, 'lon': 114.1, 'radius_m': 300, 'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['username'] for row in response.data], ['device0', 'device1', 'device2'])
+        self.assertEqual(response.data[1]['distance_m'], round(haversine_m(22.3, 114.1, 22.301, 114.1), 1))
+
+        # A new point refreshes the already built index through latest_changed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(user=User.objects.get(username='device4'))
+            self.client.post('/api/gpslocations/batch/', [{'latitude': 22.2995, 'longitude': 114.1}], format='json')
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/gpslocations/nearby/', {'lat': 22.2995, 'lon': 114.1, 'limit': 1})
+        self.assertEqual(response.data[0]['username'], 'device4')
+        for params in ({'lat': 'x'}, {'lat': 'nan', 'lon': 114.1}, {'lat': 22.3, 'lon': 114.1, 'radius_m': 'nan'},
+                       {'lat': 22.3, 'lon': 114.1, 'radius_m': 'inf'}):
+            self.assertEqual(self.client.get('/api/gpslocations/nearby/', params).status_code, 400, params)
+
+    def test_index_is_refreshed_in_the_background(self):
+        index = nearby.get_latest_index()
+        self.assertEqual(len(index.get()), 0)
+        other = get_user_model().objects.create_user(username='mover', password='pass1234')
+        GPSLatest.objects.create(user=other, latitude=22.3, longitude=114.1, timestamp=timezone.now())
+        # A stale grid is still served while the refresh runs elsewhere
+        index.built_at -= index.refresh_s
+        with self.assertNumQueries(0):
+            self.assertEqual(len(index.get()), 0)
+
+        # Writes committed while a rebuild reads GPSLatest are not lost by the swap
+        rows = [{'user_id': 99, 'latitude': 22.31, 'longitude': 114.1, 'timestamp': timezone.now()}]
+        original = nearby.LatestGrid.update
+
+        def update(grid, *args):
+            if grid is not index.grid and not getattr(grid, 'written', False):
+                grid.written = True
+                index.apply(rows)
+            original(grid, *args)
+
+        with mock.patch.object(nearby.LatestGrid, 'update', update):
+            index.rebuild()
+        self.assertEqual(sorted(index.grid._points), sorted([other.pk, 99]))
+
+
+class GroupLatestTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.viewer = User.objects.create_user(username='viewer', password='pass1234')
+        self.members = []
+        for name, group in (('ann', 'red'), ('bob', 'red'), ('cy', 'blue')):
+            member = User.objects.create_user(username=name, password='pass1234', user_group=group)
+            GPSLatest.objects.create(user=member, latitude=22.3, longitude=114.1, timestamp=timezone.now())
+            self.members.append(member)
+        # Counters are created by writes committing, which these rows skipped
+        bump(member_scopes(latest_members([member.pk for member in self.members])))
+        self.client.force_authenticate(user=self.viewer)
+
+    def test_group_scoped_latest_is_cached_until_a_member_moves(self):
+        response = self.client.get('/api/gpslocations/group/red/')
+        self.assertEqual([row['username'] for row in response.json()], ['ann', 'bob'])
+        self.assertEqual(self.client.get('/api/gpslocations/latest/', {'group': 'red'}).json(), response.json())
+        self.assertEqual(self.client.get('/api/gpslocations/group/green/').json(), [])
+        with self.assertNumQueries(0):
+            self.client.get('/api/gpslocations/group/red/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(user=self.members[1])
+            self.client.post('/api/gpslocations/', {'latitude': 22.4, 'longitude': 114.2}, format='json')
+        self.client.force_authenticate(user=self.viewer)
+        response = self.client.get('/api/gpslocations/group/red/')
+        self.assertEqual(response.json()[1]['latitude'], 22.4)
+
+        # Moving a user changes both the old and the new group
+        with self.captureOnCommitCallbacks(execute=True):
+            self.members[0].user_group = 'blue'
+            self.members[0].save()
+        self.assertEqual([row['username'] for row in self.client.get('/api/gpslocations/group/red/').json()], ['bob'])
+        self.assertEqual([row['username'] for row in self.client.get('/api/gpslocations/group/blue/').json()], ['ann', 'cy'])
+
+    def test_snapshots_are_written_through_and_evicted(self):
+        get_snapshot_cache().clear()
+        self.client.get('/api/gpslocations/group/red/')
+        self.client.get('/api/gpslocations/latest/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(user=self.members[1])
+            self.client.post('/api/gpslocations/', {'latitude': 22.4, 'longitude': 114.2}, format='json')
+        self.client.force_authenticate(user=self.viewer)
+        with self.assertNumQueries(0):
+            red = self.client.get('/api/gpslocations/group/red/').json()
+            everyone = self.client.get('/api/gpslocations/latest/').json()
+        self.assertEqual([(row['username'], row['latitude']) for row in red], [('ann', 22.3), ('bob', 22.4)])
+        self.assertEqual([row['username'] for row in everyone], ['ann', 'bob', 'cy'])
+
+        # Another process's write bumps the counter past the snapshot
+        bump([group_scope('red')])
+        with self.assertNumQueries(1):
+            self.client.get('/api/gpslocations/group/red/')
+
+        # Another worker's snapshot at the same version misses this worker's
+        # write, so its own next write must not be written through onto it
+        red = group_scope('red')
+        (version,), _ = stamp([red])
+        other = LatestSnapshotCache(max_bytes=10 ** 6, max_scopes=8)
+        other.get(red, version, group_latest('red'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(user=self.members[0])
+            self.client.post('/api/gpslocations/', {'latitude': 22.6, 'longitude': 114.2}, format='json')
+        row = {'user_id': self.members[1].pk, 'latitude': 22.7, 'longitude': 114.2, 'altitude': None,
+               'accuracy': None, 'timestamp': timezone.now()}
+        other.apply(position_events([row], latest_members([row['user_id']])), bump([red]))
+        self.assertFalse(other.holds([red]))
+        (version,), _ = stamp([red])
+        self.assertEqual([row['latitude'] for row in json.loads(other.get(red, version, group_latest('red')))],
+                         [22.6, 22.4])
+        self.client.force_authenticate(user=self.viewer)
+
+        snapshots = LatestSnapshotCache(max_bytes=10 ** 6, max_scopes=2)
+        for group in ('red', 'blue', 'red', 'green'):
+            snapshots.get(group_scope(group), 1, group_latest(group))
+        self.assertTrue(snapshots.holds([group_scope('red')]))
+        self.assertFalse(snapshots.holds([group_scope('blue')]))
+
+    def test_snapshots_share_one_entry_per_scope(self):
+        red = group_scope('red')
+        key = f'gpsinfo:latest:snapshot:{red}'
+        LatestSnapshotCache(max_bytes=10 ** 6, max_scopes=8).get(red, 1, group_latest('red'))
+        # A locmem tier is this process's only, so nothing is kept there
+        self.assertIsNone(cache.get(key))
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        backend = {'BACKEND': 'rbackend.cache.LockedFileBasedCache', 'LOCATION': directory}
+        with override_settings(CACHES={'default': backend}):
+            for version in (1, 2):
+                LatestSnapshotCache(max_bytes=10 ** 6, max_scopes=8).get(red, version, group_latest('red'))
+                # Another worker at the same version builds nothing
+                with self.assertNumQueries(0):
+                    body = LatestSnapshotCache(max_bytes=10 ** 6, max_scopes=8).get(red, version, group_latest('red'))
+                self.assertEqual([row['username'] for row in json.loads(body)], ['ann', 'bob'])
+            self.assertEqual(cache.get(key)[0], 2)
+
+    def test_group_combines_with_viewport(self):
+        response = self.client.get('/api/gpslocations/latest/', {'group': 'blue', 'bbox': '114.0,22.0,114.5,22.5'})
+        self.assertEqual([row['username'] for row in response.data], ['cy'])
+
+
+class MoveMixin:
+    def move(self, user, lat=22.4):
+        """Post a new position as user, the way their device would."""
+        self.client.force_authenticate(user=user)
+        self.client.post('/api/gpslocations/', {'latitude': lat, 'longitude': 114.1}, format='json')
+
+
+class ConditionalLatestTests(MoveMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.red = User.objects.create_user(username='red1', password='pass1234', user_group='red')
+        self.blue = User.objects.create_user(username='blue1', password='pass1234', user_group='blue')
+        for member in (self.red, self.blue):
+            GPSLatest.objects.create(user=member, latitude=22.3, longitude=114.1, timestamp=timezone.now())
+        bump(member_scopes(latest_members([self.red.pk, self.blue.pk])))
+        self.client.force_authenticate(user=self.red)
+
+    def move(self, user, lat=22.4):
+        with self.captureOnCommitCallbacks(execute=True):
+            super().move(user, lat)
+        self.client.force_authenticate(user=self.red)
+
+    def test_unchanged_scope_is_answered_with_304_without_queries(self):
+        response = self.client.get('/api/gpslocations/latest/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/gpslocations/latest/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        last_modified = response['Last-Modified']
+        self.assertEqual(self.client.get('/api/gpslocations/latest/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        self.move(self.blue)
+        response = self.client.get('/api/gpslocations/latest/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_scopes_without_a_counter_are_answered_fresh(self):
+        response = self.client.get('/api/gpslocations/group/green/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(stamp([group_scope('green')])[0], [None])
+        # Oversized scopes are answered without touching the counters at all
+        response = self.client.get('/api/gpslocations/group/' + 'g' * 5000 + '/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        response = self.client.get('/api/gpslocations/latest/', {'users': ','.join(f'u{i}' for i in range(500))})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_versions_are_per_scope(self):
+        red = self.client.get('/api/gpslocations/group/red/')['ETag']
+        user = self.client.get('/api/gpslocations/latest/', {'users': 'red1'})['ETag']
+        self.assertNotEqual(red, self.client.get('/api/gpslocations/latest/', {'group': 'red'})['ETag'])
+
+        self.move(self.blue)
+        self.assertEqual(self.client.get('/api/gpslocations/group/red/', HTTP_IF_NONE_MATCH=red).status_code, 304)
+        self.assertEqual(self.client.get('/api/gpslocations/latest/', {'users': 'red1'}, HTTP_IF_NONE_MATCH=user).status_code, 304)
+        self.move(self.red)
+        response = self.client.get('/api/gpslocations/group/red/', HTTP_IF_NONE_MATCH=red)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['latitude'], 22.4)
+        self.assertEqual(self.client.get('/api/gpslocations/latest/', {'users': 'red1'}, HTTP_IF_NONE_MATCH=user).status_code, 200)
+
+
+class ChangeFeedTests(MoveMixin, APITransactionTestCase):
+    # Every request commits on its own, as in production: on PostgreSQL seq
+    # values are transaction ids, which one TestCase transaction would share
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.users = {}
+        for name, group, lat in (('ann', 'red', 22.3), ('bob', 'red', 22.31), ('cy', 'blue', 22.32)):
+            self.users[name] = User.objects.create_user(username=name, password='pass1234', user_group=group)
+            self.move(self.users[name], lat)
+        self.client.force_authenticate(user=self.users['ann'])
+
+    def feed(self, cursor, **params):
+        self.client.force_authenticate(user=self.users['ann'])
+        response = self.client.get('/api/gpslocations/latest/', dict(params, since=cursor))
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        return [row['username'] for row in data['changes']], data['removed'], data['cursor']
+
+    def test_feed_returns_only_changes_since_the_cursor(self):
+        changes, removed, cursor = self.feed(0)
+        self.assertEqual(sorted(changes), ['ann', 'bob', 'cy'])
+        self.assertEqual(self.feed(cursor)[:2], ([], []))
+
+        self.move(self.users['bob'], 22.35)
+        changes, removed, cursor = self.feed(cursor)
+        self.assertEqual(changes, ['bob'])
+        self.assertEqual(self.feed(cursor)[:2], ([], []))
+
+        GPSLatest.objects.filter(user=self.users['cy']).delete()
+        self.assertEqual(self.feed(cursor)[:2], ([], ['cy']))
+
+    def test_tombstones_for_users_leaving_a_scope(self):
+        _, _, red = self.feed(0, group='red')
+        _, _, blue = self.feed(0, group='blue')
+        _, _, box = self.feed(0, bbox='114.0,22.29,114.2,22.315')
+
+        self.users['bob'].user_group = 'blue'
+        self.users['bob'].save()
+        self.assertEqual(self.feed(red, group='red')[:2], ([], ['bob']))
+        self.assertEqual(self.feed(blue, group='blue')[:2], (['bob'], []))
+
+        self.move(self.users['ann'], 23.0)
+        self.assertEqual(self.feed(box, bbox='114.0,22.29,114.2,22.315')[:2], (['bob'], ['ann']))
+        for since in ('x', '\u00b2', '\u0663'):
+            self.assertEqual(self.client.get('/api/gpslocations/latest/', {'since': since}).status_code, 400, since)
+
+
+
+class InMemoryBrokerTests(SimpleTestCase):
+
+    async def test_subscription_gets_the_newest_event_per_user_since_its_last_read(self):
+        broker = InMemoryBroker(max_pending=2, flush_s=0.01, heartbeat_s=60)
+        red = broker.subscribe([group_scope('red')])
+        everyone = broker.subscribe([SCOPE_ALL])
+        event = lambda name, data, group='red': LatestEvent('position', name, (SCOPE_ALL, group_scope(group)), data)
+
+        broker.publish([event('ann', '1'), event('ann', '2'), event('cy', '3', group='blue')])
+        self.assertEqual([e.data for e in await red.get()], ['2'])
+        self.assertEqual([e.data for e in await everyone.get()], ['2', '3'])
+
+        broker.publish([event('bob', '4')])
+        broker.publish([event('ann', '5')])
+        self.assertEqual([e.data for e in await red.get()], ['4', '5'])
+
+        # Three users behind with room for two: resync from the database
+        broker.publish([event('ann', '6'), event('bob', '7'), event('dee', '8')])
+        self.assertEqual(await red.get(), [])
+        self.assertTrue(red.overflowed)
+        red.close()
+        everyone.close()
+        self.assertEqual(len(broker), 0)
+
+
+class PgNotifyBrokerTests(SimpleTestCase):
+
+    def test_notifications_are_split_under_the_payload_limit(self):
+        events = [LatestEvent('position', f'user{i}', (SCOPE_ALL,), json.dumps({'n': i}, separators=(',', ':'))) for i in range(10)]
+        events.append(LatestEvent('remove', 'ann', (SCOPE_ALL, group_scope('red')), '{"username":"ann"}'))
+        payloads = encode_notifications(events, limit=120)
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload.encode()) <= 120 for payload in payloads))
+        self.assertEqual([e for payload in payloads for e in decode_notification(payload)], events)
+
+    async def test_events_reach_subscribers_of_every_broker_on_the_channel(self):
+        # Two brokers on one channel stand for two worker processes
+        cache.clear()
+        channel = LocalNotifyChannel(tick_s=0.01)
+        writer = PgNotifyBroker(flush_s=0.01, heartbeat_s=60, channel=channel, check_s=0)
+        viewer = PgNotifyBroker(flush_s=0.01, heartbeat_s=60, channel=channel, check_s=0)
+        # Nobody to publish to yet, here or in another process
+        self.assertFalse(writer.listening())
+        red = viewer.subscribe([group_scope('red')])
+        self.assertTrue(writer.listening())
+        mine = writer.subscribe([SCOPE_ALL])
+        writer.publish([
+            LatestEvent('position', 'ann', (SCOPE_ALL, group_scope('red')), '{"username":"ann"}'),
+            LatestEvent('position', 'cy', (SCOPE_ALL, group_scope('blue')), '{"username":"cy"}'),
+        ])
+        self.assertEqual([e.username for e in await asyncio.wait_for(red.get(), 5)], ['ann'])
+        self.assertEqual([e.username for e in await asyncio.wait_for(mine.get(), 5)], ['ann', 'cy'])
+
+        # After a lost connection every subscriber catches up from the database
+        viewer.resync()
+        self.assertEqual(await asyncio.wait_for(red.get(), 5), [])
+        self.assertTrue(red.overflowed)
+        red.close()
+        mine.close()
+
+
+@skipUnless(connection.vendor == 'postgresql', "LISTEN/NOTIFY needs PostgreSQL")
+class PgNotifyChannelTests(TransactionTestCase):
+
+    async def test_events_round_trip_through_pg_notify(self):
+        channel = PgNotifyChannel(tick_s=0.01)
+        broker = PgNotifyBroker(flush_s=0.01, heartbeat_s=60, channel=channel, check_s=0)
+        subscription = broker.subscribe([SCOPE_ALL])
+        try:
+            # Let the listener connect
+            await asyncio.sleep(0.5)
+            events = [LatestEvent('position', f'user{i}', (SCOPE_ALL,), json.dumps({'n': i, 'pad': 'x' * 100}, separators=(',', ':')))
+                      for i in range(200)]
+            await sync_to_async(broker.publish)(events)
+            received = []
+            while len(received) < len(events):
+                received += await asyncio.wait_for(subscription.get(), 5)
+            self.assertEqual(sorted(received, key=lambda e: int(e.username[4:])), events)
+        finally:
+            subscription.close()
+            await sync_to_async(channel.stop)()
+
+
+class LatestStreamTests(MoveMixin, APITransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.users = {}
+        for name, group, lat in (('ann', 'red', 22.3), ('bob', 'red', 22.31), ('cy', 'blue', 22.32)):
+            self.users[name] = User.objects.create_user(username=name, password='pass1234', user_group=group)
+            self.move(self.users[name], lat)
+        self.token = str(RefreshToken.for_user(self.users['ann']).access_token)
+
+    def ticket(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.post('/api/gpslocations/stream-ticket/')
+        self.assertEqual(response.status_code, 201)
+        return response.data['ticket']
+
+    @staticmethod
+    def events(chunk):
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        return [
+            dict(line.split(': ', 1) for line in block.split('\n'))
+            for block in chunk.strip().split('\n\n') if block.startswith('id') or block.startswith('event')
+        ]
+
+    async def test_stream_sends_the_scope_then_live_updates(self):
+        client = AsyncClient()
+        self.assertEqual((await client.get('/api/gpslocations/stream/')).status_code, 401)
+
+        # The access token itself is not accepted in the URL
+        self.assertEqual((await client.get('/api/gpslocations/stream/', {'token': self.token})).status_code, 401)
+        ticket = await sync_to_async(self.ticket)()
+        response = await client.get('/api/gpslocations/stream/', {'group': 'red', 'ticket': ticket})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = response.streaming_content
+        try:
+            self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+            initial = self.events(await anext(chunks))
+            self.assertEqual(sorted(json.loads(e['data'])['username'] for e in initial), ['ann', 'bob'])
+
+            await sync_to_async(self.move)(self.users['cy'], 22.4)
+            await sync_to_async(self.move)(self.users['bob'], 22.35)
+            (update,) = self.events(await anext(chunks))
+            self.assertEqual(update['event'], 'position')
+            self.assertEqual(json.loads(update['data'])['username'], 'bob')
+            self.assertEqual(json.loads(update['data'])['latitude'], 22.35)
+            self.assertGreaterEqual(int(update['id']), int(initial[0]['id']))
+        finally:
+            await chunks.aclose()
+        # Spent on connecting
+        self.assertEqual((await client.get('/api/gpslocations/stream/', {'ticket': ticket})).status_code, 401)
+
+    async def test_stream_resumes_from_last_event_id(self):
+        client = AsyncClient()
+        response = await client.get('/api/gpslocations/stream/', {'ticket': await sync_to_async(self.ticket)()})
+        chunks = response.streaming_content
+        await anext(chunks)
+        cursor = self.events(await anext(chunks))[0]['id']
+        await chunks.aclose()
+
+        await sync_to_async(self.move)(self.users['cy'], 22.4)
+        response = await client.get('/api/gpslocations/stream/', {'ticket': await sync_to_async(self.ticket)()},
+                                    headers={'Last-Event-ID': cursor})
+        chunks = response.streaming_content
+        try:
+            await anext(chunks)
+            resumed = self.events(await anext(chunks))
+            self.assertEqual([json.loads(e['data'])['username'] for e in resumed], ['cy'])
+        finally:
+            await chunks.aclose()
+
+    def test_stream_refuses_wsgi(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(self.client.get('/api/gpslocations/stream/').status_code, 501)
+
+
+def close_pool_connections():
+    """
+    End the sessions that database() pool threads of finished event loops
+    left open, so the test database can be dropped.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+                           'WHERE datname = current_database() AND pid <> pg_backend_pid()')
+
+
+class LatestLongPollTests(MoveMixin, APITransactionTestCase):
+    # AsyncClient requests are ASGI requests, so they get ASGI_URLCONF
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.users = {}
+        for name, group in (('ann', 'red'), ('bob', 'red'), ('cy', 'blue')):
+            self.users[name] = User.objects.create_user(username=name, password='pass1234', user_group=group)
+            self.move(self.users[name], 22.3)
+        self.auth = {'Authorization': f"Bearer {RefreshToken.for_user(self.users['ann']).access_token}"}
+
+    def tearDown(self):
+        close_pool_connections()
+
+    async def test_wait_returns_as_soon_as_the_scope_changes(self):
+        client = AsyncClient()
+        cursor = json.loads((await client.get('/api/gpslocations/latest/', {'since': 0}, headers=self.auth)).content)['cursor']
+        poll = asyncio.create_task(client.get(
+            '/api/gpslocations/latest/', {'wait': 10, 'since': cursor, 'group': 'red'}, headers=self.auth))
+        await asyncio.sleep(0.2)
+        self.assertFalse(poll.done())
+
+        # Outside the group: keeps waiting
+        await sync_to_async(self.move)(self.users['cy'], 22.4)
+        await asyncio.sleep(0.5)
+        self.assertFalse(poll.done())
+
+        await sync_to_async(self.move)(self.users['bob'], 22.5)
+        response = await asyncio.wait_for(poll, 5)
+        self.assertEqual(response.status_code, 200)
+        delta = json.loads(response.content)
+        self.assertEqual([(row['username'], row['latitude']) for row in delta['changes']], [('bob', 22.5)])
+        self.assertEqual(delta['removed'], [])
+        self.assertGreaterEqual(int(delta['cursor']), int(cursor))
+
+    async def test_wait_times_out_with_an_empty_delta(self):
+        client = AsyncClient()
+        cursor = json.loads((await client.get('/api/gpslocations/latest/', {'since': 0}, headers=self.auth)).content)['cursor']
+        response = await client.get('/api/gpslocations/latest/', {'wait': 1, 'since': cursor}, headers=self.auth)
+        self.assertEqual(json.loads(response.content), {'cursor': cursor, 'changes': [], 'removed': []})
+        self.assertEqual(len(get_broker()), 0)
+
+        # Pending changes are answered without waiting
+        response = await client.get('/api/gpslocations/latest/', {'wait': 30, 'since': 0, 'users': 'cy'}, headers=self.auth)
+        self.assertEqual([row['username'] for row in json.loads(response.content)['changes']], ['cy'])
+
+    def test_only_the_asgi_urls_mount_the_long_poll(self):
+        # Under WSGI latest/ is the plain DRF action, ?wait= or not
+        self.assertIs(resolve('/api/gpslocations/latest/').func.cls, GPSLocationViewSet)
+        self.assertIs(resolve('/api/gpslocations/latest/', urlconf=settings.ASGI_URLCONF).func, latest_long_poll)
+        self.client.force_authenticate(user=self.users['ann'])
+        response = self.client.get('/api/gpslocations/latest/', {'wait': 5, 'since': 0})
+        self.assertEqual(len(response.data['changes']), 3)
+
+    async def test_wait_needs_a_cursor_and_a_token(self):
+        client = AsyncClient()
+        self.assertEqual((await client.get('/api/gpslocations/latest/', {'wait': 5, 'since': 0})).status_code, 401)
+        response = await client.get('/api/gpslocations/latest/', {'wait': 5}, headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+        for wait in ('soon', '\u00b2'):
+            response = await client.get('/api/gpslocations/latest/', {'wait': wait, 'since': 0}, headers=self.auth)
+            self.assertEqual(response.status_code, 400)
+
+
+class LiveSocket:
+    """
+    In-memory ASGI client for the live tracking WebSocket.
+    """
+
+    def __init__(self, ticket=''):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': '/ws/gpslocations/', 'query_string': f'ticket={ticket}'.encode()}
+        self.task = asyncio.create_task(with_live_tracking(None)(scope, self.incoming.get, self.outgoing.put))
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        return await asyncio.wait_for(self.outgoing.get(), 5)
+
+    async def send(self, message):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    async def receive(self):
+        return json.loads((await asyncio.wait_for(self.outgoing.get(), 5))['text'])
+
+    async def close(self):
+        await self.incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 5)
+
+
+class LiveTrackingSocketTests(APITransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.users = {}
+        for name, group in (('ann', 'red'), ('bob', 'red'), ('cy', 'blue')):
+            self.users[name] = User.objects.create_user(username=name, password='pass1234', user_group=group)
+            GPSLatest.objects.create(user=self.users[name], latitude=22.3, longitude=114.1, timestamp=timezone.now())
+
+    def tearDown(self):
+        close_pool_connections()
+
+    def ticket(self, name):
+        return issue_ticket(self.users[name])
+
+    def test_benchmark_drives_devices_and_viewers(self):
+        out = io.StringIO()
+        # One device: SQLite's shared test database takes one writer at a time
+        call_command('gps_benchmark', 'websocket', devices=1, viewers=3, seconds=0.5, stdout=out)
+        self.assertIn('fixes acked (devices=1)', out.getvalue())
+        self.assertIn('updates sent (viewers=3)', out.getvalue())
+        self.assertEqual(get_user_model().objects.count(), 3)
+        self.assertFalse(GPSLocation.objects.exists())
+
+    async def test_rejects_sockets_without_a_valid_ticket(self):
+        socket = LiveSocket('not-a-ticket')
+        self.assertEqual(await socket.connect(), {'type': 'websocket.close', 'code': 4401})
+        ticket = self.ticket('ann')
+        socket = LiveSocket(ticket)
+        self.assertEqual((await socket.connect())['type'], 'websocket.accept')
+        await socket.close()
+        socket = LiveSocket(ticket)
+        self.assertEqual(await socket.connect(), {'type': 'websocket.close', 'code': 4401})
+
+    async def test_devices_push_fixes_and_viewers_get_coalesced_updates(self):
+        viewer, device = LiveSocket(self.ticket('ann')), LiveSocket(self.ticket('bob'))
+        self.assertEqual((await viewer.connect())['type'], 'websocket.accept')
+        self.assertEqual((await device.connect())['type'], 'websocket.accept')
+        try:
+            await viewer.send({'type': 'subscribe', 'group': 'red'})
+            initial = await viewer.receive()
+            self.assertEqual(initial['type'], 'updates')
+            self.assertEqual(sorted(row['username'] for row in initial['positions']), ['ann', 'bob'])
+
+            # No longitude
+            await device.send({'type': 'fix', 'ref': 7, 'latitude': 22.5})
+            reply = await device.receive()
+            self.assertEqual((reply['type'], reply['ref']), ('error', 7))
+            await device.send({'type': 'fixes', 'ref': 8, 'points': [
+                {'latitude': 22.4, 'longitude': 114.2}, {'latitude': 22.41, 'longitude': 114.2}]})
+            self.assertEqual(await device.receive(), {'type': 'ack', 'created': 2, 'dropped': 0, 'duplicates': 0, 'ref': 8})
+
+            update = await viewer.receive()
+            self.assertEqual([(row['username'], row['latitude']) for row in update['positions']], [('bob', 22.41)])
+            self.assertGreaterEqual(int(update['cursor']), int(initial['cursor']))
+        finally:
+            await viewer.close()
+            await device.close()
+        self.assertEqual(len(get_broker()), 0)
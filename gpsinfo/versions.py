@@ -0,0 +1,79 @@
+# gpsinfo/versions.py
+"""
+Monotonic version counters for the scopes latest positions are read in: the
+whole fleet, one user group and one user. Every committed GPSLatest change
+bumps the scopes it belongs to (see signals.py), so readers can tell whether
+anything moved, and build ETags and cache keys, without querying the
+database at all.
+
+Counters live in the shared cache tier (rbackend/cache.py), whose incr() is
+atomic on every backend settings.py allows with several workers, and bumps
+run after the change commits: a reader may label the new data with the old
+version for a moment, which the bump then moves past, but never the other
+way round.
+
+Only writers create counters, starting from the current time in
+microseconds so a counter lost to eviction never repeats a version handed
+out before. A scope without one, or a request naming more scopes than
+MAX_SCOPES or a scope longer than MAX_SCOPE_CHARS, has no version (None):
+its readers get no validator and no snapshot, just a fresh answer.
+"""
+import time
+from urllib.parse import quote
+
+from django.core.cache import cache
+
+SCOPE_ALL = 'all'
+MAX_SCOPES = 50
+MAX_SCOPE_CHARS = 200
+
+
+def group_scope(group):
+    return f"group:{quote(group, safe='')}"
+
+
+def user_scope(username):
+    return f"user:{quote(username, safe='')}"
+
+
+def _version_key(scope):
+    return f'gpsinfo:latest:version:{scope}'
+
+
+def _modified_key(scope):
+    return f'gpsinfo:latest:modified:{scope}'
+
+
+def bump(scopes):
+    """
+    Advance the version and last-modified time of each scope, and return
+    {scope: new version}.
+    """
+    now = time.time()
+    versions = {}
+    for scope in scopes:
+        try:
+            versions[scope] = cache.incr(_version_key(scope))
+        except ValueError:
+            if cache.add(_version_key(scope), int(now * 1e6), timeout=None):
+                versions[scope] = int(now * 1e6)
+            else:
+                # Created by a concurrent bump meanwhile
+                versions[scope] = cache.incr(_version_key(scope))
+    cache.set_many({_modified_key(scope): now for scope in scopes}, timeout=None)
+    return versions
+
+
+def stamp(scopes):
+    """
+    Return ([version or None per scope], last_modified) for ``scopes``,
+    where last_modified is the newest change time among them in epoch
+    seconds. Never writes.
+    """
+    now = time.time()
+    if len(scopes) > MAX_SCOPES or any(len(scope) > MAX_SCOPE_CHARS for scope in scopes):
+        return [None] * len(scopes), now
+    keys = [_version_key(scope) for scope in scopes] + [_modified_key(scope) for scope in scopes]
+    values = cache.get_many(keys)
+    versions = [values.get(_version_key(scope)) for scope in scopes]
+    return versions, max(values.get(_modified_key(scope), now) for scope in scopes)
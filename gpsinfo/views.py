@@ -1,60 +1,503 @@
 # gpsinfo/views.py
+import hashlib
+import math
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, Throttled, ValidationError
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.conf import settings
-from .models import GPSLocation, GPSLatest
-from .serializers import GPSLocationSerializer, GPSLatestSerializer
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from .buffer import BufferFull, FlushFailed
+from .changes import latest_changes, parse_cursor, scope_querysets
+from .conf import gps_setting
+from .decimation import get_decimator
+from .export import FORMATS, stream_export
+from .geo import haversine_m
+from .ingest import accept_locations, update_latest
+from .models import GPSLocation, GPSLatest, GPSTrackDaily, GPSTrackMinute
+from .nearby import get_latest_index
+from .pagination import KeysetPagination, time_bounds
+from .parsers import PackedGPSParser, PackedPoints
+from .polyline import DIMENSIONS, FACTORS, PolylineError, decode_track, encode_track
+from .retention import history_tiers, serialize_history, track_point
+from .serializers import (
+    GPSLocationSerializer, GPSLatestSerializer, GPSTrackDailySerializer, GPSTrackMinuteSerializer
+)
+from .snapshots import latest_snapshot
+from .spatial import bbox_q, parse_bbox
+from .stream import issue_ticket
+from .versions import SCOPE_ALL, group_scope, stamp, user_scope
+
+# Serializer for each history tier merged into my-locations
+HISTORY_SERIALIZERS = {
+    GPSLocation: GPSLocationSerializer,
+    GPSTrackMinute: GPSTrackMinuteSerializer,
+    GPSTrackDaily: GPSTrackDailySerializer,
+}
+
+class IngestUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'GPS points could not be stored, please retry.'
+    default_code = 'ingest_unavailable'
+
 
 class GPSLocationViewSet(viewsets.ModelViewSet):
     queryset = GPSLocation.objects.all()
     serializer_class = GPSLocationSerializer
     permission_classes = [IsAuthenticated]
+    # JSON for browsers, application/x-gps-packed (gpsinfo/wire.py) for devices
+    parser_classes = [JSONParser, FormParser, MultiPartParser, PackedGPSParser]
+    # Keyset pages on (timestamp, id), see gpsinfo/pagination.py
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         # Only show locations for the authenticated user
-        return GPSLocation.objects.filter(user=self.request.user)
+        queryset = GPSLocation.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            fields = self.requested_fields(GPSLocationSerializer.Meta.fields)
+            queryset = self.project(queryset.filter(time_bounds(self.request)), fields)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action == 'list':
+            kwargs['fields'] = self.requested_fields(GPSLocationSerializer.Meta.fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def requested_fields(self, allowed):
+        """
+        The ?fields=a,b,c projection as a list, or None for every field.
+        """
+        value = self.request.query_params.get('fields')
+        if not value:
+            return None
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = sorted(set(fields) - set(allowed))
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+        return fields
+
+    def project(self, queryset, fields):
+        """
+        Load only the columns a projected serializer needs, joining the user
+        only when the username is serialized.
+        """
+        serializer_fields = HISTORY_SERIALIZERS[queryset.model].Meta.fields
+        wants_user = 'username' in serializer_fields and (fields is None or 'username' in fields)
+        if wants_user:
+            queryset = queryset.select_related('user')
+        if fields is None:
+            return queryset
+        columns = {field.name for field in queryset.model._meta.concrete_fields}
+        columns &= {'id', 'timestamp'} | set(fields)
+        return queryset.only(*columns, 'user__username') if wants_user else queryset.only(*columns)
+
+    def viewport(self):
+        """
+        The ?bbox=minLon,minLat,maxLon,maxLat viewport as
+        (min_lat, min_lon, max_lat, max_lon), or None when not given.
+        """
+        value = self.request.query_params.get('bbox')
+        if not value:
+            return None
+        try:
+            return parse_bbox(value)
+        except ValueError:
+            raise ValidationError({'bbox': "Expected minLon,minLat,maxLon,maxLat in decimal degrees"})
+
+    def track_limit(self):
+        """
+        The ?limit= on points in one encoded track, at most TRACK_MAX_POINTS.
+        """
+        limit = gps_setting('TRACK_MAX_POINTS')
+        value = self.request.query_params.get('limit')
+        if value:
+            if not (value.isascii() and value.isdecimal()) or int(value) < 1:
+                raise ValidationError({'limit': "Expected a positive integer"})
+            limit = min(int(value), limit)
+        return limit
+
+    def accept(self, items):
+        """
+        Store validated points via the configured ingest mode, mapping
+        write-behind backpressure to HTTP 429 and failed flushes to HTTP 503.
+        """
+        try:
+            return accept_locations(self.request.user, items)
+        except BufferFull as exc:
+            raise Throttled(wait=1, detail=str(exc))
+        except FlushFailed as exc:
+            raise IngestUnavailable(str(exc))
+
+    def create(self, request, *args, **kwargs):
+        if isinstance(request.data, PackedPoints):
+            # Packed points are validated by the parser, so skip the serializer pass
+            if len(request.data) != 1:
+                return Response(
+                    {"error": "Expected exactly one packed point; use batch/ for more"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            serializer = self.get_serializer(self.accept_one(request.data[0]))
+            return self.created(serializer.data)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return self.created(serializer.data, self.get_success_headers(serializer.data))
+
+    def created(self, data, headers=None):
+        """
+        201 with the new point, or 200 with ``"duplicate": true`` and the
+        stored point when the request replayed an earlier device_seq.
+        """
+        if getattr(self, 'replayed', False):
+            return Response(dict(data, duplicate=True), status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def accept_one(self, point):
+        """
+        Store one point through the ingest pipeline and return its instance,
+        or the stored one it replays (setting ``self.replayed``).
+        """
+        stored, dropped = self.accept([point])
+        if stored or dropped:
+            return (stored or dropped)[0]
+        self.replayed = True
+        return GPSLocation.objects.filter(
+            user=self.request.user, device_seq=point['device_seq']
+        ).order_by('-timestamp').first()
 
     def perform_create(self, serializer):
+        if (gps_setting('INGEST_MODE') != 'direct' or gps_setting('DECIMATION_ENABLED')
+                or serializer.validated_data.get('device_seq') is not None):
+            # Ingest pipeline: decimation, write-behind/spool, and ON CONFLICT DO NOTHING for replays
+            serializer.instance = self.accept_one(serializer.validated_data)
+            return
+
         # Save the GPSLocation
         gps_location = serializer.save(user=self.request.user)
         
         # Update or create GPSLatest
-        GPSLatest.objects.update_or_create(
-            user=self.request.user,
-            defaults={
-                'latitude': gps_location.latitude,
-                'longitude': gps_location.longitude,
-                'timestamp': gps_location.timestamp,
-                'altitude': gps_location.altitude,
-                'accuracy': gps_location.accuracy,
-            }
-        )
+        update_latest(self.request.user, gps_location)
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch_create(self, request):
+        """
+        Create many GPS locations for the authenticated user in one request.
+        Accepts a JSON array of points, {"points": [...]}, a packed body, or
+        a whole track as {"polyline": "...", "device_seq_start": n}.
+        """
+        if isinstance(request.data, dict) and 'polyline' in request.data:
+            return self.track_create(request)
+
+        points = request.data.get('points') if isinstance(request.data, dict) else request.data
+        if not isinstance(points, list) or not points:
+            return Response({"error": "Expected a non-empty list of points"}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_points = gps_setting('BATCH_MAX_POINTS')
+        if len(points) > max_points:
+            return Response(
+                {"error": f"Too many points in one batch (max {max_points})"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if isinstance(points, PackedPoints):
+            validated = points
+        else:
+            # Validate item by item so errors can be reported against each point's index
+            validated, errors = [], []
+            for index, point in enumerate(points):
+                serializer = self.get_serializer(data=point)
+                if serializer.is_valid():
+                    validated.append(serializer.validated_data)
+                else:
+                    errors.append({'index': index, 'errors': serializer.errors})
+            if errors:
+                return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        stored, dropped = self.accept(validated)
+        return Response({"created": len(stored), "dropped": len(dropped),
+                         "duplicates": len(validated) - len(stored) - len(dropped)}, status=status.HTTP_201_CREATED)
+
+    def track_create(self, request):
+        """
+        Ingest an encoded-polyline track (see gpsinfo/polyline.py). When
+        device_seq_start is given, points get consecutive device_seq values so
+        a re-sent track is de-duplicated.
+        """
+        try:
+            points = decode_track(str(request.data['polyline']))
+            seq_start = request.data.get('device_seq_start')
+            if seq_start is not None:
+                seq_start = int(seq_start)
+        except (PolylineError, ValueError, TypeError) as exc:
+            return Response({"error": f"Invalid track: {exc}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_points = gps_setting('TRACK_MAX_POINTS')
+        if not points or len(points) > max_points:
+            return Response(
+                {"error": f"A track must contain between 1 and {max_points} points"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if seq_start is not None:
+            for offset, point in enumerate(points):
+                point['device_seq'] = seq_start + offset
+
+        stored, dropped = self.accept(points)
+        return Response({"created": len(stored), "dropped": len(dropped),
+                         "duplicates": len(points) - len(stored) - len(dropped)}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='ingest-stats')
+    def get_ingest_stats(self, request):
+        """
+        Stored vs. dropped point counters from this worker's decimation stage.
+        Staff users see every user cached by the worker.
+        """
+        decimator = get_decimator()
+        data = {
+            'enabled': gps_setting('DECIMATION_ENABLED'),
+            'min_distance_m': decimator.min_distance_m,
+            'min_interval_s': decimator.min_interval_s,
+            'user': decimator.stats(request.user.pk),
+        }
+        if request.user.is_staff:
+            data['users'] = decimator.stats()
+        return Response(data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'], url_path='latest')
     def get_latest_locations(self, request):
         """
-        Fetch the latest GPS location for all users.
+        Fetch the latest GPS location for all users, optionally only those
+        in user group ?group=, named in ?users=a,b, inside the
+        ?bbox=minLon,minLat,maxLon,maxLat viewport (answered from the zkey
+        index) and updated since ?since=. Everyone and whole groups are
+        served from the worker's serialized snapshot (gpsinfo/snapshots.py).
+        An integer ?since= is a change cursor instead (start with 0): only the
+        users whose position changed after it are returned, as
+        {cursor, changes, removed}, where ``removed`` lists the users that
+        left the scope (see gpsinfo/changes.py).
+        Responses carry an ETag and Last-Modified taken from the version
+        counters of the scope asked for, and a conditional request for an
+        unchanged scope gets a 304 without querying the database. A scope
+        without a counter yet (see gpsinfo/versions.py) is answered fresh.
         """
         user = request.user
         if user.is_authenticated:
+            group = request.query_params.get('group')
+            usernames = [name for name in request.query_params.get('users', '').split(',') if name]
+            box = self.viewport()
+            scopes = [group_scope(group)] if group else []
+            scopes += [user_scope(name) for name in usernames]
+            versions, last_modified = stamp(scopes or [SCOPE_ALL])
+            etag = self.latest_etag(versions)
+            if self.not_modified(etag, last_modified):
+                return self.stamped(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+            cursor = parse_cursor(request.query_params.get('since'))
+            if cursor is not None:
+                return self.stamped(Response(self.latest_delta(cursor, group, usernames, box), status=status.HTTP_200_OK),
+                                    etag, last_modified)
+
+            filtered = box is not None or usernames or any(
+                param in request.query_params for param in ('since', 'until'))
+            if not filtered:
+                body = latest_snapshot(group, versions[0])
+                if group or body != b'[]':
+                    return self.stamped(HttpResponse(body, content_type='application/json'), etag, last_modified)
+                return Response({"message": "No location data available"}, status=status.HTTP_404_NOT_FOUND)
             # Only show latest locations for the authenticated user
-            latest_locations = GPSLatest.objects.all()
-            if latest_locations.exists():
+            latest_locations = GPSLatest.objects.select_related('user').filter(time_bounds(request))
+            if group:
+                latest_locations = latest_locations.filter(user__user_group=group)
+            if usernames:
+                latest_locations = latest_locations.filter(user__username__in=usernames)
+            if box is not None:
+                latest_locations = latest_locations.in_bbox(*box)
+            latest_locations = list(latest_locations)
+            if latest_locations or filtered:
+                # An empty viewport is a normal answer for a map client, not a missing resource
                 serializer = GPSLatestSerializer(latest_locations, many=True)
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                return self.stamped(Response(serializer.data, status=status.HTTP_200_OK), etag, last_modified)
             return Response({"message": "No location data available"}, status=status.HTTP_404_NOT_FOUND)
         return Response({"error": "User not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
 
+    def latest_delta(self, cursor, group, usernames, box):
+        """
+        The change feed for latest/?since=<cursor> in the requested scope.
+        """
+        latest, tombstones = scope_querysets(group, usernames)
+        changes, removed, next_cursor = latest_changes(latest, tombstones, cursor, box)
+        return {
+            'cursor': str(next_cursor),
+            'changes': GPSLatestSerializer(changes, many=True).data,
+            'removed': removed,
+        }
+
+    @action(detail=False, methods=['get'], url_path=r'group/(?P<group>[^/.]+)')
+    def get_group_latest(self, request, group=None):
+        """
+        Fetch the latest GPS location of every member of a user group, served
+        from the worker's serialized snapshot (see gpsinfo/snapshots.py), with
+        the same conditional GET support as latest/.
+        """
+        versions, last_modified = stamp([group_scope(group)])
+        etag = self.latest_etag(versions)
+        if self.not_modified(etag, last_modified):
+            return self.stamped(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+        return self.stamped(HttpResponse(latest_snapshot(group, versions[0]), content_type='application/json'),
+                            etag, last_modified)
+
+    def latest_etag(self, versions):
+        """
+        Strong ETag for the scope versions, bound to the full query string so
+        it is never valid for a differently filtered response; None when a
+        scope has no version.
+        """
+        if None in versions:
+            return None
+        digest = hashlib.sha1(f"{self.request.get_full_path()}|{versions}".encode()).hexdigest()[:20]
+        return f'"{digest}"'
+
+    def not_modified(self, etag, last_modified):
+        """
+        Whether the request's If-None-Match (or, without one,
+        If-Modified-Since) shows the client already has this version.
+        """
+        if etag is None:
+            return False
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match:
+            return if_none_match.strip() == '*' or etag in parse_etags(if_none_match)
+        since = parse_http_date_safe(self.request.headers.get('If-Modified-Since') or '')
+        return since is not None and int(last_modified) <= since
+
+    def stamped(self, response, etag, last_modified):
+        if etag is not None:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        # Clients must revalidate each poll, which is what makes it cheap
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Stream the authenticated user's raw GPS history as a file download:
+        ?type=geojson (default), gpx or csv, bounded by ?since= and ?until=,
+        gzipped on the fly with ?gzip=1. Rows are read in chunks from a
+        server-side cursor, so memory use does not grow with the export.
+        """
+        fmt = request.query_params.get('type', 'geojson')
+        if fmt not in FORMATS:
+            return Response(
+                {"error": f"Unknown export type, expected one of: {', '.join(FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        queryset = GPSLocation.objects.filter(user=request.user).filter(time_bounds(request))
+        content_type, extension = FORMATS[fmt]
+        filename = f"gps-{request.user.username}.{extension}"
+        if compress:
+            content_type, filename = 'application/gzip', filename + '.gz'
+        response = StreamingHttpResponse(
+            stream_export(queryset, fmt, compress=compress, chunk_size=gps_setting('EXPORT_CHUNK_SIZE')),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        # Let reverse proxies pass chunks through instead of buffering the whole export
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='stream-ticket')
+    def stream_ticket(self, request):
+        """
+        A single-use ticket for opening stream/ or the live tracking
+        WebSocket with ?ticket=, instead of putting the access token in
+        their URL (see gpsinfo/stream.py).
+        """
+        ttl = gps_setting('STREAM_TICKET_TTL_S')
+        return Response({"ticket": issue_ticket(request.user), "expires_in": ttl}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='nearby')
+    def get_nearby(self, request):
+        """
+        The ``limit`` users whose latest position is nearest to ?lat=&lon=,
+        within ?radius_m=, nearest first with ``distance_m``. Answered from the
+        in-memory grid of latest positions (gpsinfo/nearby.py); only the
+        matching GPSLatest rows are read from the database.
+        """
+        try:
+            lat = float(request.query_params['lat'])
+            lon = float(request.query_params['lon'])
+            radius_m = float(request.query_params.get('radius_m', gps_setting('NEARBY_DEFAULT_RADIUS_M')))
+            limit = int(request.query_params.get('limit', 20))
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "lat and lon are required; radius_m and limit must be numbers"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not all(math.isfinite(value) for value in (lat, lon, radius_m)):
+            return Response({"error": "lat, lon and radius_m must be finite numbers"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or radius_m <= 0 or limit < 1:
+            return Response({"error": "lat/lon out of range, or non-positive radius_m/limit"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        radius_m = min(radius_m, gps_setting('NEARBY_MAX_RADIUS_M'))
+        limit = min(limit, gps_setting('NEARBY_MAX_LIMIT'))
+
+        matches = get_latest_index().get().nearest(lat, lon, radius_m, limit, exclude=request.user.pk)
+        latest = GPSLatest.objects.select_related('user').in_bulk([user_id for _, user_id in matches])
+        results = []
+        for _, user_id in matches:
+            row = latest.get(user_id)
+            if row is None:
+                continue
+            data = GPSLatestSerializer(row).data
+            data['distance_m'] = round(haversine_m(lat, lon, row.latitude, row.longitude), 1)
+            results.append(data)
+        results.sort(key=lambda data: data['distance_m'])
+        return Response(results, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'], url_path='my-locations')
     def get_my_locations(self, request):
         """
-        Fetch all GPS locations for the authenticated user.
+        Fetch the authenticated user's GPS locations, newest first, one keyset
+        page at a time (?cursor=, ?page_size=), optionally bounded by ?since=
+        and ?until=, limited to the ?bbox= viewport and projected with
+        ?fields=. History that gps_retention has downsampled is merged in from
+        the minute and daily tiers; each row carries its ``resolution``.
+        With ?encoding=polyline the track is returned oldest first as one
+        encoded polyline (see gpsinfo/polyline.py) of at most ?limit= points,
+        TRACK_MAX_POINTS by default, with a ``next`` link to the rest.
         """
         user = request.user
         if user.is_authenticated:
-            locations = GPSLocation.objects.filter(user=user).order_by('-timestamp')
-            serializer = GPSLocationSerializer(locations, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            bounds = time_bounds(request)
+            box = self.viewport()
+            if box is not None:
+                # History is already confined to one user's (user, timestamp)
+                # index range, so the viewport is an exact filter on every tier
+                bounds &= bbox_q(*box, indexed=False)
+            if request.query_params.get('encoding') == 'polyline':
+                tiers = [queryset.filter(bounds) for queryset in history_tiers(user)]
+                page = self.paginator.paginate_tiers(tiers, request, page_size=self.track_limit(), newest_first=False)
+                track = [track_point(item) for item in page]
+                return Response({
+                    'encoding': 'polyline',
+                    'dimensions': DIMENSIONS,
+                    'factors': FACTORS,
+                    'count': len(track),
+                    'polyline': encode_track(track),
+                    'next': self.paginator.get_next_link(),
+                }, status=status.HTTP_200_OK)
+
+            allowed = {'resolution'}
+            for serializer_class in HISTORY_SERIALIZERS.values():
+                allowed.update(serializer_class.Meta.fields)
+            fields = self.requested_fields(allowed)
+            tiers = [self.project(queryset.filter(bounds), fields) for queryset in history_tiers(user)]
+            page = self.paginator.paginate_tiers(tiers, request)
+            return self.paginator.get_paginated_response(serialize_history(page, HISTORY_SERIALIZERS, fields))
         return Response({"error": "User not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
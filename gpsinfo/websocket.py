@@ -0,0 +1,237 @@
+# gpsinfo/websocket.py
+"""
+WebSocket channel for live tracking at /ws/gpslocations/, mounted next to
+Django in rbackend/asgi.py.
+
+A socket is authenticated once, with a single-use ?ticket= from
+stream-ticket/ (browsers cannot set headers on a WebSocket, see stream.py),
+and then carries JSON text messages both ways.
+
+Devices push fixes through the same ingest pipeline as batch/:
+    {"type": "fix", "ref": 1, "latitude": 22.3, "longitude": 114.1, ...}
+    {"type": "fixes", "ref": 2, "points": [{...}, ...]}
+and get {"type": "ack", "ref": 1, "created": 1, "dropped": 0} or
+{"type": "error", "ref": 1, "error": "..."} back.
+
+Viewers subscribe to a scope, optionally resuming from a change cursor:
+    {"type": "subscribe", "group": "red"}
+    {"type": "subscribe", "users": ["ann", "bob"], "since": "1234"}
+    {"type": "unsubscribe"}
+and get the scope's positions, then updates coalesced per user at most once
+per STREAM_FLUSH_MS, all as
+    {"type": "updates", "cursor": "1240", "positions": [{...}], "removed": ["bob"]}
+with {"type": "heartbeat"} every STREAM_HEARTBEAT_S while nothing changes.
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from rest_framework.exceptions import ValidationError
+
+from .broker import get_broker
+from .buffer import BufferFull, FlushFailed
+from .changes import parse_cursor
+from .conf import gps_setting
+from .ingest import accept_locations
+from .serializers import GPSLocationSerializer
+from .stream import get_stable_cursor, scope_state, subscription_scopes, ticket_user
+
+logger = logging.getLogger(__name__)
+
+LIVE_PATH = '/ws/gpslocations/'
+
+
+def with_live_tracking(application):
+    """
+    Wrap the Django ASGI application so WebSocket connections to LIVE_PATH
+    reach live_tracking; other WebSocket paths are refused.
+    """
+    async def router(scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await application(scope, receive, send)
+        if scope['path'] == LIVE_PATH:
+            return await live_tracking(scope, receive, send)
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+    return router
+
+
+def database(function):
+    """
+    Run a database function on the thread pool, so sockets' queries and
+    writes proceed in parallel without blocking the event loop. Each pool
+    thread keeps its connection between messages instead of reconnecting
+    per message as CONN_MAX_AGE = 0 does per request; one left unusable by
+    an error is replaced.
+    """
+    def call(*args):
+        for conn in connections.all(initialized_only=True):
+            if conn.connection is not None and conn.errors_occurred and not conn.is_usable():
+                conn.close()
+        return function(*args)
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def ingest(user, points, serializer):
+    """
+    Validate and store pushed fixes; returns the reply without its ref.
+    ``serializer`` is an unbound GPSLocationSerializer reused across messages,
+    as ListSerializer reuses its child, so its fields are only built once.
+    """
+    max_points = gps_setting('BATCH_MAX_POINTS')
+    if not isinstance(points, list) or not 0 < len(points) <= max_points:
+        return {'type': 'error', 'error': f"Expected between 1 and {max_points} points"}
+    validated, errors = [], []
+    for index, point in enumerate(points):
+        try:
+            validated.append(serializer.run_validation(point))
+        except ValidationError as exc:
+            errors.append({'index': index, 'errors': exc.detail})
+    if errors:
+        return {'type': 'error', 'error': 'Invalid points', 'errors': errors}
+    try:
+        stored, dropped = accept_locations(user, validated)
+    except BufferFull as exc:
+        return {'type': 'error', 'error': str(exc), 'retry_after': 1}
+    except FlushFailed as exc:
+        return {'type': 'error', 'error': str(exc)}
+    return {'type': 'ack', 'created': len(stored), 'dropped': len(dropped),
+            'duplicates': len(validated) - len(stored) - len(dropped)}
+
+
+def updates_message(cursor, positions, removed):
+    # positions are JSON texts already; splice them in rather than re-encode
+    return (f'{{"type":"updates","cursor":"{cursor}","positions":[{",".join(positions)}],'
+            f'"removed":{json.dumps(removed)}}}')
+
+
+class LiveConnection:
+    """
+    One authenticated socket: handles the client's messages and, while
+    subscribed, pushes updates from a task of its own.
+    """
+
+    def __init__(self, user, send):
+        self.user = user
+        self._send = send
+        self.subscription = None
+        self.pusher = None
+        self.serializer = GPSLocationSerializer()
+
+    async def send(self, text):
+        await self._send({'type': 'websocket.send', 'text': text})
+
+    async def reply(self, message, data):
+        if message.get('ref') is not None:
+            data = dict(data, ref=message['ref'])
+        await self.send(json.dumps(data))
+
+    async def handle(self, text):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            await self.send(json.dumps({'type': 'error', 'error': 'Expected a JSON object'}))
+            return
+        kind = message.get('type')
+        if kind == 'fix':
+            await self.reply(message, await database(ingest)(self.user, [message], self.serializer))
+        elif kind == 'fixes':
+            await self.reply(message, await database(ingest)(self.user, message.get('points'), self.serializer))
+        elif kind == 'subscribe':
+            await self.subscribe(message)
+        elif kind == 'unsubscribe':
+            await self.unsubscribe()
+        else:
+            await self.reply(message, {'type': 'error', 'error': f"Unknown message type: {kind!r}"})
+
+    async def subscribe(self, message):
+        group = message.get('group') or None
+        usernames = message.get('users') or []
+        since = message.get('since')
+        cursor = parse_cursor(str(since)) if since is not None else None
+        if not (group is None or isinstance(group, str)) or not isinstance(usernames, list) \
+                or not all(isinstance(name, str) for name in usernames):
+            error = "Expected a group name or a list of usernames"
+        elif group and usernames:
+            error = "Use either group or users, not both"
+        elif since is not None and cursor is None:
+            error = "Invalid cursor"
+        else:
+            error = None
+        if error:
+            await self.reply(message, {'type': 'error', 'error': error})
+            return
+        await self.unsubscribe()
+        # Subscribe before reading the initial state, so no write falls between
+        self.subscription = get_broker().subscribe(subscription_scopes(group, usernames))
+        self.pusher = asyncio.create_task(self.push(self.subscription, group, usernames, cursor))
+
+    async def unsubscribe(self):
+        if self.pusher is not None:
+            self.pusher.cancel()
+            try:
+                await self.pusher
+            except asyncio.CancelledError:
+                pass
+            self.pusher = None
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription = None
+
+    async def push(self, subscription, group, usernames, cursor):
+        try:
+            cursor, positions, removed = await database(scope_state)(group, usernames, cursor)
+            await self.send(updates_message(cursor, positions, removed))
+            while True:
+                events = await subscription.get()
+                if subscription.overflowed:
+                    # Too far behind: catch up from the database instead
+                    subscription.resynced()
+                    cursor, positions, removed = await database(scope_state)(group, usernames, cursor)
+                    await self.send(updates_message(cursor, positions, removed))
+                elif events:
+                    stable = await get_stable_cursor().get()
+                    if stable is not None and stable > cursor:
+                        cursor = stable
+                    await self.send(updates_message(
+                        cursor,
+                        [event.data for event in events if event.kind == 'position'],
+                        [event.username for event in events if event.kind == 'remove'],
+                    ))
+                else:
+                    await self.send('{"type":"heartbeat"}')
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Live updates for {self.user.username} stopped")
+            await self.send(json.dumps({'type': 'error', 'error': 'Live updates stopped; subscribe again'}))
+
+
+async def live_tracking(scope, receive, send):
+    """
+    ASGI application of one WebSocket connection.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    query = parse_qs(scope.get('query_string', b'').decode())
+    user = await database(ticket_user)(query.get('ticket', [''])[0])
+    if user is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    await send({'type': 'websocket.accept'})
+    connection = LiveConnection(user, send)
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message['type'] == 'websocket.receive':
+                await connection.handle(message.get('text') or message.get('bytes') or '')
+    finally:
+        await connection.unsubscribe()
@@ -0,0 +1,94 @@
+# gpsinfo/wire.py
+"""
+Compact binary upload format for GPS points ("application/x-gps-packed").
+
+A body is the 4-byte header b'GPK\\x01' followed by fixed-width little-endian
+records of 40 bytes each:
+
+    latitude     float64  decimal degrees
+    longitude    float64  decimal degrees
+    altitude     float32  metres, NaN when unknown
+    accuracy     float32  metres, NaN when unknown
+    captured_at  int64    device capture time, ms since the Unix epoch, INT64_MIN when unknown
+    device_seq   int64    client sequence / idempotency key, INT64_MIN when unknown
+"""
+import math
+import struct
+from datetime import datetime, timezone as dt_timezone
+
+MEDIA_TYPE = 'application/x-gps-packed'
+HEADER = b'GPK\x01'
+RECORD = struct.Struct('<ddffqq')
+MISSING = -(2 ** 63)
+
+
+class WireFormatError(ValueError):
+    """Raised when a packed body is malformed or holds an invalid point."""
+
+
+def _get(point, name):
+    return point.get(name) if isinstance(point, dict) else getattr(point, name, None)
+
+
+def _epoch_ms(value):
+    if value is None:
+        return MISSING
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+
+def _capture_time(index, epoch_ms):
+    try:
+        return datetime.fromtimestamp(epoch_ms / 1000, tz=dt_timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        raise WireFormatError(f"Point {index}: captured_at out of range")
+
+
+def encode_points(points):
+    """
+    Pack an iterable of dicts or objects with latitude/longitude/altitude/
+    accuracy/captured_at/device_seq into a packed body. ``captured_at`` may be
+    a datetime or epoch milliseconds.
+    """
+    nan = float('nan')
+    chunks = [HEADER]
+    for point in points:
+        altitude = _get(point, 'altitude')
+        accuracy = _get(point, 'accuracy')
+        device_seq = _get(point, 'device_seq')
+        chunks.append(RECORD.pack(
+            _get(point, 'latitude'),
+            _get(point, 'longitude'),
+            nan if altitude is None else altitude,
+            nan if accuracy is None else accuracy,
+            _epoch_ms(_get(point, 'captured_at')),
+            MISSING if device_seq is None else device_seq,
+        ))
+    return b''.join(chunks)
+
+
+def decode_points(data):
+    """
+    Unpack a packed body into a list of validated point dicts ready for
+    GPSLocation(**point). Raises WireFormatError on bad input.
+    """
+    if not data.startswith(HEADER):
+        raise WireFormatError("Missing GPK1 header")
+    body = memoryview(data)[len(HEADER):]
+    if len(body) % RECORD.size:
+        raise WireFormatError(f"Body length is not a multiple of {RECORD.size} bytes")
+
+    points = []
+    for index, (lat, lon, alt, acc, captured, seq) in enumerate(RECORD.iter_unpack(body)):
+        if not (-90.0 <= lat <= 90.0) or not (-180.0 <= lon <= 180.0):
+            raise WireFormatError(f"Point {index}: latitude/longitude out of range")
+        points.append({
+            'latitude': lat,
+            'longitude': lon,
+            'altitude': None if math.isnan(alt) else alt,
+            'accuracy': None if math.isnan(acc) else acc,
+            'captured_at': None if captured == MISSING else _capture_time(index, captured),
+            'device_seq': None if seq == MISSING else seq,
+        })
+    return points
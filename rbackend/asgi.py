@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rbackend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Flush any write-behind GPS points when the worker exits gracefully
+from gpsinfo.buffer import install_shutdown_hook  # noqa: E402
+# Build the nearby index in the background before the first request needs it
+from gpsinfo.nearby import get_latest_index  # noqa: E402
+# WebSocket live tracking (/ws/gpslocations/) alongside Django's HTTP views
+from gpsinfo.websocket import with_live_tracking  # noqa: E402
+
+install_shutdown_hook()
+get_latest_index().start()
+
+application = with_live_tracking(django_application)
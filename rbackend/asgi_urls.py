@@ -0,0 +1,15 @@
+"""
+URLs of requests served by the ASGI server (ASGI_URLCONF, selected by
+rbackend/middleware.py): the project's URLs, with latest/ answered by
+gpsinfo.longpoll so ?wait= requests can be parked.
+"""
+from django.urls import path
+
+from gpsinfo.longpoll import latest_long_poll
+
+from .urls import urlpatterns as project_urlpatterns
+
+urlpatterns = [
+    # Before the router, whose detail route would otherwise match it
+    path('api/gpslocations/latest/', latest_long_poll, name='gpslocation-latest-wait'),
+] + project_urlpatterns
@@ -0,0 +1,151 @@
+# rbackend/cache.py
+"""
+Read-through helpers over the shared cache tier (CACHES in settings.py), for
+the hot reads of the apps: user rows and social providers (accounts/cache.py)
+and latest-position snapshots (gpsinfo/snapshots.py).
+
+Each kind of entry counts its hits and misses. Counts are kept in the process
+and added to counters in the cache at most every STATS_FLUSH_S seconds, so
+with a shared backend ``manage.py cache_stats`` sees every worker's reads.
+
+LockedFileBasedCache is the file backend of CACHE_BACKEND = 'file': the
+stock FileBasedCache reads and then writes in add() and incr(), so workers
+incrementing the same counter lose each other's counts.
+"""
+import fcntl
+import os
+import pickle
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+
+STATS_FLUSH_S = 10
+
+_missing = object()
+
+
+class LockedFileBasedCache(FileBasedCache):
+    """
+    FileBasedCache whose add() and incr() hold an exclusive lock on the
+    cache directory, so they are atomic across the processes sharing it.
+    incr() also keeps the entry's expiry rather than resetting it to the
+    default timeout.
+    """
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self._dir, exist_ok=True)
+        # Not a *.djcache file, so culling and clear() leave it alone
+        with open(os.path.join(self._dir, 'counters.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _remaining(self, key, version):
+        try:
+            with open(self._key_to_file(key, version), 'rb') as f:
+                expiry = pickle.load(f)
+        except (FileNotFoundError, EOFError):
+            return None
+        return None if expiry is None else max(expiry - time.time(), 0.001)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._locked():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self._locked():
+            value = self.get(key, _missing, version=version)
+            if value is _missing:
+                raise ValueError(f"Key '{key}' not found")
+            self.set(key, value + delta, self._remaining(key, version), version=version)
+            return value + delta
+
+
+def _stats_key(kind, outcome):
+    return f'cache-stats:{kind}:{outcome}'
+
+
+class CacheStats:
+    """
+    Hit and miss counts per kind of entry, flushed to the cache in batches.
+    """
+
+    def __init__(self, flush_s):
+        self.flush_s = flush_s
+        self.kinds = set()
+        self._pending = Counter()
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def track(self, *kinds):
+        self.kinds.update(kinds)
+
+    def record(self, kind, hit):
+        now = time.monotonic()
+        with self._lock:
+            self._pending[kind, 'hits' if hit else 'misses'] += 1
+            due = now - self._flushed >= self.flush_s
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed = time.monotonic()
+        for (kind, outcome), count in pending.items():
+            key = _stats_key(kind, outcome)
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                if not cache.add(key, count, timeout=None):
+                    cache.incr(key, count)
+
+    def read(self):
+        """
+        {kind: {'hits': n, 'misses': n}} of every process that flushed here.
+        """
+        self.flush()
+        kinds = sorted(self.kinds)
+        values = cache.get_many([_stats_key(kind, outcome) for kind in kinds for outcome in ('hits', 'misses')])
+        return {
+            kind: {outcome: values.get(_stats_key(kind, outcome), 0) for outcome in ('hits', 'misses')}
+            for kind in kinds
+        }
+
+    def reset(self):
+        with self._lock:
+            self._pending.clear()
+        cache.delete_many([_stats_key(kind, outcome) for kind in self.kinds for outcome in ('hits', 'misses')])
+
+
+stats = CacheStats(STATS_FLUSH_S)
+
+
+def cached(kind, key, timeout, load):
+    """
+    The value cached under ``key``, else ``load()``'s, stored for ``timeout``
+    seconds. None is a value like any other, so missing rows are cached too.
+    """
+    value = cache.get(key, _missing)
+    stats.record(kind, value is not _missing)
+    if value is _missing:
+        value = load()
+        cache.set(key, value, timeout)
+    return value
+
+
+def is_shared():
+    """
+    Whether the cache tier is seen by other processes (not locmem).
+    """
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def invalidate(*keys):
+    cache.delete_many(keys)
@@ -0,0 +1,35 @@
+# rbackend/middleware.py
+"""
+Serves requests arriving through the ASGI server (rbackend/asgi.py) from
+ASGI_URLCONF, which adds the latest/?wait= long poll to the project's URLs.
+Requests through WSGI keep ROOT_URLCONF, where latest/ is the DRF action
+alone, without an async view to adapt on every request.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+
+
+class ASGIURLConfMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.urlconf = settings.ASGI_URLCONF
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.route(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self.route(request)
+        return await self.get_response(request)
+
+    def route(self, request):
+        if isinstance(request, ASGIRequest):
+            request.urlconf = self.urlconf
@@ -3,6 +3,7 @@ from pathlib import Path
 from django.contrib.messages import constants as messages
 from datetime import timedelta
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -57,6 +58,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # ASGI requests are resolved against ASGI_URLCONF
+    'rbackend.middleware.ASGIURLConfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -71,7 +74,8 @@ MIDDLEWARE = [
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWTAuthentication reading the user through the cache
+        'accounts.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -89,6 +93,58 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': False,
     'UPDATE_LAST_LOGIN': False,
 }
+
+# Cache tier shared by the workers (rbackend/cache.py). CACHE_BACKEND is
+# locmem (one process, and what tests use; the default with DEBUG on), file
+# (one host, the default with DEBUG off; CACHE_LOCATION defaults to a
+# directory in shared memory) or redis (CACHE_LOCATION a redis:// URL of any
+# server speaking the Redis protocol, such as a local redis-server or valkey;
+# needs the redis package). It also holds the version counters of latest
+# positions (gpsinfo/versions.py).
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem' if DEBUG else 'file')
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'geostar'),
+    'file': ('rbackend.cache.LockedFileBasedCache', '/dev/shm/geostar-cache'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': config('CACHE_LOCATION', default=CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'KEY_PREFIX': 'geostar',
+        # Entries set without an explicit TTL
+        'TIMEOUT': 300,
+    }
+}
+if CACHE_BACKEND != 'redis':
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=20000, cast=int)}
+
+# Worker processes of the app server (gunicorn and uvicorn read it too). A
+# locmem cache is a separate copy in each of them, which invalidations from
+# the others never reach: a user deactivated through one worker would stay
+# signed in on the rest for up to accounts.cache.USER_TTL seconds. Settings
+# cannot see a worker count given on the command line (gunicorn -w 4), so
+# with DEBUG off locmem needs WEB_CONCURRENCY=1 set to be accepted.
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=None, cast=lambda value: int(value) if value else None)
+if CACHE_BACKEND == 'locmem' and (WEB_CONCURRENCY or 1) > 1:
+    raise ImproperlyConfigured(
+        f"CACHE_BACKEND 'locmem' is per process but WEB_CONCURRENCY is {WEB_CONCURRENCY}: "
+        "use 'file' (one host) or 'redis'"
+    )
+if CACHE_BACKEND == 'locmem' and not DEBUG and WEB_CONCURRENCY is None:
+    raise ImproperlyConfigured(
+        "CACHE_BACKEND 'locmem' with DEBUG off needs WEB_CONCURRENCY=1 to confirm a single worker: "
+        "otherwise use 'file' (one host) or 'redis'"
+    )
+
+# GPS ingest configuration (defaults live in gpsinfo/conf.py)
+GPSINFO = {
+    'INGEST_MODE': config('GPS_INGEST_MODE', default='direct'),
+    'WRITE_BEHIND_ACK': config('GPS_WRITE_BEHIND_ACK', default='flush'),
+    'SPOOL_DIR': config('GPS_SPOOL_DIR', default=os.path.join(BASE_DIR, 'gps_spool')),
+    'DECIMATION_ENABLED': config('GPS_DECIMATION', default=False, cast=bool),
+}
+
 # settings.py
 
 # Frontend URL
@@ -151,6 +207,8 @@ CORS_ALLOW_CREDENTIALS = True
 CSRF_EXEMPT_URLS = ['localhost:8000/api/auth/password/reset/']
 
 ROOT_URLCONF = 'rbackend.urls'
+# Requests through rbackend/asgi.py: the same plus the latest/?wait= long poll
+ASGI_URLCONF = 'rbackend.asgi_urls'
 
 TEMPLATES = [
     {
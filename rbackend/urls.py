@@ -4,6 +4,7 @@ from django.shortcuts import redirect
 from rest_framework.routers import DefaultRouter
 from rest_framework.permissions import AllowAny  # Add this line
 from gpsinfo.views import GPSLocationViewSet
+from gpsinfo.stream import stream_latest
 from pages.views import GpsTestView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -357,6 +358,8 @@ urlpatterns = [
     path('', include('pages.urls', namespace='pages')),
     path('gpstest/', GpsTestView.as_view(), name='gpstest'),
     path('admin/', admin.site.urls),
+    # Before the router, whose detail route would otherwise match it
+    path('api/gpslocations/stream/', stream_latest, name='gpslocation-stream'),
     path('api/', include(router.urls)),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rbackend.settings')
 
 application = get_wsgi_application()
+
+# Flush any write-behind GPS points when the worker exits gracefully
+from gpsinfo.buffer import install_shutdown_hook  # noqa: E402
+# Build the nearby index in the background before the first request needs it
+from gpsinfo.nearby import get_latest_index  # noqa: E402
+
+install_shutdown_hook()
+get_latest_index().start()
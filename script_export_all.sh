@@ -1,15 +1,9 @@
-export PGPASSWORD='1234'
+# Export every application table (including gpsinfo_gpslocation) with COPY.
+# The database connection comes from the same DB_* settings (.env) as the app.
+# Usage: ./script_export_all.sh [directory]   (re-run to resume an interrupted export)
 
 echo "start export"
 
-echo "django_site"
-psql -U dbadmin -h localhost -d geoinfo_db -c "COPY (SELECT * FROM django_site) TO STDOUT WITH CSV HEADER" > output_file_django_site.csv;
+python manage.py dbcopy export "${1:-dbcopy_export}" --compress --jobs 4
 
-echo "socialaccount_socialapp"
-psql -U dbadmin -h localhost -d geoinfo_db -c "COPY (SELECT * FROM socialaccount_socialapp) TO STDOUT WITH CSV HEADER" > output_file_socialaccount_socialapp.csv;
-
-echo "socialaccount_socialapp_sites"
-psql -U dbadmin -h localhost -d geoinfo_db -c "COPY (SELECT * FROM socialaccount_socialapp_sites) TO STDOUT WITH CSV HEADER" > output_file_socialaccount_socialapp_sites.csv;
-
-
-echo "completed"
\ No newline at end of file
+echo "completed"
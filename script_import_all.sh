@@ -1,29 +1,10 @@
-export PGPASSWORD='1234'
-
-# In zsh chmod +x script_import.sh and run ./script_import.sh
-
-# the code -c "TRUNCATE shop2_coursesession;" will delete all records 
-# in the table before importing
-
+# Import a directory written by script_export_all.sh into the database named
+# by the DB_* settings (.env). Run "python manage.py migrate" on it first.
+# The first run empties the copied tables before loading them.
+# Usage: ./script_import_all.sh [directory]   (re-run to resume an interrupted import)
 
 echo "Start import"
 
-# Truncate tables with CASCADE
-echo "Truncating tables..."
-psql -U dbadmin -h localhost -d geoinfo_db -c "TRUNCATE TABLE socialaccount_socialapp_sites CASCADE;"
-psql -U dbadmin -h localhost -d geoinfo_db -c "TRUNCATE TABLE django_site CASCADE;"
-psql -U dbadmin -h localhost -d geoinfo_db -c "TRUNCATE TABLE socialaccount_socialapp CASCADE;"
-
-# Importing data
-
-echo "Importing data into django_site"
-psql -U dbadmin -h localhost -d geoinfo_db -c "\COPY django_site FROM 'output_file_django_site.csv' WITH (FORMAT csv, HEADER);"
-
-echo "Importing data into socialaccount_socialapp"
-psql -U dbadmin -h localhost -d geoinfo_db -c "\COPY socialaccount_socialapp FROM 'output_file_socialaccount_socialapp.csv' WITH (FORMAT csv, HEADER);"
-
-echo "Importing data into socialaccount_socialapp_sites"
-psql -U dbadmin -h localhost -d geoinfo_db -c "\COPY socialaccount_socialapp_sites FROM 'output_file_socialaccount_socialapp_sites.csv' WITH (FORMAT csv, HEADER);"
-
+python manage.py dbcopy import "${1:-dbcopy_export}" --jobs 4
 
-echo "Import completed."
\ No newline at end of file
+echo "Import completed."